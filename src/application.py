@@ -1,43 +1,215 @@
 """
 This file contains the code to run a small demo-application using Streamlit. How to launch the
-application is described in the README.md.
+application is described in the README.md. Several tables can be served at once, one camera per table: all cameras
+share the model, which runs their frames in batches (see batched_inference.py). The detection engine of a camera only
+runs while a session shows the camera: it pauses when nobody reads its frames and is stopped by the next rerun after that.
+Sessions with other detection or preview settings get their own engine of the camera, the game of the table is shared.
 """
+
 import os
-from ultralytics import YOLO
-from ultralytics.utils.plotting import Annotator
+import time
+import threading
 import streamlit as st
-import requests
-import cv2 as cv
-import numpy as np
-import jass_rules as jass
 import download_best_model as dbm
+import model_store
+import model_export
+import metrics
+from batched_inference import BatchedModel
+from camera_capture import FrameGrabber
+from detection_engine import DetectionEngine, GameState
+from motion_gate import MotionGate
+from preview_renderer import PreviewRenderer
+from table_roi import TableRoi
+from typing import Dict, Tuple
+
+# seconds without a session showing the frames of a detection engine, until it pauses
+ENGINE_IDLE_TIMEOUT = 5.0
+
 
+def get_loaded_model() -> model_store.LoadedModel:
+    """
+    Return the model shared by all sessions and reruns, kept by the model store of the process (see model_store.py).
+    It is loaded and warmed up in the background on the first call. The inference backend and the model are configured
+    with environment variables (see model_export.py).
+    """
+    MODEL_PATH = os.environ.get(model_export.MODEL_VARIABLE) or dbm.get_model()
+    return model_store.get_loaded_model(
+        model_export.get_configured_model_path(MODEL_PATH), background=True
+    )
 
-game_running = False
-before_detected_cards = list()
-currently_detected_cards = set()
-already_played_cards = set()
-current_play = list()
-beginning_player = 0
 
+loaded_model = get_loaded_model()
 
-MODEL_PATH = dbm.get_model()
-model = YOLO(MODEL_PATH)
 
+def is_game_running() -> bool:
+    """
+    Return a bool that indicates if a game is running at any table.
+    """
+    return any(
+        value
+        for key, value in st.session_state.items()
+        if key.startswith("input_disabled_")
+    )
 
-def start_game() -> None:
-    st.session_state.input_disabled = True
+
+def start_game(table_index: int) -> None:
+    st.session_state[f"input_disabled_{table_index}"] = True
     st.session_state.camera_turned_on = True
 
 
-def reset_game() -> None:
-    st.session_state.input_disabled = False
-    st.session_state.camera_turned_on = False
+def reset_game(table_index: int) -> None:
+    st.session_state[f"input_disabled_{table_index}"] = False
+    st.session_state.camera_turned_on = is_game_running()
+
+
+@st.cache_resource
+def get_batched_model() -> BatchedModel:
+    """
+    Return the model shared by the detection engines of all tables, running their frames in batches.
+    Exported models have a fixed batch size of one, so only the PyTorch model runs several frames at once.
+    """
+    if os.environ.get(model_export.BACKEND_VARIABLE, "pytorch") == "pytorch":
+        return BatchedModel(loaded_model.wait())
+    return BatchedModel(loaded_model.wait(), max_batch_size=1)
+
+
+@st.cache_resource
+def get_game_state(camera_address: str) -> GameState:
+    """
+    Return the game of the table of the camera, kept across the reruns of this script, also while the camera is not shown.
+    """
+    return GameState()
+
+
+@st.cache_resource
+def get_detection_engines() -> Tuple[Dict[Tuple, DetectionEngine], threading.Lock]:
+    """
+    Return the running detection engines of all sessions by camera address and settings, and the lock to change them.
+    """
+    return dict(), threading.Lock()
+
+
+def get_detection_engine(
+    camera_address: str, crop_to_table: bool, preview_fps: int, preview_size: int
+) -> DetectionEngine:
+    """
+    Return the detection engine of the camera with the given settings, started on the first call and kept running
+    across the reruns of this script while it is shown. The settings are fixed per engine, so sessions with other
+    settings do not change them for each other. The model only runs on frames in which the table changed.
+    """
+    key = (camera_address, crop_to_table, preview_fps, preview_size)
+    detection_engines, lock = get_detection_engines()
+    with lock:
+        if key not in detection_engines:
+            detection_engines[key] = DetectionEngine(
+                FrameGrabber(camera_address),
+                get_batched_model(),
+                get_game_state(camera_address),
+                motion_gate=MotionGate(),
+                table_roi=get_table_roi() if crop_to_table else None,
+                preview_renderer=PreviewRenderer(preview_fps, preview_size),
+                metric_labels={"camera": camera_address},
+                idle_timeout=ENGINE_IDLE_TIMEOUT,
+            ).start()
+        return detection_engines[key]
+
+
+def stop_idle_detection_engines() -> None:
+    """
+    Stop and remove the detection engines no session showed within the idle timeout, e.g. of unchecked cameras,
+    changed addresses or removed tables.
+    """
+    detection_engines, lock = get_detection_engines()
+    with lock:
+        for key, detection_engine in list(detection_engines.items()):
+            if detection_engine.is_idle():
+                detection_engine.stop()
+                del detection_engines[key]
+
+
+@st.cache_resource
+def start_metrics_export() -> None:
+    """
+    Export the metrics of the process once, as configured by environment variables (see metrics.py).
+    """
+    if os.environ.get(metrics.PORT_VARIABLE):
+        metrics.start_http_server(int(os.environ[metrics.PORT_VARIABLE]))
+    if os.environ.get(metrics.LOG_VARIABLE):
+        metrics.start_jsonl_log(os.environ[metrics.LOG_VARIABLE])
+
+
+start_metrics_export()
+
+
+def get_table_roi() -> TableRoi:
+    """
+    Return a table ROI inferred from the detections. Exported models have a fixed input size, so only the PyTorch
+    model adapts its resolution.
+    """
+    if os.environ.get(model_export.BACKEND_VARIABLE, "pytorch") == "pytorch":
+        return TableRoi()
+    return TableRoi(image_sizes=(640,))
+
+
+def show_table(table_index: int, camera_address: str) -> Dict:
+    """
+    Create the game settings, scores and camera image of a table. Returns the elements updated while the camera is shown.
+    """
+    input_disabled = st.session_state.get(f"input_disabled_{table_index}", False)
+    trump_input = st.selectbox(
+        "Trump in this round:",
+        ("Schelle", "Herz", "Eichel", "Laub"),
+        disabled=input_disabled,
+        key=f"trump_{table_index}",
+    )
+    trump = trump_input.lower()[0]
+    number_of_players = st.number_input(
+        "Number of players:",
+        2,
+        6,
+        step=1,
+        disabled=input_disabled,
+        key=f"number_of_players_{table_index}",
+    )
+    placeholder = st.empty()
+    players_dict = dict([(f"Player {i+1}", 0) for i in range(number_of_players)])
+    placeholder.dataframe(players_dict)
+
+    if st.button(
+        "Start Game!",
+        disabled=input_disabled,
+        on_click=start_game,
+        args=(table_index,),
+        key=f"start_{table_index}",
+    ):
+        print(f"Game started at table {table_index + 1}!")
+        print(f"Trump: {trump_input}")
+        get_game_state(camera_address).start(number_of_players, trump)
+
+    live_video = st.image([])
+    frame_rate = st.empty()
+
+    if st.button(
+        "Reset Game",
+        disabled=not input_disabled,
+        on_click=reset_game,
+        args=(table_index,),
+        key=f"reset_{table_index}",
+    ):
+        print(f"Game reset at table {table_index + 1}!")
+        get_game_state(camera_address).reset()
+
+    return {
+        "placeholder": placeholder,
+        "live_video": live_video,
+        "frame_rate": frame_rate,
+        "shown_scores": players_dict,
+        "shown_winner": None,
+    }
 
 
 # set session_states to later disable inputs/camera on certain events
-if "input_disabled" not in st.session_state:
-    st.session_state.input_disabled = False
+if "camera_turned_on" not in st.session_state:
     st.session_state.camera_turned_on = False
 
 
@@ -50,115 +222,118 @@ st.header("Connect and Activate Camera")
 st.write(
     'To connect the camera, download the [IP-Webcam](https://play.google.com/store/apps/details?id=com.pas.webcam) \
          App on your phone, scroll to the bottom and tap "Start Server". Enter the IPv4 in the corresponding field below. \
-         An example of what the format should be is already given in the text field.'
+         An example of what the format should be is already given in the text field. To keep the score of several \
+         tables, enter the address of every camera on its own line.'
 )
 
-camera_url_input = st.text_input(
-    "Address displayed in IP Webcam:",
+camera_urls_input = st.text_area(
+    "Addresses displayed in IP Webcam (one per table):",
     "http://192.168.178.39:8080",
-    disabled=st.session_state.input_disabled,
+    disabled=is_game_running(),
 )
-camera_url = camera_url_input + "/shot.jpg"
+camera_addresses = [
+    address.strip() for address in camera_urls_input.splitlines() if address.strip()
+]
 show_camera = st.checkbox(
     "Show camera:",
     value=st.session_state.camera_turned_on,
-    disabled=st.session_state.input_disabled,
-)
-
-st.header("Specify game settings")
-trump_input = st.selectbox(
-    "Trump in this round:",
-    ("Schelle", "Herz", "Eichel", "Laub"),
-    disabled=st.session_state.input_disabled,
+    disabled=is_game_running(),
 )
-trump = trump_input.lower()[0]
-number_of_players = st.number_input(
-    "Number of players:", 2, 6, step=1, disabled=st.session_state.input_disabled
+crop_to_table = st.checkbox(
+    "Only detect cards in the region of the table:",
+    value=False,
+    help="Crops the frames to the region of the recently detected cards and lowers the resolution of the detection while it stays confident.",
 )
-placeholder = st.empty()
-players_dict = dict([(f"Player {i+1}", 0) for i in range(number_of_players)])
-placeholder.dataframe(players_dict)
 
-if st.button(
-    "Start Game!", disabled=st.session_state.input_disabled, on_click=start_game
+st.header("Specify game settings")
+if len(camera_addresses) > 1:
+    table_containers = st.tabs(
+        [f"Table {table_index + 1}" for table_index in range(len(camera_addresses))]
+    )
+else:
+    table_containers = [st.container()]
+table_views = list()
+for table_index, (table_container, camera_address) in enumerate(
+    zip(table_containers, camera_addresses)
 ):
-    print("Game started!")
-    print(f"Trump: {trump_input}")
-    game_running = True
+    with table_container:
+        table_views.append(show_table(table_index, camera_address))
 
-live_video = st.image([])
 
-if st.button(
-    "Reset Game", disabled=not st.session_state.input_disabled, on_click=reset_game
-):
-    print("Game reset!")
-    game_running = False
-    before_detected_cards = list()
-    currently_detected_cards = set()
-    already_played_cards = set()
-    current_play = list()
-    beginning_player = 0
-
-
-# loop showing detected playing cards
-while show_camera:
-    img_from_server = requests.get(camera_url)
-    img_array = np.array(bytearray(img_from_server.content), dtype=np.uint8)
-    img = cv.imdecode(img_array, -1)
-    # detect cards using YOLO
-    result = model(source=img, conf=0.7, verbose=False)[0]
-    # do score calculations when game is going on
-    if game_running:
-        currently_detected_cards = set()
-        for card_class in result.boxes.cls:
-            card = model.names[int(card_class)]
-            currently_detected_cards.add(card)
-            # if card was detected consecutively for n frames and was not registered before, count as played card
-            if (all((card in frame) for frame in before_detected_cards)) and (
-                card not in already_played_cards
+# show if the model is ready and what loading it cost
+with st.sidebar:
+    st.header("Model")
+    if not loaded_model.ready.is_set():
+        with st.spinner("Loading and warming up the model..."):
+            loaded_model.ready.wait()
+    if loaded_model.error is not None:
+        st.error(f"The model could not be loaded: {loaded_model.error}")
+    else:
+        model_statistics = loaded_model.get_statistics()
+        st.write(
+            f"Ready, loaded in {model_statistics['load_seconds']:.1f} s "
+            f"(warm-up {model_statistics['warmup_seconds']:.1f} s)."
+        )
+        st.write(f"Process memory: {model_store.get_rss_mb():.0f} MB")
+        st.write(f"Backend: {os.environ.get(model_export.BACKEND_VARIABLE, 'pytorch')}")
+
+
+# the preview is sent to the browser as JPEG, limited in frame rate and size to keep up on slow networks
+with st.sidebar:
+    st.header("Preview")
+    preview_fps = st.slider("Maximum frames per second:", 1, 30, 10)
+    preview_size = st.select_slider(
+        "Maximum size in pixels:", (320, 480, 640, 960, 1280), 640
+    )
+
+
+# latency of every stage of the live loop and counters, updated while the camera is shown
+with st.sidebar:
+    st.header("Latency")
+    metrics_panel = st.empty()
+    metrics_panel.dataframe(metrics.get_stage_table())
+shown_metrics_time = time.perf_counter()
+
+
+# loop showing detected playing cards of every table, detection and score keeping run in the background (see detection_engine.py)
+stop_idle_detection_engines()
+if show_camera:
+    for table_view, camera_address in zip(table_views, camera_addresses):
+        detection_engine = get_detection_engine(
+            camera_address, crop_to_table, preview_fps, preview_size
+        )
+        table_view["detection_engine"] = detection_engine
+        table_view["camera_address"] = camera_address
+        table_view["subscription"] = detection_engine.subscribe()
+while show_camera and table_views:
+    for table_container, table_view in zip(table_containers, table_views):
+        frame = table_view["subscription"].get(timeout=0.05)
+        if frame is None:
+            continue
+        detection_engine = table_view["detection_engine"]
+        if detection_engine.game_state.running and (
+            frame.scores != table_view["shown_scores"]
+        ):
+            table_view["placeholder"].dataframe(frame.scores)
+            table_view["shown_scores"] = frame.scores
+        # when last round was played, display winner
+        if (frame.winner is not None) and (frame.winner != table_view["shown_winner"]):
+            table_view["placeholder"].dataframe(frame.scores)
+            table_container.warning(f"{frame.winner} wins!")
+            table_view["shown_winner"] = frame.winner
+        if frame.preview_image is not None:
+            with metrics.registry.timed(
+                "stage_seconds",
+                stage="preview_push",
+                camera=table_view["camera_address"],
             ):
-                already_played_cards.add(card)
-                current_play.append(card)
-                if len(current_play) == number_of_players:
-                    print(
-                        f"Cards from current play (starting with player {beginning_player + 1}): {current_play}"
-                    )
-                    players_dict, beginning_player = jass.add_points_from_play(
-                        players_dict,
-                        beginning_player,
-                        current_play,
-                        trump,
-                        len(already_played_cards),
-                        number_of_players,
-                    )
-                    placeholder.dataframe(players_dict)
-                    current_play = list()
-
-                    # when last round was played, display winner and end game
-                    if (36 - len(already_played_cards)) < number_of_players:
-                        st.warning(f"{max(players_dict, key = players_dict.get)} wins!")
-                        game_running = False
-
-        # keep track of the detected cards in the last 3 frames
-        if len(before_detected_cards) > 3:
-            del before_detected_cards[0]
-        before_detected_cards.append(currently_detected_cards)
-
-    # due to visualizing with Streamlit, output image of model cannot be used and bounding boxes need to be added manually
-    color_list = [
-        (87, 139, 46),
-        (128, 0, 0),
-        (226, 43, 138),
-        (143, 143, 188),
-        (30, 105, 210),
-        (222, 196, 176),
-    ]
-    annotator = Annotator(img)
-    for i, label in enumerate(result.boxes.data):
-        annotator.box_label(
-            label[0:4],
-            f"{result.names[label[-1].item()]} {round(label[-2].item(), 2)}",
-            color_list[i % len(color_list)],
+                table_view["live_video"].image(frame.preview_image)
+        table_view["frame_rate"].caption(
+            f"Detection: {detection_engine.get_fps():.1f} frames per second"
         )
-    img = cv.cvtColor(annotator.im, cv.COLOR_BGR2RGB)
-    live_video.image(img)
+    if time.perf_counter() - shown_metrics_time > 2.0:
+        with metrics_panel.container():
+            st.dataframe(metrics.get_stage_table())
+            st.dataframe(metrics.get_stage_table(name="frame_interval_seconds"))
+            st.dataframe(metrics.get_counter_table())
+        shown_metrics_time = time.perf_counter()
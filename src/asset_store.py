@@ -0,0 +1,179 @@
+"""
+This file contains the asset store used during the dataset generation.
+Instead of searching the input folders and decoding the images again for every generated image,
+the store is built once per run: it keeps an index of the usable image paths, the decoded playing cards
+and the backgrounds already resized to the YOLO input size.
+The resized backgrounds are saved as a memory-mapped .npy stack, which is shared by the processes of
+the generation pool without copying it. For very large background sets a bounded LRU cache is used instead.
+"""
+
+import cv2 as cv
+from pathlib import Path
+import os
+import tempfile
+import numpy as np
+import photo_preparation_functions as ppf
+from functools import lru_cache
+from tqdm import tqdm
+from typing import Tuple, List
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+BACKGROUND_SIZE = 640  # common YOLO input size
+
+
+def get_image_paths(DIR: str, recursive: bool = False) -> List[str]:
+    """
+    Return the sorted paths of all image files in the directory.
+    """
+    pattern = "**/*.*" if recursive else "*.*"
+    return sorted(
+        str(path)
+        for path in Path(DIR).glob(pattern)
+        if path.suffix.lower() in IMAGE_EXTENSIONS
+    )
+
+
+def get_image_name(image_path: str) -> str:
+    """
+    Return the name of an image without folder and extension.
+    """
+    return image_path.split("/")[-1].split(".")[0]
+
+
+def load_background(background_path: str):
+    """
+    Return the resized background, or None if the file can not be read as image.
+    """
+    background = cv.imread(background_path)
+    if background is None:
+        return None
+    return cv.resize(background, (BACKGROUND_SIZE, BACKGROUND_SIZE))
+
+
+class AssetStore:
+    """
+    Backgrounds and playing cards needed to generate the images of a dataset.
+    """
+
+    def __init__(
+        self,
+        BACKGROUNDS_DIR: str,
+        PLAYING_CARDS_DIR: str,
+        max_stacked_backgrounds: int = 2048,
+        background_cache_size: int = 256,
+    ) -> None:
+        self.card_paths = get_image_paths(PLAYING_CARDS_DIR)
+        self.card_names = [get_image_name(path) for path in self.card_paths]
+        self.cards, self.card_masks = zip(
+            *[ppf.load_card(path) for path in self.card_paths]
+        )
+
+        self.background_paths = get_image_paths(BACKGROUNDS_DIR, recursive=True)
+        self.background_cache_size = background_cache_size
+        self.backgrounds_stack_path = None
+        self.unreadable_backgrounds = set()
+        if len(self.background_paths) <= max_stacked_backgrounds:
+            self._stack_backgrounds()
+        self._open_backgrounds()
+
+    def _stack_backgrounds(self) -> None:
+        """
+        Decode and resize all backgrounds once and save them as .npy stack, in the order of the index.
+        Unreadable files keep their empty slot and are marked as unreadable.
+        """
+        file_descriptor, self.backgrounds_stack_path = tempfile.mkstemp(
+            prefix="backgrounds_", suffix=".npy"
+        )
+        os.close(file_descriptor)
+        try:
+            stack = np.lib.format.open_memmap(
+                self.backgrounds_stack_path,
+                mode="w+",
+                dtype=np.uint8,
+                shape=(len(self.background_paths), BACKGROUND_SIZE, BACKGROUND_SIZE, 3),
+            )
+            print(f"Preloading {len(self.background_paths)} backgrounds...")
+            for background_index, background_path in enumerate(
+                tqdm(self.background_paths)
+            ):
+                background = load_background(background_path)
+                if background is None:
+                    self.unreadable_backgrounds.add(background_index)
+                else:
+                    stack[background_index] = background
+            stack.flush()
+            del stack
+            if len(self.unreadable_backgrounds) == len(self.background_paths):
+                raise ValueError("None of the backgrounds can be read as image.")
+        except BaseException:
+            os.remove(self.backgrounds_stack_path)
+            self.backgrounds_stack_path = None
+            raise
+
+    def _open_backgrounds(self) -> None:
+        """
+        Open the background stack in read-only mode, or create the LRU cache if there is no stack.
+        """
+        if self.backgrounds_stack_path is not None:
+            self.backgrounds = np.load(self.backgrounds_stack_path, mmap_mode="r")
+        else:
+            self.backgrounds = None
+            self._load_background = lru_cache(maxsize=self.background_cache_size)(
+                load_background
+            )
+
+    def __getstate__(self) -> dict:
+        # only pass the path of the stack to other processes, they open their own memory map
+        state = self.__dict__.copy()
+        state.pop("backgrounds", None)
+        state.pop("_load_background", None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._open_backgrounds()
+
+    def _get_background(self, background_index: int):
+        """
+        Return a copy of the resized background, or None if the file can not be read as image.
+        """
+        if self.backgrounds is not None:
+            return np.array(self.backgrounds[background_index])
+        background = self._load_background(self.background_paths[background_index])
+        return None if background is None else background.copy()
+
+    def select_background(self, rng):
+        """
+        Returns a randomly sampled, resized background. Both the stack and the LRU cache draw the same indices,
+        so the same rng gives the same background in either mode.
+        """
+        background = None
+        while background is None:
+            if len(self.unreadable_backgrounds) == len(self.background_paths):
+                raise ValueError("None of the backgrounds can be read as image.")
+            background_index = rng.randrange(len(self.background_paths))
+            if background_index in self.unreadable_backgrounds:
+                continue
+            background = self._get_background(background_index)
+            if background is None:
+                self.unreadable_backgrounds.add(background_index)
+        return background
+
+    def select_cards(self, number_of_cards: int, rng) -> Tuple[List, List, List]:
+        """
+        Returns a tuple containing a list with randomly selected cards, a list with their masks and a list with the according names.
+        """
+        card_indices = rng.sample(range(len(self.cards)), number_of_cards)
+        selected_cards = [self.cards[i] for i in card_indices]
+        selected_cards_masks = [self.card_masks[i] for i in card_indices]
+        selected_cards_names = [self.card_names[i] for i in card_indices]
+        return selected_cards, selected_cards_masks, selected_cards_names
+
+    def close(self) -> None:
+        """
+        Remove the background stack from the disk.
+        """
+        self.backgrounds = None
+        if self.backgrounds_stack_path is not None:
+            os.remove(self.backgrounds_stack_path)
+            self.backgrounds_stack_path = None
@@ -0,0 +1,99 @@
+"""
+This file contains the batched inference, to serve the cameras of several tables with one model in one process.
+Every table has its own detection engine (see detection_engine.py) with its own game state, but all engines share a
+batched model. It looks like a YOLO model to the engines: each call submits one frame and waits for its result.
+A single thread collects the frames submitted at the same time and runs them through the model as one batch, which
+costs a lot less than one inference per frame. This also makes sure the model is never used by two threads at once.
+"""
+
+import time
+import queue
+import threading
+from typing import Any, Dict, List
+
+
+class InferenceRequest:
+    """
+    A frame submitted to the batched model, waiting for its result.
+    """
+
+    def __init__(self, source, parameters: Dict[str, Any]) -> None:
+        self.source = source
+        self.parameters = parameters
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BatchedModel:
+    """
+    Runs the frames submitted by several threads through the model in batches, with the interface of an ultralytics YOLO model.
+    """
+
+    def __init__(self, model, max_batch_size: int = 8, max_wait: float = 0.005):
+        self.model = model
+        self.names = model.names
+        self.overrides = getattr(model, "overrides", dict())
+        self.max_batch_size = max_batch_size
+        # seconds to wait for more frames after the first frame of a batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.number_of_batches = 0
+        self.number_of_images = 0
+        threading.Thread(
+            target=self._run, name="batched_inference", daemon=True
+        ).start()
+
+    def __call__(self, source, **parameters) -> List:
+        """
+        Return the result of the model for a single image, as list like the YOLO model does.
+        """
+        request = InferenceRequest(source, parameters)
+        self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return [request.result]
+
+    def get_mean_batch_size(self) -> float:
+        """
+        Return the mean number of images per batch.
+        """
+        return self.number_of_images / max(self.number_of_batches, 1)
+
+    def _get_batch(self) -> List[InferenceRequest]:
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining_time = deadline - time.perf_counter()
+            try:
+                if remaining_time > 0:
+                    batch.append(self.requests.get(timeout=remaining_time))
+                else:
+                    batch.append(self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            # frames with different parameters (e.g. image size) cannot share a batch
+            groups = dict()
+            for request in self._get_batch():
+                key = tuple(sorted(request.parameters.items()))
+                groups.setdefault(key, list()).append(request)
+            for key, requests in groups.items():
+                try:
+                    results = self.model(
+                        source=[request.source for request in requests], **dict(key)
+                    )
+                    for request, result in zip(requests, results):
+                        request.result = result
+                    self.number_of_batches += 1
+                    self.number_of_images += len(requests)
+                except Exception as error:
+                    for request in requests:
+                        request.error = error
+                finally:
+                    for request in requests:
+                        request.done.set()
@@ -0,0 +1,748 @@
+"""
+Benchmarks for the dataset generation. The results are printed as JSON, so runs can be compared across commits.
+Execute the script in the root-directory of this project, e.g.:
+
+    python src/benchmarks.py compositing
+    python src/benchmarks.py batch_compositing --fixture synthetic
+    python src/benchmarks.py stages --fixture synthetic --images 500 --output stages.json
+    python src/benchmarks.py model --sessions 20
+    python src/benchmarks.py backends --model yolov8n.yaml --backends pytorch onnx openvino
+    python src/benchmarks.py replay --clip ./clips/table_1 --real-time
+    python src/benchmarks.py decoding
+
+The benchmarks of the dataset generation and the decoding only need the packages of the dataset generation, the
+benchmarks of the model and the detection (model, backends, replay) import the packages of the demo-application
+(ultralytics, torch, streamlit) when they run.
+"""
+
+import argparse
+import json
+import os
+import time
+import resource
+import shutil
+import subprocess
+import tempfile
+import cv2 as cv
+import numpy as np
+import dataset_generation_functions as dgf
+import photo_preparation_functions as ppf
+import card_compositing as cc
+import metrics
+from asset_store import AssetStore, get_image_paths
+from collections import defaultdict
+from frame_decoding import FrameDecoder
+from frame_recording import ReplayFrameSource, iter_clip
+from typing import Dict, List, Tuple
+
+APPLICATION_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "application.py"
+)
+CARD_NAMES = [
+    suit + value
+    for suit in ("h", "s", "e", "l")
+    for value in ("6", "7", "8", "9", "x", "u", "o", "k", "a")
+]
+
+
+def get_commit() -> str:
+    """
+    Return the hash of the current git commit, or "unknown" outside of a git repository.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def get_peak_rss_mb() -> float:
+    """
+    Return the peak resident memory of this process and its finished child processes in MB.
+    """
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_kb += resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak_rss_kb / 1024
+
+
+def create_synthetic_fixture(
+    FIXTURE_DIR: str,
+    number_of_backgrounds: int = 100,
+    number_of_photos: int = 36,
+    seed: int = 1,
+) -> Tuple[str, str]:
+    """
+    Create backgrounds and card photos to benchmark with more data than in unittest_data.
+    The photos look like the phone photos of the real dataset: a bright card on a dark table.
+    Returns a tuple containing the directories of backgrounds and photos.
+    """
+    BACKGROUNDS_DIR = FIXTURE_DIR + "/backgrounds"
+    PHOTOS_DIR = FIXTURE_DIR + "/photos"
+    if os.path.exists(FIXTURE_DIR):
+        return BACKGROUNDS_DIR, PHOTOS_DIR
+    os.makedirs(BACKGROUNDS_DIR + "/synthetic")
+    os.makedirs(PHOTOS_DIR)
+    generator = np.random.default_rng(seed)
+
+    for i in range(number_of_backgrounds):
+        # smooth random texture at a typical size of the texture dataset
+        texture = generator.integers(0, 256, (60, 80, 3), dtype=np.uint8)
+        background = cv.resize(texture, (640, 480), interpolation=cv.INTER_CUBIC)
+        cv.imwrite(f"{BACKGROUNDS_DIR}/synthetic/background_{i:04d}.jpg", background)
+
+    for i in range(number_of_photos):
+        photo = np.full((2000, 1500, 3), 40, dtype=np.uint8)
+        photo += generator.integers(0, 12, photo.shape, dtype=np.uint8)
+        cv.rectangle(photo, (350, 400), (1150, 1600), (235, 235, 235), -1)
+        color = tuple(int(c) for c in generator.integers(0, 200, 3))
+        card_name = CARD_NAMES[i % len(CARD_NAMES)]
+        cv.putText(
+            photo, card_name, (450, 1050), cv.FONT_HERSHEY_SIMPLEX, 12, color, 25
+        )
+        cv.imwrite(f"{PHOTOS_DIR}/{card_name}.jpg", photo)
+    return BACKGROUNDS_DIR, PHOTOS_DIR
+
+
+def benchmark_compositing(
+    BACKGROUNDS_DIR: str,
+    PHOTOS_DIR: str,
+    number_of_images: int = 200,
+    number_of_cards_per_image: int = 5,
+    seed: int = 1,
+) -> Dict:
+    """
+    Compare the step by step card transformation with the fused compositing engine. Returns the timings per image in milliseconds.
+    Both paths place the same cards at the same positions, only card transformation and overlay are different.
+    """
+    PLAYING_CARDS_DIR = ppf.process_photos(PHOTOS_DIR)
+    assets = AssetStore(BACKGROUNDS_DIR, PLAYING_CARDS_DIR)
+    number_of_cards_per_image = min(number_of_cards_per_image, len(assets.cards))
+    results = {
+        "number_of_images": number_of_images,
+        "number_of_cards_per_image": number_of_cards_per_image,
+    }
+    generated_images = list()
+    for fused in (False, True):
+        images = list()
+        elapsed_time = 0.0
+        for i in range(number_of_images):
+            rng = dgf.get_image_rng(seed, i)
+            background = assets.select_background(rng)
+            cards, masks, _ = assets.select_cards(number_of_cards_per_image, rng)
+            start_time = time.perf_counter()
+            image, _ = dgf.place_cards(
+                background,
+                cards,
+                list(range(number_of_cards_per_image)),
+                0.7,
+                0.2,
+                True,
+                rng,
+                masks,
+                fused,
+            )
+            elapsed_time += time.perf_counter() - start_time
+            images.append(image)
+        path_name = "fused" if fused else "step_by_step"
+        results[path_name + "_ms_per_image"] = 1000 * elapsed_time / number_of_images
+        generated_images.append(images)
+    results["speedup"] = (
+        results["step_by_step_ms_per_image"] / results["fused_ms_per_image"]
+    )
+    results["mean_absolute_pixel_difference"] = float(
+        np.mean(
+            [
+                np.abs(step_by_step.astype(np.int16) - fused.astype(np.int16)).mean()
+                for step_by_step, fused in zip(*generated_images)
+            ]
+        )
+    )
+    assets.close()
+    return results
+
+
+def composite_sprites_vectorized(images, sprite_placements: List[Tuple]):
+    """
+    Place card sprites on a batch of images like card_compositing.composite_sprites, but with masked NumPy writes.
+    The n-th sprites of all images form a layer that is written at once, so later sprites still cover earlier ones.
+    """
+    _, image_height, image_width, _ = images.shape
+    layers = defaultdict(list)
+    number_of_sprites = defaultdict(int)
+    for sprite_placement in sprite_placements:
+        image_index = sprite_placement[0]
+        layers[number_of_sprites[image_index]].append(sprite_placement)
+        number_of_sprites[image_index] += 1
+    for layer_index in sorted(layers):
+        image_indices, sprites, origins, alphas, betas = zip(*layers[layer_index])
+        origins = np.array(origins)
+        widths = np.array([sprite.shape[1] for sprite in sprites])
+        sizes = np.array([sprite.shape[0] * sprite.shape[1] for sprite in sprites])
+        pixels = np.concatenate([sprite.reshape(-1, 4) for sprite in sprites])
+        # sprite of every pixel and the position of the pixel in its sprite
+        sprite_indices = np.repeat(np.arange(len(sprites)), sizes)
+        pixel_indices = np.arange(len(pixels)) - np.repeat(
+            np.cumsum(sizes) - sizes, sizes
+        )
+        x = pixel_indices % widths[sprite_indices] + origins[sprite_indices, 0]
+        y = pixel_indices // widths[sprite_indices] + origins[sprite_indices, 1]
+        visible = (
+            (pixels[:, 3] > 0)
+            & (x >= 0)
+            & (x < image_width)
+            & (y >= 0)
+            & (y < image_height)
+        )
+        sprite_indices = sprite_indices[visible]
+        # brightness and contrast as changed by cv.convertScaleAbs
+        adjusted_pixels = np.abs(
+            pixels[visible, :3].astype(np.float32)
+            * np.float32(alphas)[sprite_indices, np.newaxis]
+            + np.float32(betas)[sprite_indices, np.newaxis]
+        )
+        images[np.array(image_indices)[sprite_indices], y[visible], x[visible]] = (
+            np.clip(np.rint(adjusted_pixels), 0, 255).astype(np.uint8)
+        )
+    return images
+
+
+def benchmark_batch_compositing(
+    BACKGROUNDS_DIR: str,
+    PHOTOS_DIR: str,
+    number_of_images: int = 200,
+    batch_size: int = 32,
+    max_number_of_cards_per_image: int = 5,
+    seed: int = 1,
+) -> Dict:
+    """
+    Compare the generation of single images with the generation of batches, and compositing the sprites of a batch
+    one by one with OpenCV (card_compositing.composite_sprites) with a vectorized NumPy masked write.
+    Returns the timings per image in milliseconds and the largest pixel difference of both compositors.
+    """
+    PLAYING_CARDS_DIR = ppf.process_photos(PHOTOS_DIR)
+    assets = AssetStore(BACKGROUNDS_DIR, PLAYING_CARDS_DIR)
+    generation_config = {
+        "assets": assets,
+        "name_to_int_dict": dict((name, i) for i, name in enumerate(assets.card_names)),
+        "max_number_of_cards_per_image": min(
+            max_number_of_cards_per_image, len(assets.cards)
+        ),
+        "min_size": 0.2,
+        "max_size": 0.5,
+        "overlapping": True,
+        "seed": seed,
+    }
+    batches = [
+        list(range(i, min(i + batch_size, number_of_images)))
+        for i in range(0, number_of_images, batch_size)
+    ]
+    results = {
+        "commit": get_commit(),
+        "number_of_images": number_of_images,
+        "batch_size": batch_size,
+    }
+
+    start_time = time.perf_counter()
+    for image_index in range(number_of_images):
+        dgf.generate_sample(generation_config, image_index)
+    results["single_image_ms_per_image"] = (
+        1000 * (time.perf_counter() - start_time) / number_of_images
+    )
+    start_time = time.perf_counter()
+    for image_indices in batches:
+        dgf.generate_batch(generation_config, image_indices)
+    results["batch_ms_per_image"] = (
+        1000 * (time.perf_counter() - start_time) / number_of_images
+    )
+
+    # only the compositing, both compositors place the same sprites on copies of the same backgrounds
+    compositing_times = defaultdict(float)
+    max_pixel_difference = 0
+    for image_indices in batches:
+        backgrounds, sprite_placements = list(), list()
+        for image_index in image_indices:
+            rng = dgf.get_image_rng(seed, image_index)
+            backgrounds.append(assets.select_background(rng))
+            cards, masks, names = assets.select_cards(
+                rng.randint(1, generation_config["max_number_of_cards_per_image"]),
+                rng,
+            )
+            # class indices as in generate_batch, so the same labels are composed as for the dataset
+            card_classes = [
+                generation_config["name_to_int_dict"][name] for name in names
+            ]
+            image_sprite_placements, _ = dgf.get_sprite_placements(
+                backgrounds[-1],
+                cards,
+                card_classes,
+                generation_config["max_size"],
+                generation_config["min_size"],
+                generation_config["overlapping"],
+                rng,
+                masks,
+            )
+            sprite_placements += [
+                (len(backgrounds) - 1, *sprite_placement)
+                for sprite_placement in image_sprite_placements
+            ]
+        backgrounds = np.stack(backgrounds)
+        images = list()
+        for compositor_name, composite in (
+            ("opencv_per_sprite", cc.composite_sprites),
+            ("numpy_masked_write", composite_sprites_vectorized),
+        ):
+            batch_images = backgrounds.copy()
+            start_time = time.perf_counter()
+            images.append(composite(batch_images, sprite_placements))
+            compositing_times[compositor_name] += time.perf_counter() - start_time
+        max_pixel_difference = max(
+            max_pixel_difference,
+            int(np.abs(images[0].astype(np.int16) - images[1]).max()),
+        )
+    for compositor_name, elapsed_time in compositing_times.items():
+        results[compositor_name + "_ms_per_image"] = (
+            1000 * elapsed_time / number_of_images
+        )
+    results["max_pixel_difference"] = max_pixel_difference
+    assets.close()
+    return results
+
+
+def get_generation_metrics() -> Tuple[Dict[str, Tuple[int, float]], Dict[str, int]]:
+    """
+    Return count and sum of the generation_seconds histogram of every stage and the value of every counter, read from
+    the metrics of this process.
+    """
+    stages = dict(
+        (dict(labels)["stage"], (histogram.count, histogram.sum))
+        for (name, labels), histogram in metrics.registry.get_histograms()
+        if name == "generation_seconds"
+    )
+    counters = dict(
+        (name, counter.value)
+        for (name, labels), counter in metrics.registry.get_counters()
+        if not labels
+    )
+    return stages, counters
+
+
+def benchmark_generation_stages(
+    BACKGROUNDS_DIR: str,
+    PHOTOS_DIR: str,
+    number_of_images: int = 200,
+    max_number_of_cards_per_image: int = 5,
+    min_size: float = 0.2,
+    max_size: float = 0.5,
+    overlapping: bool = False,
+    seed: int = 1,
+    workers: int = 1,
+) -> Dict:
+    """
+    Generate a dataset with generate_dataset and read the duration of its stages from the metrics it reports.
+    Returns the milliseconds per image of every stage, images per second of the whole generation and peak memory.
+    The stages run by the pool of processes with workers > 1 are merged into the metrics of this process as well.
+    """
+    stages_before, counters_before = get_generation_metrics()
+    OUTPUT_DIR = tempfile.mkdtemp(prefix="benchmark_dataset_")
+    start_time = time.perf_counter()
+    dgf.generate_dataset(
+        BACKGROUNDS_DIR,
+        PHOTOS_DIR,
+        OUTPUT_DIR,
+        number_of_images,
+        max_number_of_cards_per_image,
+        min_size,
+        max_size,
+        overlapping,
+        seed,
+        workers,
+    )
+    generation_time = time.perf_counter() - start_time
+    shutil.rmtree(OUTPUT_DIR)
+    stages_after, counters_after = get_generation_metrics()
+
+    stage_seconds = dict(
+        (stage, total - stages_before.get(stage, (0, 0.0))[1])
+        for stage, (_, total) in stages_after.items()
+    )
+    counters = dict(
+        (name, value - counters_before.get(name, 0))
+        for name, value in counters_after.items()
+    )
+    return {
+        "commit": get_commit(),
+        "number_of_images": number_of_images,
+        "max_number_of_cards_per_image": max_number_of_cards_per_image,
+        "overlapping": overlapping,
+        "workers": workers,
+        "stages_ms_per_image": dict(
+            (stage, 1000 * seconds / number_of_images)
+            for stage, seconds in stage_seconds.items()
+            if stage not in ("photo_processing", "asset_preloading")
+        ),
+        "setup_ms": {
+            "photo_processing": 1000 * stage_seconds.get("photo_processing", 0.0),
+            "asset_preloading": 1000 * stage_seconds.get("asset_preloading", 0.0),
+        },
+        "placement_tries": counters.get("card_placement_tries_total", 0),
+        "free_space_searches": counters.get("free_space_searches_total", 0),
+        "unplaced_cards": counters.get("unplaced_cards_total", 0),
+        "images_per_second": number_of_images / generation_time,
+        "peak_rss_mb": get_peak_rss_mb(),
+    }
+
+
+def benchmark_model_loading(
+    MODEL_PATH: str, number_of_sessions: int = 10, number_of_inferences: int = 20
+) -> Dict:
+    """
+    Measure the startup of the model and what every further session of the demo-application costs.
+    Every session is a first run of application.py in this process (streamlit.testing), as for a new browser session.
+    Returns load and warm-up time, latency of the first and of the following inferences, the time of every session and
+    the memory of the process after it.
+    """
+    import model_store
+    import model_export
+    from streamlit.testing.v1 import AppTest
+
+    loaded_model = model_store.get_loaded_model(MODEL_PATH, warmup=False)
+    model = loaded_model.wait()
+    image = np.zeros((model_store.WARMUP_IMAGE_SIZE,) * 2 + (3,), dtype=np.uint8)
+    inference_times = list()
+    for _ in range(number_of_inferences):
+        start_time = time.perf_counter()
+        model(source=image, verbose=False)
+        inference_times.append(1000 * (time.perf_counter() - start_time))
+
+    # the sessions get the model from the store, instead of loading it again
+    os.environ[model_export.MODEL_VARIABLE] = MODEL_PATH
+    rss_before_sessions_mb = model_store.get_rss_mb()
+    session_times, rss_after_sessions_mb = list(), list()
+    for _ in range(number_of_sessions):
+        start_time = time.perf_counter()
+        application = AppTest.from_file(APPLICATION_PATH, default_timeout=60).run()
+        session_times.append(1000 * (time.perf_counter() - start_time))
+        if application.exception:
+            raise RuntimeError(
+                f"The application failed: {application.exception[0].message}"
+            )
+        rss_after_sessions_mb.append(model_store.get_rss_mb())
+    if model_store.get_loaded_model(MODEL_PATH).model is not model:
+        raise RuntimeError("The sessions did not share the model of the process.")
+    return {
+        "commit": get_commit(),
+        **loaded_model.get_statistics(),
+        "model_mb": loaded_model.rss_after_mb - loaded_model.rss_before_mb,
+        "first_inference_ms": inference_times[0],
+        "warm_inference_ms": float(np.median(inference_times[1:])),
+        "number_of_sessions": number_of_sessions,
+        "first_session_ms": session_times[0],
+        "ms_per_session": float(np.median(session_times)),
+        "mb_per_session": (rss_after_sessions_mb[-1] - rss_before_sessions_mb)
+        / number_of_sessions,
+        "rss_after_sessions_mb": rss_after_sessions_mb,
+        "peak_rss_mb": get_peak_rss_mb(),
+    }
+
+
+def benchmark_backends(
+    MODEL_PATH: str,
+    DATASET_DIR: str,
+    backends: List[str] = None,
+    number_of_images: int = 100,
+) -> Dict:
+    """
+    Compare the inference backends on the test split of a generated dataset. Returns the latency of every backend and
+    the agreement of its detections with the PyTorch model (F1 score of matching boxes, see get_detection_agreement).
+    Backends that cannot be exported (e.g. missing packages) are reported with their error. By default all backends
+    are compared.
+    """
+    import model_export
+    from detection_engine import Detections
+
+    backends = backends or model_export.BACKENDS
+    image_paths = get_image_paths(DATASET_DIR + "/test/images")[:number_of_images]
+    images = [cv.imread(image_path) for image_path in image_paths]
+    results = {"commit": get_commit(), "number_of_images": len(images)}
+    reference_detections = None
+    for backend in ["pytorch"] + [b for b in backends if b != "pytorch"]:
+        try:
+            model = model_export.load_model(
+                model_export.export_model(
+                    MODEL_PATH, backend, DATASET_DIR + "/data.yaml"
+                )
+            )
+        except Exception as error:
+            results[backend] = {"error": str(error)}
+            continue
+        model(source=images[0], verbose=False)
+        inference_times, detections = list(), list()
+        for image in images:
+            start_time = time.perf_counter()
+            result = model(source=image, conf=0.7, verbose=False)[0]
+            inference_times.append(1000 * (time.perf_counter() - start_time))
+            detections.append(Detections.from_result(result))
+        if reference_detections is None:
+            reference_detections = detections
+        results[backend] = {
+            "median_ms": float(np.median(inference_times)),
+            "p90_ms": float(np.percentile(inference_times, 90)),
+            "agreement_with_pytorch": float(
+                np.mean(
+                    [
+                        model_export.get_detection_agreement(
+                            d.boxes,
+                            d.card_classes,
+                            reference.boxes,
+                            reference.card_classes,
+                        )
+                        for d, reference in zip(detections, reference_detections)
+                    ]
+                )
+            ),
+        }
+    return results
+
+
+def benchmark_replay(
+    CLIP_DIR: str,
+    MODEL_PATH: str,
+    real_time: bool = False,
+    number_of_players: int = 2,
+    trump: str = "s",
+) -> Dict:
+    """
+    Replay a recorded clip through the whole detection engine (decode, model, card tracking and scoring) and return
+    the frames per second, the latency percentiles from capture to rendered frame, the time per stage and the final scores.
+    In real time the engine runs on its threads and drops frames like with a camera, otherwise every frame is
+    processed as fast as possible on a single thread, which always leads to the same scores.
+    Frame counts and stage times are read from the counters and histograms of the engine, the time ends when the
+    last frame is published. In real time the latencies are of the frames seen by a subscriber, not of every frame.
+    """
+    import model_store
+    from detection_engine import DetectionEngine, GameState
+
+    model = model_store.get_loaded_model(MODEL_PATH).wait()
+    game_state = GameState()
+    game_state.start(number_of_players, trump)
+    frame_source = ReplayFrameSource(CLIP_DIR, real_time)
+    engine = DetectionEngine(frame_source, model, game_state)
+    # the metrics of the engine are kept by the registry of the process, only their change belongs to this replay
+    counters_before = dict(
+        (name, counter.value) for name, counter in engine.counters.items()
+    )
+    stages_before = dict(
+        (stage_name, (histogram.count, histogram.sum))
+        for stage_name, histogram in engine.stage_histograms.items()
+    )
+
+    def get_counter(name: str) -> int:
+        return engine.counters[name].value - counters_before[name]
+
+    frames = list()
+    start_time = time.time()
+    if real_time:
+        subscription = engine.start().subscribe()
+        # every captured frame is published, dropped or failed once the engine is done
+        while (not frame_source.finished.is_set()) or (
+            get_counter("frames")
+            > get_counter("published_frames")
+            + get_counter("dropped_frames")
+            + get_counter("errors")
+        ):
+            frame = subscription.get(timeout=0.1)
+            if frame is not None:
+                frames.append(frame)
+        engine.stop()
+    else:
+        for frame_index, (encoded_image, _) in enumerate(iter_clip(CLIP_DIR)):
+            frames.append(engine.process(frame_index, time.time(), encoded_image))
+    # no frame is published if every frame failed, see last_error
+    seconds = (
+        engine.output.publish_time if engine.output else time.time()
+    ) - start_time
+
+    latencies = [1000 * (frame.publish_time - frame.capture_time) for frame in frames]
+    stage_ms = dict()
+    for stage_name, histogram in engine.stage_histograms.items():
+        count, total = stages_before[stage_name]
+        if histogram.count > count:
+            stage_ms[stage_name] = (
+                1000 * (histogram.sum - total) / (histogram.count - count)
+            )
+    return {
+        "commit": get_commit(),
+        "real_time": real_time,
+        "number_of_frames": get_counter("frames"),
+        "processed_frames": get_counter("published_frames"),
+        "dropped_frames": get_counter("dropped_frames"),
+        "inferred_frames": get_counter("inferred_frames"),
+        "skipped_inferences": get_counter("skipped_inferences"),
+        "fps": get_counter("published_frames") / seconds,
+        "latency_ms": {
+            f"p{percentile}": float(np.percentile(latencies, percentile))
+            for percentile in (50, 90, 99)
+        },
+        "stage_ms": stage_ms,
+        "scores": game_state.get_scores(),
+        "winner": game_state.winner,
+        "last_error": None if engine.last_error is None else str(engine.last_error),
+    }
+
+
+def benchmark_decoding(
+    BACKGROUNDS_DIR: str,
+    resolutions: List[Tuple[int, int]] = (
+        (1280, 720),
+        (1920, 1080),
+        (2560, 1440),
+        (3840, 2160),
+    ),
+    number_of_frames: int = 20,
+    target_size: int = 640,
+) -> Dict:
+    """
+    Measure the decoding of camera frames at common phone resolutions: the former full-size decode (copying the frame
+    twice), the reduced-scale decode with OpenCV and with PyTurboJPEG, if it is installed.
+    Returns the median time per frame in ms and the decoded size for every resolution and decoder.
+    """
+    background = cv.imread(get_image_paths(BACKGROUNDS_DIR, recursive=True)[0])
+    decoders = {
+        "full_size": lambda encoded_image: cv.imdecode(
+            np.array(bytearray(encoded_image), dtype=np.uint8), -1
+        ),
+        "reduced_opencv": FrameDecoder(target_size, use_turbo_jpeg=False).decode,
+    }
+    turbo_jpeg_decoder = FrameDecoder(target_size)
+    if turbo_jpeg_decoder.turbo_jpeg is not None:
+        decoders["reduced_turbo_jpeg"] = turbo_jpeg_decoder.decode
+    results = {
+        "commit": get_commit(),
+        "target_size": target_size,
+        "number_of_frames": number_of_frames,
+    }
+    for width, height in resolutions:
+        encoded_image = cv.imencode(
+            ".jpg",
+            cv.resize(background, (width, height)),
+            [cv.IMWRITE_JPEG_QUALITY, 90],
+        )[1].tobytes()
+        results[f"{width}x{height}"] = dict()
+        for decoder_name, decode in decoders.items():
+            decode_times = list()
+            for _ in range(number_of_frames):
+                start_time = time.perf_counter()
+                image = decode(encoded_image)
+                decode_times.append(1000 * (time.perf_counter() - start_time))
+            results[f"{width}x{height}"][decoder_name] = {
+                "median_ms": float(np.median(decode_times)),
+                "size": list(image.shape[:2]),
+            }
+    return results
+
+
+def get_trained_model() -> str:
+    """
+    Return the path of the trained model, downloaded if it is not there yet.
+    """
+    import download_best_model as dbm
+
+    return dbm.get_model()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "benchmark",
+        choices=[
+            "compositing",
+            "batch_compositing",
+            "stages",
+            "model",
+            "backends",
+            "replay",
+            "decoding",
+        ],
+    )
+    parser.add_argument(
+        "--fixture",
+        choices=["unittest", "synthetic"],
+        default="unittest",
+        help="unittest_data or a larger generated fixture",
+    )
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        default=["pytorch"],
+        help="pytorch, onnx, openvino or openvino_int8 (see model_export.py)",
+    )
+    parser.add_argument(
+        "--dataset",
+        help="generated dataset, by default one is generated from the fixture",
+    )
+    parser.add_argument(
+        "--model", help="path of the YOLO model, the trained model by default"
+    )
+    parser.add_argument("--clip", help="recorded clip (see frame_recording.py)")
+    parser.add_argument(
+        "--real-time",
+        action="store_true",
+        help="replay the clip with its timing instead of as fast as possible",
+    )
+    parser.add_argument("--output", help="also save the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.fixture == "synthetic":
+        BACKGROUNDS_DIR, PHOTOS_DIR = create_synthetic_fixture(
+            tempfile.gettempdir() + "/card_benchmark_fixture"
+        )
+    else:
+        BACKGROUNDS_DIR = "./unittest_data/test_backgrounds"
+        PHOTOS_DIR = "./unittest_data/test_photos"
+
+    if args.benchmark == "compositing":
+        results = benchmark_compositing(BACKGROUNDS_DIR, PHOTOS_DIR, args.images)
+    elif args.benchmark == "batch_compositing":
+        results = benchmark_batch_compositing(BACKGROUNDS_DIR, PHOTOS_DIR, args.images)
+    elif args.benchmark == "stages":
+        results = benchmark_generation_stages(
+            BACKGROUNDS_DIR, PHOTOS_DIR, args.images, workers=args.workers
+        )
+    elif args.benchmark == "model":
+        results = benchmark_model_loading(
+            args.model or get_trained_model(), args.sessions
+        )
+    elif args.benchmark == "backends":
+        DATASET_DIR = args.dataset or dgf.generate_dataset(
+            BACKGROUNDS_DIR,
+            PHOTOS_DIR,
+            tempfile.gettempdir() + "/card_benchmark_dataset",
+            args.images,
+            5,
+            0.2,
+            0.5,
+            False,
+            1,
+        )
+        results = benchmark_backends(
+            args.model or get_trained_model(), DATASET_DIR, args.backends, args.images
+        )
+    elif args.benchmark == "replay":
+        results = benchmark_replay(
+            args.clip, args.model or get_trained_model(), args.real_time
+        )
+    elif args.benchmark == "decoding":
+        results = benchmark_decoding(BACKGROUNDS_DIR, number_of_frames=args.images)
+    if args.benchmark not in ("model", "replay"):
+        results["fixture"] = args.fixture
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
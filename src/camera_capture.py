@@ -0,0 +1,209 @@
+"""
+This file contains the frame grabber, that reads the frames of the IP Webcam app in the background.
+The frames are fetched by their own thread over a single kept-alive HTTP connection, either as the continuous
+MJPEG stream of the app (/video) or as single snapshots (/shot.jpg). Only the latest frame is kept: frames that
+arrive before the previous one was read are dropped, so the detection always works on the current view of the
+table, no matter how long it takes per frame.
+"""
+
+import time
+import threading
+import requests
+import metrics
+from requests.adapters import HTTPAdapter
+from typing import Dict, Iterator, Optional, Tuple
+
+STREAM_PATH = "/video"
+SNAPSHOT_PATH = "/shot.jpg"
+JPEG_START = b"\xff\xd8"
+JPEG_END = b"\xff\xd9"
+
+
+def get_boundary(content_type: str) -> Optional[str]:
+    """
+    Return the boundary of the parts of a multipart stream from its Content-Type header, None if it is not given.
+    """
+    for parameter in content_type.split(";")[1:]:
+        name, _, value = parameter.strip().partition("=")
+        if name.lower() == "boundary":
+            # some cameras already prefix the boundary with the dashes of its delimiter
+            return value.strip('"').lstrip("-") or None
+    return None
+
+
+def get_part_headers(header_block) -> Dict[str, str]:
+    """
+    Return the headers of a part of a multipart stream with lower case names. The boundary line is skipped.
+    """
+    headers = dict()
+    for line in bytes(header_block).decode("latin-1").split("\r\n"):
+        name, separator, value = line.partition(":")
+        if separator:
+            headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def iter_mjpeg_frames(
+    chunks: Iterator[bytes], boundary: Optional[str] = None
+) -> Iterator[bytes]:
+    """
+    Yield the JPEG images of a MJPEG stream, given as chunks of bytes of any size and the boundary of its parts.
+    Every part is read by the length in its Content-Length header, so images containing another JPEG (e.g. the
+    thumbnail in their EXIF segment) stay whole. Only parts without Content-Length are cut at the first end marker
+    after their start marker.
+    """
+    delimiter = b"--" + (boundary or "").encode()
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while True:
+            part_start = buffer.find(delimiter)
+            if part_start < 0:
+                # keep the end of the buffer, it could be the first half of a delimiter
+                del buffer[: max(len(buffer) - len(delimiter) + 1, 0)]
+                break
+            header_end = buffer.find(b"\r\n\r\n", part_start)
+            if header_end < 0:
+                del buffer[:part_start]
+                break
+            headers = get_part_headers(buffer[part_start:header_end])
+            if "content-length" in headers:
+                frame_start = header_end + 4
+                frame_end = frame_start + int(headers["content-length"])
+            else:
+                frame_start = buffer.find(JPEG_START, header_end + 4)
+                frame_end = -1
+                if frame_start >= 0:
+                    frame_end = buffer.find(JPEG_END, frame_start + len(JPEG_START))
+                if frame_end >= 0:
+                    frame_end += len(JPEG_END)
+            if (frame_end < 0) or (len(buffer) < frame_end):
+                del buffer[:part_start]
+                break
+            # copy the frame out of the buffer once, slicing the buffer would copy it twice
+            with memoryview(buffer) as view:
+                frame = bytes(view[frame_start:frame_end])
+            del buffer[:frame_end]
+            yield frame
+
+
+class FrameGrabber:
+    """
+    Fetches the frames of an IP Webcam on a background thread and keeps the latest one.
+    """
+
+    def __init__(
+        self,
+        camera_url: str,
+        use_stream: bool = True,
+        timeout: float = 5.0,
+        reconnect_delay: float = 1.0,
+    ) -> None:
+        self.camera_url = camera_url.rstrip("/")
+        self.use_stream = use_stream
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        # one pooled connection, kept alive between the requests
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.frame_available = threading.Condition()
+        self.latest_frame = None
+        self.latest_frame_time = 0.0
+        self.has_new_frame = False
+        self.number_of_frames = 0
+        self.number_of_dropped_frames = 0
+        self.last_error = None
+        self.frame_interval_histogram = metrics.registry.histogram(
+            "frame_interval_seconds",
+            "Time between two frames of the camera in seconds",
+            camera=camera_url,
+        )
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self) -> "FrameGrabber":
+        """
+        Start fetching frames in the background, also after stop. Returns the frame grabber itself.
+        """
+        if (self.thread is not None) and self.stopping.is_set():
+            # a stopped thread can still be waiting for its last request
+            self.thread.join()
+        if (self.thread is None) or (not self.thread.is_alive()):
+            self.stopping.clear()
+            self.thread = threading.Thread(
+                target=self._run, name="frame_grabber", daemon=True
+            )
+            self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop fetching frames and close the connection.
+        """
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.timeout)
+        self.session.close()
+        with self.frame_available:
+            self.frame_available.notify_all()
+
+    def _run(self) -> None:
+        while not self.stopping.is_set():
+            try:
+                frames = self._iter_stream() if self.use_stream else self._iter_shots()
+                last_frame_time = None
+                for frame in frames:
+                    now = time.perf_counter()
+                    if last_frame_time is not None:
+                        self.frame_interval_histogram.observe(now - last_frame_time)
+                    last_frame_time = now
+                    self._set_latest_frame(frame)
+                    if self.stopping.is_set():
+                        break
+            except (requests.RequestException, ValueError) as error:
+                self.last_error = error
+            self.stopping.wait(self.reconnect_delay)
+
+    def _iter_stream(self) -> Iterator[bytes]:
+        with self.session.get(
+            self.camera_url + STREAM_PATH, stream=True, timeout=self.timeout
+        ) as response:
+            response.raise_for_status()
+            yield from iter_mjpeg_frames(
+                response.iter_content(chunk_size=1 << 16),
+                get_boundary(response.headers.get("Content-Type", "")),
+            )
+
+    def _iter_shots(self) -> Iterator[bytes]:
+        while not self.stopping.is_set():
+            response = self.session.get(
+                self.camera_url + SNAPSHOT_PATH, timeout=self.timeout
+            )
+            response.raise_for_status()
+            yield response.content
+
+    def _set_latest_frame(self, frame: bytes) -> None:
+        with self.frame_available:
+            if self.has_new_frame:
+                self.number_of_dropped_frames += 1
+            self.has_new_frame = True
+            self.latest_frame = frame
+            self.latest_frame_time = time.time()
+            self.number_of_frames += 1
+            self.frame_available.notify_all()
+
+    def read(self, timeout: float = None) -> Optional[Tuple[bytes, float]]:
+        """
+        Return a tuple containing the latest JPEG encoded frame, that was not read before, and the time it arrived.
+        Waits for a new frame, returns None if there is no new frame within the timeout (default: the request timeout).
+        """
+        timeout = self.timeout if timeout is None else timeout
+        with self.frame_available:
+            self.frame_available.wait_for(
+                lambda: self.has_new_frame or self.stopping.is_set(), timeout
+            )
+            if not self.has_new_frame:
+                return None
+            self.has_new_frame = False
+            return self.latest_frame, self.latest_frame_time
@@ -0,0 +1,131 @@
+"""
+This file contains the placement engine, that decides where the playing cards are placed on a background.
+The bounding boxes of the placed cards are kept as N x 4 array (center x, center y, width, height).
+If the cards are not allowed to overlap, an occupancy map of the image is kept as well: after a few
+cheap random tries, the positions are sampled from all free positions only, found with the integral
+image of the occupancy map. A card that does not fit anywhere is reported by returning None, so the
+caller can keep the labels aligned with the cards that were actually placed.
+"""
+
+import cv2 as cv
+import numpy as np
+from typing import Tuple, Optional
+
+
+class CardPlacement:
+    """
+    Bounding boxes of the cards placed on a single image.
+    """
+
+    def __init__(
+        self,
+        image_height: int,
+        image_width: int,
+        overlapping: bool,
+        quick_tries: int = 5,
+    ) -> None:
+        self.image_height = image_height
+        self.image_width = image_width
+        self.overlapping = overlapping
+        self.quick_tries = quick_tries
+        self.bounding_boxes = np.empty((0, 4), dtype=np.int64)
+        # counters to see how often the random tries are not enough (see benchmarks.py)
+        self.number_of_tries = 0
+        self.number_of_free_space_searches = 0
+        # x_min, x_max, y_min, y_max of the placed bounding boxes
+        self.box_limits = np.empty((0, 4), dtype=np.int64)
+        if not overlapping:
+            self.occupancy = np.zeros((image_height, image_width), dtype=np.uint8)
+
+    def find_position(self, card_width: int, card_height: int, rng) -> Optional[Tuple]:
+        """
+        Return the proposed bounding box of a card at a random position, or None if there is no free position left.
+        """
+        if self.overlapping:
+            x_pos = rng.randint(0, self.image_width - 1)
+            y_pos = rng.randint(0, self.image_height - 1)
+            return (x_pos, y_pos, card_width, card_height)
+
+        # the card covers an even number of pixels around its (integer) center
+        half_width = max(1, (card_width + card_width % 2) // 2)
+        half_height = max(1, (card_height + card_height % 2) // 2)
+        max_x_pos = self.image_width - half_width
+        max_y_pos = self.image_height - half_height
+        if (max_x_pos < half_width) or (max_y_pos < half_height):
+            return None
+
+        # positions are mostly free in sparse images, so first try a few positions inside the image
+        for _ in range(self.quick_tries):
+            self.number_of_tries += 1
+            x_pos = rng.randint(half_width, max_x_pos)
+            y_pos = rng.randint(half_height, max_y_pos)
+            if not self._overlaps(
+                x_pos - half_width,
+                x_pos + half_width,
+                y_pos - half_height,
+                y_pos + half_height,
+            ):
+                return (x_pos, y_pos, card_width, card_height)
+
+        # sample from all free positions: sum of occupied pixels under the card for every top left corner
+        self.number_of_free_space_searches += 1
+        integral_image = cv.integral(self.occupancy)
+        width, height = 2 * half_width, 2 * half_height
+        occupied_pixels = (
+            integral_image[height:, width:]
+            - integral_image[:-height, width:]
+            - integral_image[height:, :-width]
+            + integral_image[:-height, :-width]
+        )
+        free_positions = np.flatnonzero(occupied_pixels == 0)
+        if len(free_positions) == 0:
+            return None
+        y_min, x_min = np.divmod(
+            free_positions[rng.randrange(len(free_positions))],
+            occupied_pixels.shape[1],
+        )
+        return (
+            int(x_min) + half_width,
+            int(y_min) + half_height,
+            card_width,
+            card_height,
+        )
+
+    def _overlaps(self, x_min: int, x_max: int, y_min: int, y_max: int) -> bool:
+        """
+        Return a bool that indicates if the area overlaps with a placed bounding box.
+        """
+        limits = self.box_limits
+        return bool(
+            np.any(
+                (limits[:, 0] < x_max)
+                & (x_min < limits[:, 1])
+                & (limits[:, 2] < y_max)
+                & (y_min < limits[:, 3])
+            )
+        )
+
+    def add(self, bounding_box: Tuple) -> None:
+        """
+        Add the bounding box of a placed card.
+        """
+        x_min = int(np.floor(bounding_box[0] - bounding_box[2] / 2))
+        x_max = int(np.ceil(bounding_box[0] + bounding_box[2] / 2))
+        y_min = int(np.floor(bounding_box[1] - bounding_box[3] / 2))
+        y_max = int(np.ceil(bounding_box[1] + bounding_box[3] / 2))
+        self.bounding_boxes = np.vstack((self.bounding_boxes, bounding_box))
+        self.box_limits = np.vstack((self.box_limits, (x_min, x_max, y_min, y_max)))
+        if not self.overlapping:
+            self.occupancy[max(0, y_min) : y_max, max(0, x_min) : x_max] = 1
+
+    def get_relative_bounding_boxes(self):
+        """
+        Return the bounding boxes normalized by the image size, as needed by YOLO.
+        """
+        image_size = (
+            self.image_width,
+            self.image_height,
+            self.image_width,
+            self.image_height,
+        )
+        return self.bounding_boxes / image_size
@@ -0,0 +1,136 @@
+"""
+This file contains the temporal tracking of the detected cards, which decides when a card is played.
+A card is played, when it is detected in enough consecutive frames, so single false detections are not counted.
+The state of every card class is kept in fixed-size arrays: hits (consecutive frames the card was detected in),
+accumulated confidence, the frame it was last seen in and its last box. Boxes are associated across frames by their
+intersection over union, a card detected at another place starts over. The number of hits needed adapts to the
+confidence: confident cards are played after few frames, uncertain ones need more. A card that is not detected loses
+a hit and is dropped after a few missed frames, so flickering detections are held back.
+"""
+
+import numpy as np
+from typing import List
+
+NUMBER_OF_CARDS = 36
+
+
+def get_box_areas(boxes):
+    """
+    Return the areas of boxes given as ... x 4 array (x_min, y_min, x_max, y_max).
+    """
+    return (boxes[..., 2] - boxes[..., 0]) * (boxes[..., 3] - boxes[..., 1])
+
+
+def get_iou_matrix(boxes, other_boxes):
+    """
+    Return the intersection over union of every box with every other box, boxes given as N x 4 arrays (x_min, y_min, x_max, y_max).
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 1, 4)
+    other_boxes = np.asarray(other_boxes, dtype=np.float64).reshape(1, -1, 4)
+    intersection_width = np.minimum(boxes[..., 2], other_boxes[..., 2]) - np.maximum(
+        boxes[..., 0], other_boxes[..., 0]
+    )
+    intersection_height = np.minimum(boxes[..., 3], other_boxes[..., 3]) - np.maximum(
+        boxes[..., 1], other_boxes[..., 1]
+    )
+    intersection = np.clip(intersection_width, 0, None) * np.clip(
+        intersection_height, 0, None
+    )
+    union = get_box_areas(boxes) + get_box_areas(other_boxes) - intersection
+    return intersection / np.maximum(union, 1e-12)
+
+
+class CardTracker:
+    """
+    Tracks every card class over the frames and reports the cards as soon as they are played.
+    """
+
+    def __init__(
+        self,
+        number_of_classes: int = NUMBER_OF_CARDS,
+        min_hits: int = 2,
+        max_hits: int = 5,
+        low_confidence: float = 0.7,
+        high_confidence: float = 0.95,
+        max_missed_frames: int = 1,
+        iou_threshold: float = 0.3,
+    ) -> None:
+        self.number_of_classes = number_of_classes
+        self.min_hits = min_hits
+        self.max_hits = max_hits
+        self.low_confidence = low_confidence
+        self.high_confidence = high_confidence
+        self.max_missed_frames = max_missed_frames
+        self.iou_threshold = iou_threshold
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forget all tracked and played cards.
+        """
+        self.frame_index = 0
+        self.hits = np.zeros(self.number_of_classes, dtype=np.int64)
+        self.confidence_sums = np.zeros(self.number_of_classes, dtype=np.float64)
+        self.last_seen = np.full(self.number_of_classes, -1, dtype=np.int64)
+        self.boxes = np.zeros((self.number_of_classes, 4), dtype=np.float64)
+        self.played = np.zeros(self.number_of_classes, dtype=bool)
+
+    def get_required_hits(self, mean_confidences):
+        """
+        Return the number of hits needed to play cards with the given mean confidences, between min_hits (high confidence) and max_hits (low confidence).
+        """
+        certainty = np.clip(
+            (mean_confidences - self.low_confidence)
+            / (self.high_confidence - self.low_confidence),
+            0,
+            1,
+        )
+        return np.rint(
+            self.max_hits - (self.max_hits - self.min_hits) * certainty
+        ).astype(np.int64)
+
+    def update(self, boxes, confidences, card_classes) -> List[int]:
+        """
+        Register the detections of a frame. Returns the classes of the cards played with this frame, in the order of detection.
+        """
+        self.frame_index += 1
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        confidences = np.asarray(confidences, dtype=np.float64).reshape(-1)
+        card_classes = np.asarray(card_classes, dtype=np.int64).reshape(-1)
+
+        # keep the most confident box of every class, in the order of detection
+        order = np.argsort(-confidences, kind="stable")
+        _, first_indices = np.unique(card_classes[order], return_index=True)
+        indices = np.sort(order[first_indices])
+        boxes, confidences, card_classes = (
+            boxes[indices],
+            confidences[indices],
+            card_classes[indices],
+        )
+
+        # detections continue a track, if the card was seen recently at the same place
+        ious = np.diagonal(get_iou_matrix(boxes, self.boxes[card_classes]))
+        continued = (self.hits[card_classes] > 0) & (ious >= self.iou_threshold)
+        self.hits[card_classes] = np.where(continued, self.hits[card_classes] + 1, 1)
+        self.confidence_sums[card_classes] = np.where(
+            continued, self.confidence_sums[card_classes] + confidences, confidences
+        )
+        self.boxes[card_classes] = boxes
+        self.last_seen[card_classes] = self.frame_index
+
+        # tracked cards that were not detected lose a hit, or are dropped after too many missed frames
+        missed = (self.hits > 0) & (self.last_seen < self.frame_index)
+        dropped = missed & (self.frame_index - self.last_seen > self.max_missed_frames)
+        decayed = missed & ~dropped
+        self.confidence_sums[decayed] *= (self.hits[decayed] - 1) / self.hits[decayed]
+        self.hits[decayed] -= 1
+        self.hits[dropped] = 0
+        self.confidence_sums[dropped] = 0
+
+        hits = self.hits[card_classes]
+        required_hits = self.get_required_hits(
+            self.confidence_sums[card_classes] / hits
+        )
+        newly_played = (~self.played[card_classes]) & (hits >= required_hits)
+        self.played[card_classes[newly_played]] = True
+        return card_classes[newly_played].tolist()
@@ -5,14 +5,43 @@ and the contained images, but also testing of the model-download and rule implem
 """
 
 import dataset_generation_functions as dgf
+import photo_preparation_functions as ppf
+from asset_store import AssetStore
+from card_placement import CardPlacement
+from synthetic_dataset import SyntheticCardDataset, collate_samples
+from dataset_shards import ShardReader
+from dataset_writer import DatasetWriter
+from sprite_atlas import SpriteAtlas
+from camera_capture import FrameGrabber, get_boundary, iter_mjpeg_frames
+from frame_decoding import FrameDecoder, get_jpeg_size, get_scale_factor
+from detection_engine import DetectionEngine, Detections, Frame, GameState
+from batched_inference import BatchedModel
+from frame_recording import FrameRecorder, ReplayFrameSource, iter_clip
+from preview_renderer import PreviewRenderer
+from card_tracker import CardTracker
+from motion_gate import MotionGate
+from table_roi import TableRoi
+import model_store
+import model_export
+import metrics
+import numpy as np
 import jass_rules as jass
 import download_best_model as dbm
 import cv2 as cv
 from ultralytics import YOLO
 import os
+import json
+import struct
+import requests
 import shutil
+import tempfile
 import unittest
+import threading
+import time
+from types import SimpleNamespace
+from importlib.util import find_spec
 from glob import glob
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
 
 class TestDatasetGeneration(unittest.TestCase):
@@ -63,6 +92,1010 @@ class TestDatasetGeneration(unittest.TestCase):
         shutil.rmtree(DATASET_DIR)
         shutil.rmtree(PROCESSED_PHOTOS_DIR)
 
+    def test_parallel_generation_is_deterministic(self) -> None:
+        """
+        Test if the same seed generates the same dataset, independent of the number of workers. Otherwise the test fails.
+        """
+        PROCESSED_PHOTOS_DIR = str(os.getcwd()) + "/unittest_data/test_photos_processed"
+        DATASET_DIRS = [
+            str(os.getcwd()) + f"/unittest_data/test_dataset_{workers}_workers"
+            for workers in (1, 2)
+        ]
+        for workers, DATASET_DIR in zip((1, 2), DATASET_DIRS):
+            compositing_histogram = metrics.registry.histogram(
+                "generation_seconds", stage="compositing"
+            )
+            number_of_compositings = compositing_histogram.count
+            _ = dgf.generate_dataset(
+                BACKGROUNDS_DIR="./unittest_data/test_backgrounds",
+                PHOTOS_DIR="./unittest_data/test_photos",
+                OUTPUT_DIR=DATASET_DIR,
+                number_of_images=8,
+                max_number_of_cards_per_image=3,
+                min_size=0.2,
+                max_size=0.7,
+                overlapping=False,
+                seed=1,
+                workers=workers,
+            )
+            # the stages run by the worker processes are reported to the metrics of this process as well
+            self.assertGreater(compositing_histogram.count, number_of_compositings)
+        for file_path in glob(DATASET_DIRS[0] + "/*/*/*"):
+            with open(file_path, "rb") as file:
+                single_worker_file = file.read()
+            with open(file_path.replace(*DATASET_DIRS), "rb") as file:
+                self.assertEqual(single_worker_file, file.read())
+        for DATASET_DIR in DATASET_DIRS:
+            shutil.rmtree(DATASET_DIR)
+        shutil.rmtree(PROCESSED_PHOTOS_DIR)
+
+    def test_fused_compositing_equivalence(self) -> None:
+        """
+        Test if the fused compositing engine places the cards like the step by step transformation: same labels and
+        nearly the same pixels (only the interpolation at the card edges differs). Otherwise the test fails.
+        """
+        PROCESSED_PHOTOS_DIR = ppf.process_photos("./unittest_data/test_photos")
+        assets = AssetStore("./unittest_data/test_backgrounds", PROCESSED_PHOTOS_DIR)
+        for seed in range(10):
+            images_and_labels = list()
+            for fused in (False, True):
+                rng = dgf.get_image_rng(seed, 0)
+                background = assets.select_background(rng)
+                cards, masks, _ = assets.select_cards(3, rng)
+                images_and_labels.append(
+                    dgf.place_cards(
+                        background, cards, [0, 1, 2], 0.7, 0.2, True, rng, masks, fused
+                    )
+                )
+            (step_by_step_image, step_by_step_labels), (fused_image, fused_labels) = (
+                images_and_labels
+            )
+            self.assertEqual(step_by_step_labels, fused_labels)
+            pixel_difference = np.abs(
+                step_by_step_image.astype(np.int16) - fused_image.astype(np.int16)
+            )
+            self.assertLess(pixel_difference.mean(), 3)
+            self.assertLess((pixel_difference.max(axis=2) > 40).mean(), 0.03)
+        assets.close()
+        shutil.rmtree(PROCESSED_PHOTOS_DIR)
+
+    def test_background_selection_is_deterministic(self) -> None:
+        """
+        Test if the background stack and the LRU cache select the same backgrounds for the same seeds, also with an
+        unreadable file, and if no stack is left on the disk when no background can be read. Otherwise the test fails.
+        """
+        PROCESSED_PHOTOS_DIR = ppf.process_photos("./unittest_data/test_photos")
+        BACKGROUNDS_DIR = str(os.getcwd()) + "/unittest_data/test_backgrounds_broken"
+        shutil.copytree("./unittest_data/test_backgrounds", BACKGROUNDS_DIR)
+        with open(BACKGROUNDS_DIR + "/images/banded_0003.jpg", "w") as file:
+            file.write("not an image")
+        stacked_assets = AssetStore(BACKGROUNDS_DIR, PROCESSED_PHOTOS_DIR)
+        cached_assets = AssetStore(
+            BACKGROUNDS_DIR, PROCESSED_PHOTOS_DIR, max_stacked_backgrounds=0
+        )
+        self.assertIsNone(cached_assets.backgrounds_stack_path)
+        for seed in range(20):
+            self.assertTrue(
+                np.array_equal(
+                    stacked_assets.select_background(dgf.get_image_rng(seed, 0)),
+                    cached_assets.select_background(dgf.get_image_rng(seed, 0)),
+                )
+            )
+        self.assertEqual(
+            stacked_assets.unreadable_backgrounds, cached_assets.unreadable_backgrounds
+        )
+        stacked_assets.close()
+        cached_assets.close()
+
+        shutil.rmtree(BACKGROUNDS_DIR)
+        os.makedirs(BACKGROUNDS_DIR)
+        with open(BACKGROUNDS_DIR + "/broken.jpg", "w") as file:
+            file.write("not an image")
+        stack_paths = set(
+            glob(os.path.join(tempfile.gettempdir(), "backgrounds_*.npy"))
+        )
+        with self.assertRaises(ValueError):
+            AssetStore(BACKGROUNDS_DIR, PROCESSED_PHOTOS_DIR)
+        self.assertEqual(
+            set(glob(os.path.join(tempfile.gettempdir(), "backgrounds_*.npy"))),
+            stack_paths,
+        )
+        shutil.rmtree(BACKGROUNDS_DIR)
+        shutil.rmtree(PROCESSED_PHOTOS_DIR)
+
+    def test_placement_uses_free_space(self) -> None:
+        """
+        Test if a card is placed in the only free area of an otherwise covered image, and if a card that does not fit
+        anywhere is reported as not placed. Otherwise the test fails.
+        """
+        placement = CardPlacement(100, 100, overlapping=False)
+        placement.add((50, 20, 100, 40))
+        placement.add((20, 70, 40, 60))
+        placement.add((80, 70, 40, 60))
+        placement.add((50, 90, 20, 20))
+        rng = dgf.get_image_rng(1, 0)
+        self.assertTupleEqual(placement.find_position(20, 40, rng), (50, 60, 20, 40))
+        placement.add((50, 60, 20, 40))
+        self.assertIsNone(placement.find_position(2, 2, rng))
+        self.assertEqual(placement.bounding_boxes.shape, (5, 4))
+
+    def test_in_memory_dataset(self) -> None:
+        """
+        Test if the in-memory dataset generates the images saved by generate_dataset in epoch 0 and new images in
+        other epochs, and if samples can be combined to a batch. Otherwise the test fails.
+        """
+        DATASET_DIR = str(os.getcwd()) + "/unittest_data/test_dataset"
+        PROCESSED_PHOTOS_DIR = str(os.getcwd()) + "/unittest_data/test_photos_processed"
+        settings = dict(
+            BACKGROUNDS_DIR="./unittest_data/test_backgrounds",
+            PHOTOS_DIR="./unittest_data/test_photos",
+            number_of_images=5,
+            max_number_of_cards_per_image=3,
+            min_size=0.2,
+            max_size=0.7,
+            overlapping=False,
+            seed=1,
+        )
+        _ = dgf.generate_dataset(OUTPUT_DIR=DATASET_DIR, **settings)
+        dataset = SyntheticCardDataset(**settings)
+        image, bounding_boxes, card_classes = dataset[1]
+        with open(DATASET_DIR + "/train/labels/1.txt") as file:
+            self.assertEqual(
+                file.read(), dgf.format_labels(bounding_boxes, card_classes)
+            )
+        self.assertTupleEqual(image.shape, (640, 640, 3))
+
+        dataset.set_epoch(1)
+        images, labels = collate_samples([dataset[0], dataset[1]])
+        self.assertTupleEqual(images.shape, (2, 640, 640, 3))
+        self.assertEqual(labels.shape[1], 6)
+        self.assertFalse(np.array_equal(images[1], image))
+        batch_images, batch_labels = dataset.get_batch([0, 1])
+        self.assertTrue(np.array_equal(batch_images, images))
+        self.assertTrue(np.array_equal(batch_labels, labels))
+        dataset.close()
+        shutil.rmtree(DATASET_DIR)
+        shutil.rmtree(PROCESSED_PHOTOS_DIR)
+
+    def test_sharded_output(self) -> None:
+        """
+        Test if the sharded dataset contains the same samples as the dataset saved as files, and if it can be
+        read directly and unpacked into the folder structure for YOLO. Otherwise the test fails.
+        """
+        DATASET_DIR = str(os.getcwd()) + "/unittest_data/test_dataset"
+        SHARDED_DATASET_DIR = str(os.getcwd()) + "/unittest_data/test_dataset_sharded"
+        PROCESSED_PHOTOS_DIR = str(os.getcwd()) + "/unittest_data/test_photos_processed"
+        for OUTPUT_DIR, output_format in (
+            (DATASET_DIR, "files"),
+            (SHARDED_DATASET_DIR, "shards"),
+        ):
+            _ = dgf.generate_dataset(
+                BACKGROUNDS_DIR="./unittest_data/test_backgrounds",
+                PHOTOS_DIR="./unittest_data/test_photos",
+                OUTPUT_DIR=OUTPUT_DIR,
+                number_of_images=10,
+                max_number_of_cards_per_image=2,
+                min_size=0.2,
+                max_size=0.7,
+                overlapping=True,
+                seed=1,
+                output_format=output_format,
+                samples_per_shard=3,
+            )
+        reader = ShardReader(SHARDED_DATASET_DIR)
+        self.assertEqual(len(reader), 10)
+        self.assertEqual(len(glob(SHARDED_DATASET_DIR + "/shards/train-*.tar")), 3)
+        image_index, image, labels = reader.read_sample("train", 4)
+        self.assertEqual(image_index, 4)
+        self.assertTupleEqual(image.shape, (640, 640, 3))
+        with open(DATASET_DIR + "/train/labels/4.txt") as file:
+            self.assertEqual(file.read(), labels)
+
+        reader.unpack()
+        for file_path in glob(DATASET_DIR + "/*/*/*"):
+            with open(file_path, "rb") as file:
+                unsharded_file = file.read()
+            with open(
+                file_path.replace(DATASET_DIR, SHARDED_DATASET_DIR), "rb"
+            ) as file:
+                self.assertEqual(unsharded_file, file.read())
+        shutil.rmtree(DATASET_DIR)
+        shutil.rmtree(SHARDED_DATASET_DIR)
+        shutil.rmtree(PROCESSED_PHOTOS_DIR)
+
+    def test_writer_image_format_and_errors(self) -> None:
+        """
+        Test if the images are saved in the chosen image format and if failed writes are reported. Otherwise the test fails.
+        """
+        DATASET_DIR = str(os.getcwd()) + "/unittest_data/test_dataset"
+        PROCESSED_PHOTOS_DIR = str(os.getcwd()) + "/unittest_data/test_photos_processed"
+        _ = dgf.generate_dataset(
+            BACKGROUNDS_DIR="./unittest_data/test_backgrounds",
+            PHOTOS_DIR="./unittest_data/test_photos",
+            OUTPUT_DIR=DATASET_DIR,
+            number_of_images=10,
+            max_number_of_cards_per_image=2,
+            min_size=0.2,
+            max_size=0.7,
+            overlapping=True,
+            seed=1,
+            image_format="png",
+        )
+        image_paths = glob(DATASET_DIR + "/*/images/*")
+        self.assertEqual(len(image_paths), 10)
+        self.assertTrue(all(path.endswith(".png") for path in image_paths))
+        self.assertTupleEqual(cv.imread(image_paths[0]).shape, (640, 640, 3))
+
+        # the write errors are collected by submit and raised together by close
+        with self.assertRaisesRegex(OSError, "^3 images"):
+            with DatasetWriter(
+                DATASET_DIR + "/missing", max_pending_images=2
+            ) as writer:
+                for i in range(3):
+                    writer.submit("train", i, np.zeros((8, 8, 3), dtype=np.uint8), "")
+        self.assertTrue(writer.closed)
+        shutil.rmtree(DATASET_DIR)
+        shutil.rmtree(PROCESSED_PHOTOS_DIR)
+
+    def test_resume_generation(self) -> None:
+        """
+        Test if an interrupted dataset generation is resumed by generating only the missing and truncated images,
+        and if the result is the same as of an uninterrupted generation. Otherwise the test fails.
+        """
+        DATASET_DIR = str(os.getcwd()) + "/unittest_data/test_dataset"
+        RESUMED_DATASET_DIR = str(os.getcwd()) + "/unittest_data/test_dataset_resumed"
+        PROCESSED_PHOTOS_DIR = str(os.getcwd()) + "/unittest_data/test_photos_processed"
+        settings = dict(
+            BACKGROUNDS_DIR="./unittest_data/test_backgrounds",
+            PHOTOS_DIR="./unittest_data/test_photos",
+            number_of_images=10,
+            max_number_of_cards_per_image=2,
+            min_size=0.2,
+            max_size=0.7,
+            overlapping=True,
+            seed=1,
+        )
+        _ = dgf.generate_dataset(OUTPUT_DIR=DATASET_DIR, **settings)
+        _ = dgf.generate_dataset(OUTPUT_DIR=RESUMED_DATASET_DIR, **settings)
+        # simulate an interrupted run: a missing image and a truncated image
+        os.remove(RESUMED_DATASET_DIR + "/train/images/2.jpg")
+        with open(RESUMED_DATASET_DIR + "/train/images/3.jpg", "r+b") as file:
+            file.truncate(100)
+        # a changed file of the same size is found by its modification time
+        with open(RESUMED_DATASET_DIR + "/train/labels/1.txt", "r+b") as file:
+            file.write(b"9")
+        completed_at = os.path.getmtime(RESUMED_DATASET_DIR + "/train/images/4.jpg")
+        _ = dgf.generate_dataset(OUTPUT_DIR=RESUMED_DATASET_DIR, **settings)
+        self.assertEqual(
+            completed_at,
+            os.path.getmtime(RESUMED_DATASET_DIR + "/train/images/4.jpg"),
+        )
+        for file_path in glob(DATASET_DIR + "/*/*/*"):
+            with open(file_path, "rb") as file:
+                uninterrupted_file = file.read()
+            with open(
+                file_path.replace(DATASET_DIR, RESUMED_DATASET_DIR), "rb"
+            ) as file:
+                self.assertEqual(uninterrupted_file, file.read())
+        shutil.rmtree(DATASET_DIR)
+        shutil.rmtree(RESUMED_DATASET_DIR)
+        shutil.rmtree(PROCESSED_PHOTOS_DIR)
+
+    def test_sprite_atlas(self) -> None:
+        """
+        Test if the sprites of the atlas are cut to their mask and if a dataset can be generated with them. Otherwise the test fails.
+        """
+        DATASET_DIR = str(os.getcwd()) + "/unittest_data/test_dataset"
+        PROCESSED_PHOTOS_DIR = ppf.process_photos("./unittest_data/test_photos")
+        assets = AssetStore("./unittest_data/test_backgrounds", PROCESSED_PHOTOS_DIR)
+        atlas = SpriteAtlas(
+            assets.cards, assets.card_masks, assets.card_names, 640, 0.2, 0.7, 3, 8
+        )
+        sprite = atlas.get_sprite(0, 0.3, 50)
+        self.assertTrue(np.array_equal(sprite, atlas.get_sprite(0, 0.2, 45)))
+        card_mask = sprite[:, :, 3]
+        for border in (card_mask[0], card_mask[-1], card_mask[:, 0], card_mask[:, -1]):
+            self.assertTrue(border.any())
+        atlas.close()
+        assets.close()
+
+        _ = dgf.generate_dataset(
+            BACKGROUNDS_DIR="./unittest_data/test_backgrounds",
+            PHOTOS_DIR="./unittest_data/test_photos",
+            OUTPUT_DIR=DATASET_DIR,
+            number_of_images=10,
+            max_number_of_cards_per_image=3,
+            min_size=0.2,
+            max_size=0.7,
+            overlapping=False,
+            seed=1,
+            sprite_atlas_grid=(3, 8),
+        )
+        self.assertEqual(len(glob(DATASET_DIR + "/*/images/*.jpg")), 10)
+        for label_path in glob(DATASET_DIR + "/*/labels/*.txt"):
+            labels = np.loadtxt(label_path, ndmin=2)
+            self.assertTrue(np.all((labels[:, 1:] >= 0) & (labels[:, 1:] <= 1)))
+        shutil.rmtree(DATASET_DIR)
+        shutil.rmtree(PROCESSED_PHOTOS_DIR)
+
+
+class TestPhotoPreparation(unittest.TestCase):
+    def test_mask_is_stored_with_card(self) -> None:
+        """
+        Test if the processed cards are saved together with their mask and are only processed again when the photo changes. Otherwise the test fails.
+        """
+        PROCESSED_PHOTOS_DIR = ppf.process_photos("./unittest_data/test_photos")
+        card_path = glob(PROCESSED_PHOTOS_DIR + "/*.png")[0]
+        card, mask = ppf.load_card(card_path)
+        self.assertTupleEqual(card.shape[:2], mask.shape)
+        self.assertTrue(mask.any())
+        saved_at = os.path.getmtime(card_path)
+        _ = ppf.process_photos("./unittest_data/test_photos")
+        self.assertEqual(saved_at, os.path.getmtime(card_path))
+        shutil.rmtree(PROCESSED_PHOTOS_DIR)
+
+    def test_incremental_and_parallel_processing(self) -> None:
+        """
+        Test if adding a photo only processes this photo, if workers > 1 save the same cards as the serial processing
+        and if photos with the same name but another extension are rejected. Otherwise the test fails.
+        """
+        PHOTOS_DIRS = [
+            str(os.getcwd()) + "/unittest_data/test_photos_serial",
+            str(os.getcwd()) + "/unittest_data/test_photos_parallel",
+        ]
+        photo_paths = sorted(glob("./unittest_data/test_photos/*.jpg"))
+        for PHOTOS_DIR in PHOTOS_DIRS:
+            os.makedirs(PHOTOS_DIR)
+            for photo_path in photo_paths[:-1]:
+                shutil.copy2(photo_path, PHOTOS_DIR)
+        SERIAL_PROCESSED_DIR = ppf.process_photos(PHOTOS_DIRS[0])
+        saved_at = {
+            card_path: os.stat(card_path).st_mtime_ns
+            for card_path in glob(SERIAL_PROCESSED_DIR + "/*.png")
+        }
+        self.assertEqual(len(saved_at), len(photo_paths) - 1)
+        shutil.copy2(photo_paths[-1], PHOTOS_DIRS[0])
+        _ = ppf.process_photos(PHOTOS_DIRS[0])
+        card_paths = sorted(glob(SERIAL_PROCESSED_DIR + "/*.png"))
+        self.assertEqual(len(card_paths), len(photo_paths))
+        for card_path, saved_at_ns in saved_at.items():
+            self.assertEqual(os.stat(card_path).st_mtime_ns, saved_at_ns)
+
+        shutil.copy2(photo_paths[-1], PHOTOS_DIRS[1])
+        PARALLEL_PROCESSED_DIR = ppf.process_photos(PHOTOS_DIRS[1], workers=2)
+        self.assertEqual(len(glob(PARALLEL_PROCESSED_DIR + "/*.png")), len(card_paths))
+        for card_path in card_paths:
+            serial_card = cv.imread(card_path, cv.IMREAD_UNCHANGED)
+            parallel_card = cv.imread(
+                card_path.replace(SERIAL_PROCESSED_DIR, PARALLEL_PROCESSED_DIR),
+                cv.IMREAD_UNCHANGED,
+            )
+            self.assertTrue(np.array_equal(serial_card, parallel_card))
+
+        shutil.copy2(photo_paths[0], PHOTOS_DIRS[0] + "/ea.png")
+        with self.assertRaises(ValueError):
+            ppf.process_photos(PHOTOS_DIRS[0])
+        for PHOTOS_DIR in PHOTOS_DIRS:
+            shutil.rmtree(PHOTOS_DIR)
+            shutil.rmtree(PHOTOS_DIR + "_processed")
+
+
+def add_exif_thumbnail(encoded_image: bytes, thumbnail: bytes) -> bytes:
+    """
+    Return the JPEG image with an EXIF segment holding a JPEG thumbnail, as written by many cameras.
+    """
+    # TIFF header, an empty IFD0 and an IFD1 with offset and length of the thumbnail, which follows at offset 44
+    tiff = (
+        b"II*\x00"
+        + struct.pack("<I", 8)
+        + struct.pack("<HI", 0, 14)
+        + struct.pack("<H", 2)
+        + struct.pack("<HHII", 0x0201, 4, 1, 44)
+        + struct.pack("<HHII", 0x0202, 4, 1, len(thumbnail))
+        + struct.pack("<I", 0)
+        + thumbnail
+    )
+    exif = b"Exif\x00\x00" + tiff
+    return (
+        encoded_image[:2]
+        + b"\xff\xe1"
+        + struct.pack(">H", len(exif) + 2)
+        + exif
+        + encoded_image[2:]
+    )
+
+
+def load_test_frames() -> list:
+    """
+    Return the test backgrounds as JPEG encoded frames.
+    """
+    frames = list()
+    for path in sorted(glob("./unittest_data/test_backgrounds/*/*.jpg")):
+        with open(path, "rb") as file:
+            frames.append(file.read())
+    return frames
+
+
+class CameraStandIn(BaseHTTPRequestHandler):
+    """
+    Serves the test frames like the IP Webcam app: as snapshot and as MJPEG stream. The frames are set by the test.
+    """
+
+    frames = list()
+
+    def do_GET(self) -> None:
+        self.send_response(200)
+        if self.path == "/shot.jpg":
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(self.frames[0])))
+            self.end_headers()
+            self.wfile.write(self.frames[0])
+            return
+        self.send_header("Content-Type", "multipart/x-mixed-replace;boundary=frame")
+        self.end_headers()
+        for frame in self.frames:
+            self.wfile.write(
+                b"--frame\r\nContent-Type: image/jpeg\r\n"
+                + f"Content-Length: {len(frame)}\r\n\r\n".encode()
+                + frame
+                + b"\r\n"
+            )
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class TestCameraCapture(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        CameraStandIn.frames = load_test_frames()
+
+    def test_frame_grabber(self) -> None:
+        """
+        Test if the frame grabber reads the frames of a local stand-in for the IP Webcam, as stream and as
+        snapshots, and if the MJPEG stream is split into the original images. Otherwise the test fails.
+        """
+        server = ThreadingHTTPServer(("127.0.0.1", 0), CameraStandIn)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        camera_url = f"http://127.0.0.1:{server.server_address[1]}"
+        for use_stream in (True, False):
+            frame_grabber = FrameGrabber(camera_url, use_stream, timeout=2.0).start()
+            frame, _ = frame_grabber.read()
+            self.assertIn(frame, CameraStandIn.frames)
+            image = cv.imdecode(np.frombuffer(frame, dtype=np.uint8), cv.IMREAD_COLOR)
+            self.assertEqual(image.ndim, 3)
+            frame_grabber.stop()
+        server.shutdown()
+        server.server_close()
+
+        stream = b"".join(
+            b"--frame\r\n\r\n" + frame + b"\r\n" for frame in CameraStandIn.frames
+        )
+        chunks = [stream[i : i + 1000] for i in range(0, len(stream), 1000)]
+        self.assertListEqual(list(iter_mjpeg_frames(chunks)), CameraStandIn.frames)
+
+    def test_mjpeg_thumbnail(self) -> None:
+        """
+        Test if frames with a JPEG thumbnail in their EXIF segment are read whole, by the Content-Length of their part
+        in the MJPEG stream. Otherwise the test fails.
+        """
+        image = np.full((120, 160, 3), 200, dtype=np.uint8)
+        thumbnail = cv.imencode(".jpg", image[::8, ::8])[1].tobytes()
+        frames = [
+            add_exif_thumbnail(cv.imencode(".jpg", image // i)[1].tobytes(), thumbnail)
+            for i in (1, 2, 3)
+        ]
+        self.assertEqual(
+            get_boundary('multipart/x-mixed-replace; boundary="--frame"'), "frame"
+        )
+        stream = b"".join(
+            b"--frame\r\nContent-Type: image/jpeg\r\n"
+            + f"Content-Length: {len(frame)}\r\n\r\n".encode()
+            + frame
+            + b"\r\n"
+            for frame in frames
+        )
+        chunks = [stream[i : i + 100] for i in range(0, len(stream), 100)]
+        self.assertListEqual(list(iter_mjpeg_frames(chunks, "frame")), frames)
+        self.assertTupleEqual(get_jpeg_size(frames[0]), (120, 160))
+        decoded_image = cv.imdecode(np.frombuffer(frames[0], np.uint8), cv.IMREAD_COLOR)
+        self.assertTupleEqual(decoded_image.shape, image.shape)
+
+    def test_frame_decoding(self) -> None:
+        """
+        Test if the size of a frame is read from its JPEG header and if frames are decoded at the smallest scale
+        that is still as large as the input of the model. Otherwise the test fails.
+        """
+        image = np.zeros((1080, 1920, 3), dtype=np.uint8)
+        cv.rectangle(image, (800, 400), (1120, 680), (0, 0, 255), -1)
+        encoded_image = cv.imencode(".jpg", image)[1].tobytes()
+        self.assertTupleEqual(get_jpeg_size(encoded_image), (1080, 1920))
+        self.assertIsNone(get_jpeg_size(b"\xff\xd8\x00"))
+        self.assertEqual(get_scale_factor((1080, 1920), 640), 2)
+        self.assertEqual(get_scale_factor((2160, 3840), 640), 4)
+        self.assertEqual(get_scale_factor((480, 640), 640), 1)
+
+        # a region of half the width and height is kept as large as the input of the model
+        frame_decoder = FrameDecoder(640, use_turbo_jpeg=False)
+        self.assertEqual(frame_decoder.get_scale_factor(encoded_image), 2)
+        region = (0.25, 0.25, 0.75, 0.75)
+        self.assertEqual(frame_decoder.get_scale_factor(encoded_image, region), 1)
+
+        for target_size, expected_shape in ((640, (540, 960, 3)), (None, image.shape)):
+            decoded_image = FrameDecoder(target_size, use_turbo_jpeg=False).decode(
+                encoded_image
+            )
+            self.assertTupleEqual(decoded_image.shape, expected_shape)
+            height, width = decoded_image.shape[:2]
+            self.assertGreater(decoded_image[height // 2, width // 2, 2], 200)
+        self.assertIsNone(FrameDecoder(use_turbo_jpeg=False).decode(b"no image"))
+
+
+class StandInModel:
+    """
+    Detects the same cards on every image, with the interface of an ultralytics YOLO model. Keeps the batch sizes.
+    """
+
+    names = {0: "h6", 1: "sa"}
+
+    def __init__(self) -> None:
+        self.batch_sizes = list()
+
+    def __call__(self, source, conf: float, verbose: bool, imgsz: int = 640) -> list:
+        boxes = SimpleNamespace(
+            xyxy=np.array([[10.0, 10.0, 50.0, 80.0], [60.0, 10.0, 100.0, 80.0]]),
+            conf=np.array([0.9, 0.8]),
+            cls=np.array([0.0, 1.0]),
+        )
+        boxes.cpu = boxes.numpy = lambda: boxes
+        batch_size = len(source) if isinstance(source, list) else 1
+        self.batch_sizes.append(batch_size)
+        return [SimpleNamespace(boxes=boxes)] * batch_size
+
+
+class ScaledStandInModel(StandInModel):
+    """
+    Detects a card at the same place of the table on every image, at the resolution of the image.
+    """
+
+    def __call__(self, source, conf: float, verbose: bool, imgsz: int = 640) -> list:
+        height, width = source.shape[:2]
+        boxes = SimpleNamespace(
+            xyxy=np.array([[0.25 * width, 0.25 * height, 0.5 * width, 0.75 * height]]),
+            conf=np.array([0.97]),
+            cls=np.array([0.0]),
+        )
+        boxes.cpu = boxes.numpy = lambda: boxes
+        return [SimpleNamespace(boxes=boxes)]
+
+
+class ListFrameSource:
+    """
+    Frame source returning the JPEG encoded test backgrounds, one after another.
+    """
+
+    def __init__(self) -> None:
+        self.frames = load_test_frames()
+
+    def read(self, timeout: float = None):
+        if not self.frames:
+            time.sleep(timeout)
+            return None
+        return self.frames.pop(0), time.time()
+
+
+class TestDetectionEngine(unittest.TestCase):
+    def test_game_state(self) -> None:
+        """
+        Test if played cards are only counted once and if the plays are scored. Otherwise the test fails.
+        """
+        game_state = GameState()
+        self.assertFalse(game_state.update(["h6"]))
+        self.assertListEqual(game_state.current_play, [])
+        game_state.start(number_of_players=2, trump="h")
+        self.assertFalse(game_state.update(["h6"]))
+        self.assertFalse(game_state.update(["h6"]))
+        self.assertListEqual(game_state.current_play, ["h6"])
+        self.assertTrue(game_state.update(["sa"]))
+        self.assertEqual(sum(game_state.get_scores().values()), 11)
+        game_state.reset()
+        self.assertFalse(game_state.update(["h6"]))
+
+    def test_card_tracker(self) -> None:
+        """
+        Test on recorded detection sequences if confident cards are played after fewer frames than uncertain ones,
+        if flickering and moving detections are held back and if a card is only played once. Otherwise the test fails.
+        """
+        box = [100.0, 100.0, 150.0, 180.0]
+        other_box = [300.0, 100.0, 350.0, 180.0]
+
+        def get_played_frames(sequence, card_tracker=None):
+            card_tracker = card_tracker or CardTracker()
+            played_frames = list()
+            for frame_index, detections in enumerate(sequence):
+                boxes = [detection[0] for detection in detections]
+                confidences = [detection[1] for detection in detections]
+                card_classes = [detection[2] for detection in detections]
+                for card_class in card_tracker.update(boxes, confidences, card_classes):
+                    played_frames.append((frame_index, card_class))
+            return played_frames
+
+        # a confident card is played in the second frame, an uncertain one needs five frames
+        sequence = [[(box, 0.97, 3), (other_box, 0.72, 7)]] * 8
+        self.assertListEqual(get_played_frames(sequence), [(1, 3), (4, 7)])
+        # a second, less confident box of the same class does not count twice
+        sequence = [[(box, 0.97, 3), (other_box, 0.5, 3)]] * 3
+        self.assertListEqual(get_played_frames(sequence), [(1, 3)])
+        # a single missed frame delays the card, a flickering card is never played
+        sequence = [[(box, 0.75, 5)], [(box, 0.75, 5)], [], [(box, 0.75, 5)]] + [
+            [(box, 0.75, 5)]
+        ] * 3
+        self.assertListEqual(get_played_frames(sequence), [(5, 5)])
+        sequence = [[(box, 0.75, 5)], []] * 10
+        self.assertListEqual(get_played_frames(sequence), [])
+        # detections at another place start over
+        sequence = [[(box, 0.97, 3)], [(other_box, 0.97, 3)], [(other_box, 0.97, 3)]]
+        self.assertListEqual(get_played_frames(sequence), [(2, 3)])
+        # no empty detections or reset needed to keep played cards from being played again
+        card_tracker = CardTracker()
+        sequence = [[(box, 0.97, 3)]] * 2 + [[]] * 3 + [[(box, 0.97, 3)]] * 2
+        self.assertListEqual(get_played_frames(sequence, card_tracker), [(1, 3)])
+        card_tracker.reset()
+        self.assertListEqual(get_played_frames(sequence, card_tracker), [(1, 3)])
+
+    def test_engine_stages(self) -> None:
+        """
+        Test if a frame passes all stages of the detection engine without the user interface. Otherwise the test fails.
+        """
+        game_state = GameState()
+        game_state.start(number_of_players=2, trump="h")
+        engine = DetectionEngine(ListFrameSource(), StandInModel(), game_state)
+        subscription = engine.start().subscribe()
+        frame = subscription.get(timeout=10.0)
+        engine.stop()
+        self.assertIsNotNone(frame)
+        self.assertListEqual(frame.detected_cards, ["h6", "sa"])
+        image = cv.imdecode(
+            np.frombuffer(frame.preview_image, dtype=np.uint8), cv.IMREAD_COLOR
+        )
+        self.assertEqual(image.ndim, 3)
+        self.assertSetEqual(
+            set(frame.stage_times), {"decode", "infer", "track", "score", "render"}
+        )
+        self.assertIsNone(engine.last_error)
+
+    def test_idle_engine(self) -> None:
+        """
+        Test if the engine stops its frame source while nobody reads its frames, resumes it for a subscriber and stops it
+        together with the engine. Otherwise the test fails.
+        """
+
+        class StoppableFrameSource(ListFrameSource):
+            running = False
+
+            def start(self):
+                self.running = True
+                return self
+
+            def stop(self):
+                self.running = False
+
+        frame_source = StoppableFrameSource()
+        engine = DetectionEngine(frame_source, StandInModel(), idle_timeout=0.5)
+        engine.start()
+        self.assertTrue(frame_source.running)
+        time.sleep(1.0)
+        self.assertTrue(engine.is_idle())
+        self.assertFalse(frame_source.running)
+        engine.subscribe().get(timeout=0.1)
+        time.sleep(0.3)
+        self.assertTrue(frame_source.running)
+        engine.stop()
+        self.assertFalse(frame_source.running)
+
+    def test_motion_gate(self) -> None:
+        """
+        Test if the model only runs on changed frames and periodically on static ones, and if the detections of skipped
+        frames are reused. Otherwise the test fails.
+        """
+        motion_gate = MotionGate(max_skipped_frames=3)
+        image = cv.imread(sorted(glob("./unittest_data/test_backgrounds/*/*.jpg"))[0])
+        noisy_image = cv.add(image, np.full_like(image, 2))
+        changed_image = image.copy()
+        changed_image[:100, :100] = 255 - changed_image[:100, :100]
+        should_infer = [
+            motion_gate.should_infer(frame)
+            for frame in (image, noisy_image, image, image, image, changed_image)
+        ]
+        self.assertListEqual(should_infer, [True, False, False, False, True, True])
+        self.assertDictEqual(
+            motion_gate.get_counters(),
+            {"inferred_frames": 3, "skipped_frames": 3, "rechecks": 1},
+        )
+
+        engine = DetectionEngine(
+            ListFrameSource(), StandInModel(), motion_gate=MotionGate()
+        )
+        frame = Frame(0, 0.0, None)
+        frame.image = image
+        self.assertFalse(engine._infer(frame).inference_skipped)
+        frame = Frame(1, 0.0, None)
+        frame.image = image
+        self.assertTrue(engine._infer(frame).inference_skipped)
+        self.assertIs(frame.detections, engine.last_detections)
+
+    def test_table_roi(self) -> None:
+        """
+        Test if the region is inferred from the detections, if the input size is lowered while the detections are
+        confident and raised when cards are lost, and if boxes are mapped back to the full frame. Otherwise the test fails.
+        """
+        table_roi = TableRoi(
+            margin=0.0, full_frame_interval=100, image_sizes=(320, 640), patience=2
+        )
+        self.assertTupleEqual(table_roi.get_region((480, 640, 3)), (0, 0, 640, 480))
+        boxes = np.array([[100.0, 50.0, 200.0, 150.0], [300.0, 60.0, 400.0, 160.0]])
+        table_roi.update(boxes, np.array([0.9, 0.9]), (480, 640, 3))
+        self.assertTupleEqual(table_roi.get_region((480, 640, 3)), (100, 50, 400, 160))
+        # frames decoded at another scale
+        self.assertTupleEqual(
+            table_roi.get_region((960, 1280, 3)), (200, 100, 800, 320)
+        )
+        self.assertEqual(table_roi.get_relative_region()[2], 400 / 640)
+        self.assertEqual(table_roi.get_image_size((1000, 1000, 3)), 640)
+        table_roi.update(boxes, np.array([0.9, 0.9]), (480, 640, 3))
+        self.assertEqual(table_roi.get_image_size((1000, 1000, 3)), 320)
+        table_roi.update(boxes[:1], np.array([0.9]), (480, 640, 3))
+        self.assertEqual(table_roi.get_image_size((1000, 1000, 3)), 640)
+        # no upscaling of small crops
+        self.assertEqual(table_roi.get_image_size((110, 300, 3)), 320)
+        table_roi = TableRoi(roi=(0.5, 0.5, 1.0, 1.0))
+        self.assertTupleEqual(table_roi.get_region((480, 640, 3)), (320, 240, 640, 480))
+
+        engine = DetectionEngine(ListFrameSource(), StandInModel(), table_roi=table_roi)
+        frame = Frame(0, 0.0, None)
+        frame.image = np.zeros((480, 640, 3), dtype=np.uint8)
+        engine._infer(frame)
+        self.assertListEqual(
+            frame.detections.boxes[0].tolist(), [330.0, 250.0, 370.0, 320.0]
+        )
+        self.assertEqual(frame.image_size, 320)
+
+        # the region of the table is decoded as large as the input of the model, not the whole frame
+        model = StandInModel()
+        model.overrides = {"imgsz": 320}
+        engine = DetectionEngine(ListFrameSource(), model, table_roi=table_roi)
+        self.assertEqual(engine.frame_decoder.target_size, 320)
+        frame = Frame(0, 0.0, cv.imencode(".jpg", np.zeros((1080, 1920, 3)))[1])
+        engine._decode(frame)
+        self.assertTupleEqual(frame.image.shape, (540, 960, 3))
+        self.assertTupleEqual(frame.region, (480, 270, 960, 540))
+
+    def test_decode_scales(self) -> None:
+        """
+        Test if a card is tracked as the same card over frames decoded at different scales, because the detections are
+        kept in coordinates of the full-size frame. Otherwise the test fails.
+        """
+        game_state = GameState()
+        game_state.start(number_of_players=2, trump="h")
+        engine = DetectionEngine(ListFrameSource(), ScaledStandInModel(), game_state)
+        encoded_image = cv.imencode(".jpg", np.zeros((1080, 1920, 3)))[1]
+        engine.frame_decoder.target_size = None
+        first_frame = engine.process(0, 0.0, encoded_image)
+        engine.frame_decoder.target_size = 320
+        second_frame = engine.process(1, 0.0, encoded_image)
+        self.assertEqual(first_frame.scale_factor, 1)
+        self.assertEqual(second_frame.scale_factor, 4)
+        self.assertListEqual(
+            second_frame.detections.boxes.tolist(), [[480.0, 270.0, 960.0, 810.0]]
+        )
+        self.assertListEqual(second_frame.played_cards, ["h6"])
+
+    def test_batched_inference(self) -> None:
+        """
+        Test if frames submitted at the same time are run as one batch and if every table keeps its own game state.
+        Otherwise the test fails.
+        """
+        model = StandInModel()
+        batched_model = BatchedModel(model, max_batch_size=3, max_wait=1.0)
+        image = np.zeros((64, 64, 3), dtype=np.uint8)
+        results = list()
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    batched_model(source=image, conf=0.7, verbose=False)
+                )
+            )
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertListEqual(model.batch_sizes, [3])
+        self.assertEqual(len(results), 3)
+        self.assertEqual(len(results[0]), 1)
+        self.assertEqual(batched_model.get_mean_batch_size(), 3)
+
+        batched_model = BatchedModel(StandInModel())
+        engines = [
+            DetectionEngine(ListFrameSource(), batched_model).start() for _ in range(2)
+        ]
+        engines[0].game_state.start(number_of_players=2, trump="h")
+        for engine in engines:
+            self.assertIsNotNone(engine.subscribe().get(timeout=10.0))
+            engine.stop()
+            self.assertIsNone(engine.last_error)
+        self.assertTrue(engines[0].game_state.running)
+        self.assertFalse(engines[1].game_state.running)
+        now = time.perf_counter()
+        engines[0].output_times.clear()
+        engines[0].output_times.extend([now - 1.0, now - 0.5, now])
+        self.assertAlmostEqual(engines[0].get_fps(), 2.0)
+
+    def test_recording_replay(self) -> None:
+        """
+        Test if a recorded clip is replayed with the frames and timing of the recording and if replaying it through
+        the detection engine always leads to the same scores. Otherwise the test fails.
+        """
+        CLIP_DIR = "./unittest_data/test_clip"
+        shutil.rmtree(CLIP_DIR, ignore_errors=True)
+        frames = ListFrameSource().frames
+        recorder = FrameRecorder(CLIP_DIR, frames_per_chunk=3)
+        for i, frame in enumerate(frames):
+            recorder.add(frame, 100.0 + 0.1 * i)
+        recorder.close()
+        self.assertEqual(recorder.number_of_chunks, -(-len(frames) // 3))
+        self.assertListEqual(
+            list(iter_clip(CLIP_DIR)),
+            [(frame, 100.0 + 0.1 * i) for i, frame in enumerate(frames)],
+        )
+
+        frame_source = ReplayFrameSource(CLIP_DIR, real_time=True)
+        capture_times = [frame_source.read()[1] for _ in frames]
+        self.assertAlmostEqual(
+            capture_times[-1] - capture_times[0], 0.1 * (len(frames) - 1), places=1
+        )
+        self.assertIsNone(frame_source.read(timeout=0.0))
+        self.assertTrue(frame_source.finished.is_set())
+
+        replayed_scores = list()
+        for _ in range(2):
+            game_state = GameState()
+            game_state.start(number_of_players=2, trump="h")
+            engine = DetectionEngine(None, StandInModel(), game_state)
+            for frame_index, (encoded_image, capture_time) in enumerate(
+                iter_clip(CLIP_DIR)
+            ):
+                frame = engine.process(frame_index, capture_time, encoded_image)
+            self.assertIs(engine.output, frame)
+            replayed_scores.append(game_state.get_scores())
+        self.assertEqual(sum(replayed_scores[0].values()), 11)
+        self.assertDictEqual(replayed_scores[0], replayed_scores[1])
+        shutil.rmtree(CLIP_DIR)
+
+    def test_preview_renderer(self) -> None:
+        """
+        Test if the preview is downscaled JPEG with the boxes drawn on it and if its frame rate is limited. Otherwise the test fails.
+        """
+        preview_renderer = PreviewRenderer(max_fps=5.0, max_size=320)
+        image = np.zeros((720, 960, 3), dtype=np.uint8)
+        detections = Detections(
+            np.array([[480.0, 360.0, 720.0, 600.0]]), np.array([0.9]), np.array([0])
+        )
+        preview_image = preview_renderer.render_if_due(
+            image, detections, StandInModel.names
+        )
+        preview = cv.imdecode(np.frombuffer(preview_image, np.uint8), cv.IMREAD_COLOR)
+        self.assertTupleEqual(preview.shape, (240, 320, 3))
+        # the box is drawn at the downscaled position only
+        self.assertGreater(preview[120:200, 160:240].max(), 0)
+        self.assertEqual(preview[:100, :100].max(), 0)
+        self.assertIsNone(
+            preview_renderer.render_if_due(image, detections, StandInModel.names)
+        )
+        time.sleep(0.2)
+        self.assertIsNotNone(
+            preview_renderer.render_if_due(image, detections, StandInModel.names)
+        )
+        self.assertEqual(preview_renderer.number_of_rendered_frames, 2)
+        self.assertEqual(preview_renderer.number_of_skipped_frames, 1)
+
+
+class TestModelExport(unittest.TestCase):
+    def test_detection_agreement(self) -> None:
+        """
+        Test if detections are compared by class and overlap of their boxes. Otherwise the test fails.
+        """
+        boxes = np.array([[0, 0, 10, 10], [20, 20, 40, 40]])
+        self.assertEqual(
+            model_export.get_detection_agreement(boxes, [1, 2], boxes, [1, 2]), 1.0
+        )
+        self.assertEqual(
+            model_export.get_detection_agreement(boxes, [1, 2], boxes + 1, [1, 3]), 0.5
+        )
+        self.assertEqual(model_export.get_detection_agreement([], [], boxes, [1, 2]), 0)
+
+    @unittest.skipUnless(find_spec("onnxruntime"), "needs onnxruntime")
+    def test_stand_in_onnx_export(self) -> None:
+        """
+        Test if the stand-in model exported to ONNX detects the same as the PyTorch model. Otherwise the test fails.
+        The untrained stand-in model is not confident about anything, so a very low confidence threshold is used to
+        have detections to compare.
+        """
+        ONNX_MODEL_PATH = model_export.export_model(model_export.STAND_IN_MODEL, "onnx")
+        image = cv.imread(glob("./unittest_data/test_backgrounds/*/*.jpg")[0])
+        detections = list()
+        for MODEL_PATH in (model_export.STAND_IN_MODEL, ONNX_MODEL_PATH):
+            model = model_export.load_model(MODEL_PATH)
+            result = model(source=image, conf=0.0001, verbose=False)[0]
+            detections.append(result.boxes.cpu().numpy())
+        self.assertGreater(len(detections[0].xyxy), 0)
+        agreement = model_export.get_detection_agreement(
+            detections[0].xyxy,
+            detections[0].cls,
+            detections[1].xyxy,
+            detections[1].cls,
+        )
+        self.assertGreater(agreement, 0.9)
+        os.remove(ONNX_MODEL_PATH)
+
+
+class TestMetrics(unittest.TestCase):
+    def test_metrics_export(self) -> None:
+        """
+        Test if durations and counters are exported in Prometheus text format, over HTTP and as JSONL, and if the
+        metrics of another process can be merged. Otherwise the test fails.
+        """
+        metrics_registry = metrics.MetricsRegistry()
+        histogram = metrics_registry.histogram("stage_seconds", "Stages", stage="infer")
+        for value in (0.002, 0.004, 0.02, 0.2):
+            histogram.observe(value)
+        metrics_registry.counter("frames_total", camera='a "b"').increase(3)
+        self.assertAlmostEqual(histogram.get_percentiles()["p50"], 0.012)
+        prometheus_text = metrics_registry.to_prometheus()
+        self.assertIn("# TYPE shel_stage_seconds histogram", prometheus_text)
+        self.assertIn(
+            'shel_stage_seconds_bucket{stage="infer",le="0.0025"} 1', prometheus_text
+        )
+        self.assertIn(
+            'shel_stage_seconds_bucket{stage="infer",le="0.025"} 3', prometheus_text
+        )
+        self.assertIn(
+            'shel_stage_seconds_bucket{stage="infer",le="+Inf"} 4', prometheus_text
+        )
+        self.assertIn('shel_stage_seconds_count{stage="infer"} 4', prometheus_text)
+        self.assertIn('shel_frames_total{camera="a \\"b\\""} 3', prometheus_text)
+
+        server = metrics.start_http_server(0, metrics_registry, host="127.0.0.1")
+        response = requests.get(f"http://127.0.0.1:{server.server_address[1]}/metrics")
+        server.shutdown()
+        server.server_close()
+        self.assertEqual(response.text, prometheus_text)
+
+        LOG_PATH = "./unittest_data/test_metrics.jsonl"
+        if os.path.exists(LOG_PATH):
+            os.remove(LOG_PATH)
+        metrics_registry.write_jsonl(LOG_PATH)
+        metrics_registry.write_jsonl(LOG_PATH)
+        with open(LOG_PATH) as file:
+            snapshots = [json.loads(line) for line in file]
+        os.remove(LOG_PATH)
+        self.assertEqual(len(snapshots), 2)
+        self.assertEqual(snapshots[0]["histograms"][0]["count"], 4)
+        self.assertEqual(snapshots[0]["counters"][0]["value"], 3)
+
+        # metrics of a worker process, sent to the main process
+        main_registry = metrics.MetricsRegistry()
+        main_registry.histogram("stage_seconds", stage="infer").observe(0.001)
+        main_registry.merge_updates(metrics_registry.pop_updates())
+        main_histogram = main_registry.histogram("stage_seconds", stage="infer")
+        self.assertEqual(main_histogram.count, 5)
+        self.assertAlmostEqual(main_histogram.sum, 0.227)
+        self.assertAlmostEqual(main_histogram.get_percentiles()["p50"], 0.004)
+        self.assertEqual(main_registry.counter("frames_total", camera='a "b"').value, 3)
+        self.assertEqual(histogram.count, 0)
+        self.assertListEqual(metrics_registry.pop_updates()["histograms"], [])
+
 
 class TestApplication(unittest.TestCase):
     def test_model_download(self) -> None:
@@ -91,6 +1124,16 @@ class TestApplication(unittest.TestCase):
         shutil.rmtree(DATASET_DIR)
         shutil.rmtree(PROCESSED_PHOTOS_DIR)
 
+    def test_model_is_loaded_once(self) -> None:
+        """
+        Test if the model is loaded and warmed up once per process and then shared. Otherwise the test fails.
+        """
+        MODEL_PATH = dbm.get_model()
+        loaded_model = model_store.get_loaded_model(MODEL_PATH, background=True)
+        model = loaded_model.wait(timeout=120)
+        self.assertIs(model_store.get_loaded_model(MODEL_PATH).wait(), model)
+        self.assertIsNotNone(loaded_model.get_statistics()["warmup_seconds"])
+
     def test_jass_scoring(self) -> None:
         """
         Test if the score keeping of Jassa works correctly, by playing a game and checking if sum of points is 157. Otherwise the test fails.
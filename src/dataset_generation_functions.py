@@ -9,14 +9,34 @@ The dataset is saved in a directory given by the user.
 """
 
 import cv2 as cv
-from pathlib import Path
 import os
 import random as rand
 import imutils
 import numpy as np
+import time
+import metrics
 import photo_preparation_functions as ppf
+import card_compositing as cc
+from asset_store import AssetStore, BACKGROUND_SIZE, get_image_paths, get_image_name
+from card_placement import CardPlacement
+from dataset_shards import ShardWriter
+from dataset_writer import DatasetWriter, encode_image
+from generation_progress import GenerationProgress
+from sprite_atlas import SpriteAtlas
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from tqdm import tqdm
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Dict, Callable, Iterator
+
+# settings of the current dataset generation, set once per process (see init_worker)
+_generation_config = dict()
+
+
+def timed_stage(stage: str):
+    """
+    Report the duration of a stage of the dataset generation to the metrics of the process (see metrics.py).
+    """
+    return metrics.registry.timed("generation_seconds", stage=stage)
 
 
 def transform_coordinates_to_relative_values(bounding_box: Tuple, image) -> Tuple:
@@ -54,24 +74,31 @@ def overlay_images(image, card, mask, bounding_box: Tuple):
     return image
 
 
-def get_adjusted_bounding_box_and_card_and_mask(
-    proposed_bounding_box: Tuple, card, mask, image
-) -> Tuple:
+def get_edge_adjustments(proposed_bounding_box: Tuple, image) -> Tuple:
     """
-    Return adjusted bounding box, card and mask, in case the position is on the edge of the backgound.
+    Return the number of pixels the bounding box stands over the image edges, as x_max, x_min, y_max and y_min adjustment.
     """
     image_height, image_width, _ = image.shape
-    card_height, card_width, _ = card.shape
     pbb_x_min, pbb_x_max, pbb_y_min, pbb_y_max = get_min_max_bounding_box_coordinates(
         proposed_bounding_box
     )
-
-    # get number of pixels that stand over the image edges for each side
     x_adjustment_max = max(0, pbb_x_max - image_width)
     x_adjustment_min = min(0, pbb_x_min)
     y_adjustment_max = max(0, pbb_y_max - image_height)
     y_adjustment_min = min(0, pbb_y_min)
-    # adjust bounding box accordingly
+    return x_adjustment_max, x_adjustment_min, y_adjustment_max, y_adjustment_min
+
+
+def get_adjusted_bounding_box(proposed_bounding_box: Tuple, image) -> Tuple:
+    """
+    Return the bounding box adjusted to the part inside the image, in case the position is on the edge of the background.
+    """
+    (
+        x_adjustment_max,
+        x_adjustment_min,
+        y_adjustment_max,
+        y_adjustment_min,
+    ) = get_edge_adjustments(proposed_bounding_box, image)
     adjusted_x_pos = int(
         proposed_bounding_box[0]
         - np.ceil(x_adjustment_max / 2)
@@ -84,6 +111,25 @@ def get_adjusted_bounding_box_and_card_and_mask(
     )
     adjusted_width = proposed_bounding_box[2] - x_adjustment_max + x_adjustment_min
     adjusted_height = proposed_bounding_box[3] - y_adjustment_max + y_adjustment_min
+    return (adjusted_x_pos, adjusted_y_pos, adjusted_width, adjusted_height)
+
+
+def get_adjusted_bounding_box_and_card_and_mask(
+    proposed_bounding_box: Tuple, card, mask, image
+) -> Tuple:
+    """
+    Return adjusted bounding box, card and mask, in case the position is on the edge of the backgound.
+    """
+    card_height, card_width, _ = card.shape
+    # get number of pixels that stand over the image edges for each side
+    (
+        x_adjustment_max,
+        x_adjustment_min,
+        y_adjustment_max,
+        y_adjustment_min,
+    ) = get_edge_adjustments(proposed_bounding_box, image)
+    # adjust bounding box accordingly
+    adjusted_bounding_box = get_adjusted_bounding_box(proposed_bounding_box, image)
     # crop card and card-mask to fit the new bounding box
     adjusted_card = card[
         (-y_adjustment_min) : (card_height - y_adjustment_max),
@@ -94,11 +140,7 @@ def get_adjusted_bounding_box_and_card_and_mask(
         -x_adjustment_min : (card_width - x_adjustment_max),
     ]
 
-    return (
-        (adjusted_x_pos, adjusted_y_pos, adjusted_width, adjusted_height),
-        adjusted_card,
-        adjusted_mask,
-    )
+    return adjusted_bounding_box, adjusted_card, adjusted_mask
 
 
 def get_min_max_bounding_box_coordinates(bounding_box: Tuple) -> Tuple:
@@ -112,80 +154,43 @@ def get_min_max_bounding_box_coordinates(bounding_box: Tuple) -> Tuple:
     return bb_x_min, bb_x_max, bb_y_min, bb_y_max
 
 
-def no_bounding_boxes_overlap(
-    bounding_boxes: List, proposed_bounding_box: Tuple, image
-) -> bool:
-    """
-    Return a bool that indicates if the new bounding box overlapps with the existing ones.
-    """
-    no_bb_overlap = True
-    image_height, image_width, _ = image.shape
-    pbb_x_min, pbb_x_max, pbb_y_min, pbb_y_max = get_min_max_bounding_box_coordinates(
-        proposed_bounding_box
-    )
-
-    # check if new bounding box overlaps image edges
-    if (
-        (pbb_x_min < 0)
-        or (pbb_x_max > image_width)
-        or (pbb_y_min < 0)
-        or (pbb_y_max > image_height)
-    ):
-        no_bb_overlap = False
-    # check if new bounding box overlaps other bounding boxes
-    for bounding_box in bounding_boxes:
-        bb_x_min, bb_x_max, bb_y_min, bb_y_max = get_min_max_bounding_box_coordinates(
-            bounding_box
-        )
-        if (
-            (bb_x_min < pbb_x_max)
-            and (pbb_x_min < bb_x_max)
-            and (bb_y_min < pbb_y_max)
-            and (pbb_y_min < bb_y_max)
-        ):
-            no_bb_overlap = False
-            break
-    return no_bb_overlap
-
-
-def place_card(image, card, mask, overlapping: bool, bounding_boxes: List) -> Tuple:
+def place_card(
+    image, card, mask, overlapping: bool, bounding_boxes: List, rng=rand
+) -> Tuple:
     """
     Return a tuple containing the image with a newly placed card and the updated list of bounding boxes.
     """
-    card_placed = False
-    max_tries = 50
-    tries = 0
     image_height, image_width, _ = image.shape
     card_height, card_width, _ = card.shape
-
-    # try to place card, if no success (due to overlapping) stop after max_tries
-    while (not card_placed) and (tries < max_tries):
-        x_pos = rand.randint(0, image_width - 1)
-        y_pos = rand.randint(0, image_height - 1)
-        proposed_bounding_box = (x_pos, y_pos, card_width, card_height)
-
-        if (
-            no_bounding_boxes_overlap(bounding_boxes, proposed_bounding_box, image)
-        ) or overlapping:
-            # adjust bounding box, if it reaches over the edges of the image
-            bounding_box, card, mask = get_adjusted_bounding_box_and_card_and_mask(
-                proposed_bounding_box, card, mask, image
-            )
-            bounding_boxes.append(bounding_box)
-            image = overlay_images(image, card, mask, bounding_box)
-            card_placed = True
-        else:
-            tries += 1
+    placement = CardPlacement(image_height, image_width, overlapping)
+    for bounding_box in bounding_boxes:
+        placement.add(bounding_box)
+    proposed_bounding_box = placement.find_position(card_width, card_height, rng)
+    if proposed_bounding_box is not None:
+        # adjust bounding box, if it reaches over the edges of the image
+        bounding_box, card, mask = get_adjusted_bounding_box_and_card_and_mask(
+            proposed_bounding_box, card, mask, image
+        )
+        bounding_boxes.append(bounding_box)
+        image = overlay_images(image, card, mask, bounding_box)
     return image, bounding_boxes
 
 
 def transform_card(
-    image, card, size: float, rotation: float, alpha: float, beta: float
+    image,
+    card,
+    size: float,
+    rotation: float,
+    alpha: float,
+    beta: float,
+    card_mask=None,
 ) -> Tuple:
     """
     Return a tuple containing a transformed card and the corresponding mask.
+    The mask is only computed, if no stored mask of the card is given.
     """
-    card_mask = ppf.create_mask(card)
+    if card_mask is None:
+        card_mask = ppf.create_mask(card)
 
     image_height, _, _ = image.shape
     ratio = card.shape[1] / card.shape[0]
@@ -200,85 +205,262 @@ def transform_card(
     return card, card_mask
 
 
-def place_cards(
+def compose_image(
     background,
     cards: List,
     card_classes: List,
     max_size: float,
     min_size: float,
     overlapping: bool,
+    rng=rand,
+    card_masks: List = None,
+    fused: bool = True,
 ) -> Tuple:
     """
-    Place selected cards on the background. Returns a tuple containing this image and a list with the according bounding boxes.
+    Place selected cards on the background. Returns a tuple containing this image, the normalized bounding boxes
+    (center x, center y, width, height) of the placed cards as N x 4 array and their classes as array of length N.
+    By default the cards are placed with the fused compositing engine, fused=False transforms them step by step.
     """
+    if fused:
+        sprite_placements, labels = get_sprite_placements(
+            background,
+            cards,
+            card_classes,
+            max_size,
+            min_size,
+            overlapping,
+            rng,
+            card_masks,
+        )
+        with timed_stage("compositing"):
+            for sprite, origin, alpha, beta in sprite_placements:
+                cc.composite_sprite(background, sprite, origin, alpha, beta)
+        return background, labels[:, 1:], labels[:, 0].astype(np.int64)
+
     image = background
-    bounding_boxes = list()
-    for card in cards:
-        size = rand.uniform(min_size, max_size)
-        rotation = rand.uniform(0, 360)
+    image_height, image_width, _ = image.shape
+    placement = CardPlacement(image_height, image_width, overlapping)
+    placed_card_classes = list()
+    if card_masks is None:
+        card_masks = [None] * len(cards)
+    for card, card_mask, card_class in zip(cards, card_masks, card_classes):
+        size = rng.uniform(min_size, max_size)
+        rotation = rng.uniform(0, 360)
         # alpha and beta to change image brightness in next step
-        alpha = rand.uniform(0.5, 1.5)
-        beta = rand.uniform(-50, 50)
+        alpha = rng.uniform(0.5, 1.5)
+        beta = rng.uniform(-50, 50)
 
         transformed_card, transformed_card_mask = transform_card(
-            image, card, size, rotation, alpha, beta
+            image, card, size, rotation, alpha, beta, card_mask
         )
-        image, bounding_boxes = place_card(
-            image, transformed_card, transformed_card_mask, overlapping, bounding_boxes
+        card_height, card_width, _ = transformed_card.shape
+
+        proposed_bounding_box = placement.find_position(card_width, card_height, rng)
+        # skip cards that do not fit on the image anymore, only placed cards get a label
+        if proposed_bounding_box is None:
+            continue
+        placed_card_classes.append(card_class)
+        # adjust bounding box, if it reaches over the edges of the image
+        bounding_box, card, mask = get_adjusted_bounding_box_and_card_and_mask(
+            proposed_bounding_box, transformed_card, transformed_card_mask, image
         )
+        placement.add(bounding_box)
+        image = overlay_images(image, card, mask, bounding_box)
+
+    return (
+        image,
+        placement.get_relative_bounding_boxes(),
+        np.array(placed_card_classes, dtype=np.int64),
+    )
 
-    # create labels in the format needed by YOLO
+
+def get_sprite_placements(
+    background,
+    cards: List,
+    card_classes: List,
+    max_size: float,
+    min_size: float,
+    overlapping: bool,
+    rng=rand,
+    card_masks: List = None,
+    sprite_atlas: SpriteAtlas = None,
+) -> Tuple:
+    """
+    Find a position for every selected card on the background and transform the placed cards to sprites.
+    With a sprite atlas, the cards are given as their indices in the atlas and the pre-rendered sprites are used.
+    Returns a tuple containing a list of sprite placements (BGRA sprite, position of its top left corner, alpha and
+    beta) and the labels of the placed cards as (N, 5) array of class and normalized bounding box.
+    """
+    image_height, image_width, _ = background.shape
+    placement = CardPlacement(image_height, image_width, overlapping)
+    placed_card_classes = list()
+    sprite_placements = list()
+    if (card_masks is None) and (sprite_atlas is None):
+        with timed_stage("mask_creation"):
+            card_masks = [ppf.create_mask(card) for card in cards]
+    elif card_masks is None:
+        card_masks = [None] * len(cards)
+    for card, card_mask, card_class in zip(cards, card_masks, card_classes):
+        size = rng.uniform(min_size, max_size)
+        rotation = rng.uniform(0, 360)
+        # alpha and beta to change image brightness when compositing
+        alpha = rng.uniform(0.5, 1.5)
+        beta = rng.uniform(-50, 50)
+        if sprite_atlas is not None:
+            with timed_stage("sprite_rendering"):
+                sprite = sprite_atlas.get_sprite(card, size, rotation)
+            card_height, card_width = sprite.shape[:2]
+        else:
+            transformation, (card_width, card_height) = cc.get_card_transformation(
+                card.shape, size, rotation, image_height
+            )
+
+        with timed_stage("card_placement"):
+            proposed_bounding_box = placement.find_position(
+                card_width, card_height, rng
+            )
+            if proposed_bounding_box is not None:
+                placement.add(
+                    get_adjusted_bounding_box(proposed_bounding_box, background)
+                )
+        # skip cards that do not fit on the image anymore, only placed cards get a label
+        if proposed_bounding_box is None:
+            continue
+        placed_card_classes.append(card_class)
+        if sprite_atlas is not None:
+            # composite_sprite cuts off the parts outside the image
+            origin, _ = cc.get_card_area(proposed_bounding_box, background.shape)
+        else:
+            with timed_stage("sprite_rendering"):
+                sprite, origin = cc.render_card_sprite(
+                    cc.to_bgra(card, card_mask),
+                    transformation,
+                    proposed_bounding_box,
+                    background.shape,
+                )
+        sprite_placements.append((sprite, origin, alpha, beta))
+    metrics.registry.counter("card_placement_tries_total").increase(
+        placement.number_of_tries
+    )
+    metrics.registry.counter("free_space_searches_total").increase(
+        placement.number_of_free_space_searches
+    )
+    labels = np.column_stack(
+        (placed_card_classes, placement.get_relative_bounding_boxes())
+    ).reshape(-1, 5)
+    return sprite_placements, labels
+
+
+def compose_batch(
+    backgrounds,
+    batch_cards: List[List],
+    batch_card_classes: List[List],
+    max_size: float,
+    min_size: float,
+    overlapping: bool,
+    rngs: List,
+    batch_card_masks: List[List] = None,
+    sprite_atlas: SpriteAtlas = None,
+) -> Tuple:
+    """
+    Place the selected cards of every image on a batch of backgrounds, given as (B, H, W, 3) array.
+    The cards of all images are transformed to sprites first, which are then composited onto the batch (see
+    card_compositing.composite_sprites). With a sprite atlas, the cards are given as their indices in the atlas.
+    Returns a tuple containing the batch of images and the labels of all images as (M, 6) array, every row
+    containing image index in the batch, class and normalized bounding box (center x, center y, width, height).
+    """
+    if batch_card_masks is None:
+        batch_card_masks = [None] * len(batch_cards)
+    sprite_placements = list()
+    labels = list()
+    for image_index, (cards, card_classes, card_masks, rng) in enumerate(
+        zip(batch_cards, batch_card_classes, batch_card_masks, rngs)
+    ):
+        image_sprite_placements, image_labels = get_sprite_placements(
+            backgrounds[image_index],
+            cards,
+            card_classes,
+            max_size,
+            min_size,
+            overlapping,
+            rng,
+            card_masks,
+            sprite_atlas,
+        )
+        sprite_placements += [
+            (image_index, *sprite_placement)
+            for sprite_placement in image_sprite_placements
+        ]
+        labels.append(
+            np.column_stack((np.full(len(image_labels), image_index), image_labels))
+        )
+
+    with timed_stage("compositing"):
+        images = cc.composite_sprites(backgrounds, sprite_placements)
+    return images, np.concatenate(labels).reshape(-1, 6)
+
+
+def format_labels(bounding_boxes, card_classes) -> str:
+    """
+    Return the labels of an image in the format needed by YOLO, one line per card.
+    """
     labels = ""
-    for i, bounding_box in enumerate(bounding_boxes):
-        bounding_box = transform_coordinates_to_relative_values(bounding_box, image)
+    for card_class, bounding_box in zip(card_classes.tolist(), bounding_boxes.tolist()):
         labels += (
-            str(card_classes[i])
+            str(card_class)
             + " "
             + " ".join([str(data) for data in bounding_box])
             + "\n"
         )
-    return image, labels
+    return labels
 
 
-def select_cards(PLAYING_CARDS_DIR: str, number_of_cards: int) -> Tuple[List, List]:
+def place_cards(
+    background,
+    cards: List,
+    card_classes: List,
+    max_size: float,
+    min_size: float,
+    overlapping: bool,
+    rng=rand,
+    card_masks: List = None,
+    fused: bool = True,
+) -> Tuple:
     """
-    Returns a tuple containing a list with the selected cards and a list with the according names.
-    Images are randomly sampled from the images contained in the directory.
+    Place selected cards on the background. Returns a tuple containing this image and the according labels in the YOLO format.
+    By default the cards are placed with the fused compositing engine, fused=False transforms them step by step.
     """
-    card_paths = [str(path) for path in Path(PLAYING_CARDS_DIR).glob("*")]
-    selected_cards_paths = rand.sample(card_paths, number_of_cards)
-    selected_cards = [cv.imread(path) for path in selected_cards_paths]
-
-    selected_cards_names = [
-        card_path.split("/")[-1].split(".")[0] for card_path in selected_cards_paths
-    ]  # splits to get name of cards without .jpg from path
-    return selected_cards, selected_cards_names
+    image, bounding_boxes, placed_card_classes = compose_image(
+        background,
+        cards,
+        card_classes,
+        max_size,
+        min_size,
+        overlapping,
+        rng,
+        card_masks,
+        fused,
+    )
+    return image, format_labels(bounding_boxes, placed_card_classes)
 
 
-def select_background(BACKGROUNDS_DIR: str):
+def get_card_names(PLAYING_CARDS_DIR: str) -> List[str]:
     """
-    Returns a randomly sampled, resized image from the inputfolder.
+    Return the names of the processed cards, in the order of their labels.
     """
-    background_paths = [str(path) for path in Path(BACKGROUNDS_DIR).glob("**/*.*")]
-    selected_background_path = str(rand.sample(background_paths, 1)[0])
-    background = cv.imread(selected_background_path)
-
-    try:  # try except because of some additional files in the downloaded dtd, that have to be skipped
-        cropped_background = cv.resize(
-            background, (640, 640)
-        )  # resize images to common YOLO input size
-    except:
-        cropped_background = select_background(BACKGROUNDS_DIR)
-    return cropped_background
+    return [
+        get_image_name(card_path) for card_path in get_image_paths(PLAYING_CARDS_DIR)
+    ]
 
 
-def generate_yaml_file(PLAYING_CARDS_DIR: str, OUTPUT_DIR: str) -> Dict[str, int]:
+def generate_yaml_file(
+    PLAYING_CARDS_DIR: str, OUTPUT_DIR: str, sharded: bool = False
+) -> Dict[str, int]:
     """
     Generate the meta-data for YOLO training. Returns a dictionary with the mapping of card name to an label.
+    For sharded datasets the image folders are created when unpacking the shards (see dataset_shards.py).
     """
-    card_names = [
-        frame_name.split(".")[0] for frame_name in os.listdir(PLAYING_CARDS_DIR)
-    ]
+    card_names = get_card_names(PLAYING_CARDS_DIR)
     name_to_int_dict = dict((name, i) for i, name in enumerate(card_names))
 
     with open(OUTPUT_DIR + "/data.yaml", "w") as file:
@@ -286,15 +468,18 @@ def generate_yaml_file(PLAYING_CARDS_DIR: str, OUTPUT_DIR: str) -> Dict[str, int
         file.write("train: train/images\n")
         file.write("val: val/images\n")
         file.write("test: test/images\n")
+        if sharded:
+            file.write("shards: shards/index.json\n")
         file.write("names:\n")
         for i, card_name in enumerate(card_names):
             file.write(f"  {i}: {card_name}\n")
     return name_to_int_dict
 
 
-def create_dataset_dir(OUTPUT_DIR: str) -> None:
+def create_dataset_dir(OUTPUT_DIR: str, sharded: bool = False) -> None:
     """
     Creates the folder structure for generated images if it does not exist already.
+    Sharded datasets only need the output directory, the shards have their own folder.
     """
     subdirs_to_create = [
         "/train/images/",
@@ -306,12 +491,183 @@ def create_dataset_dir(OUTPUT_DIR: str) -> None:
     ]
     if not os.path.exists(OUTPUT_DIR):
         os.makedirs(OUTPUT_DIR)
+    if sharded:
+        return
     for subdir in subdirs_to_create:
         FULL_SUBDIR = OUTPUT_DIR + subdir
         if not os.path.exists(FULL_SUBDIR):
             os.makedirs(FULL_SUBDIR)
 
 
+def get_image_rng(seed: int, image_index: int, epoch: int = 0) -> rand.Random:
+    """
+    Return the random number generator of a single image, derived from the seed and the image index.
+    This way an image does not depend on the images generated before it, or on the process generating it.
+    Every epoch > 0 gets new images, epoch 0 generates the same images as saved by generate_dataset.
+    """
+    if epoch == 0:
+        return rand.Random(f"{seed}-{image_index}")
+    return rand.Random(f"{seed}-{epoch}-{image_index}")
+
+
+def get_dataset_split(image_index: int, number_of_images: int) -> str:
+    """
+    Return the dataset split (train, val or test) an image belongs to.
+    """
+    if image_index >= 0.95 * number_of_images:
+        return "/test"
+    if image_index >= 0.8 * number_of_images:
+        return "/val"
+    return "/train"
+
+
+def init_worker(generation_config: Dict) -> None:
+    """
+    Store the settings of the dataset generation in the current process.
+    """
+    # every process works on its own image, more threads per process only compete for the cores
+    if generation_config["workers"] > 1:
+        cv.setNumThreads(1)
+    _generation_config.clear()
+    _generation_config.update(generation_config)
+
+
+def generate_batch(
+    generation_config: Dict, image_indices: List[int], epoch: int = 0
+) -> Tuple:
+    """
+    Generate a batch of images of the dataset. Returns a tuple containing the images as (B, H, W, 3) array, the labels
+    as (M, 6) array (see compose_batch) and the number of selected cards per image.
+    """
+    config = generation_config
+    assets = config["assets"]
+    sprite_atlas = config.get("sprite_atlas")
+    backgrounds = list()
+    batch_cards, batch_card_masks, batch_card_classes, rngs = [], [], [], []
+    for image_index in image_indices:
+        rng = get_image_rng(config["seed"], image_index, epoch)
+        with timed_stage("background_selection"):
+            backgrounds.append(assets.select_background(rng))
+        number_of_cards_per_image = rng.randint(
+            1, config["max_number_of_cards_per_image"]
+        )
+        with timed_stage("card_selection"):
+            cards, masks, names = assets.select_cards(number_of_cards_per_image, rng)
+        if sprite_atlas is not None:
+            cards = [sprite_atlas.card_indices[name] for name in names]
+        batch_cards.append(cards)
+        batch_card_masks.append(masks)
+        batch_card_classes.append([config["name_to_int_dict"][name] for name in names])
+        rngs.append(rng)
+
+    images, labels = compose_batch(
+        np.stack(backgrounds),
+        batch_cards,
+        batch_card_classes,
+        config["max_size"],
+        config["min_size"],
+        config["overlapping"],
+        rngs,
+        batch_card_masks,
+        sprite_atlas,
+    )
+    return images, labels, [len(cards) for cards in batch_cards]
+
+
+def generate_sample(generation_config: Dict, image_index: int, epoch: int = 0) -> Tuple:
+    """
+    Generate a single image of the dataset. Returns a tuple containing the image, the normalized bounding boxes
+    of the placed cards as N x 4 array and their classes, as well as the number of selected cards.
+    """
+    images, labels, number_of_cards = generate_batch(
+        generation_config, [image_index], epoch
+    )
+    return images[0], labels[:, 2:], labels[:, 1].astype(np.int64), number_of_cards[0]
+
+
+def generate_images(image_indices: List[int]) -> List[Tuple[np.ndarray, str, int]]:
+    """
+    Generate a batch of images of the dataset. Returns a list containing a tuple for every image: the image, its labels
+    and the number of selected cards, that could not be placed on the image.
+    """
+    images, labels, number_of_cards = generate_batch(_generation_config, image_indices)
+    results = list()
+    for i, image in enumerate(images):
+        image_labels = labels[labels[:, 0] == i]
+        with timed_stage("label_formatting"):
+            formatted_labels = format_labels(
+                image_labels[:, 2:], image_labels[:, 1].astype(np.int64)
+            )
+        results.append(
+            (image, formatted_labels, number_of_cards[i] - len(image_labels))
+        )
+    return results
+
+
+def generate_encoded_images(image_indices: List[int]) -> List[Tuple[bytes, str, int]]:
+    """
+    Generate a batch of images of the dataset, like generate_images, but return the images encoded in the output format.
+    """
+    config = _generation_config
+    results = list()
+    for image, labels, unplaced_cards in generate_images(image_indices):
+        with timed_stage("encode"):
+            image_bytes = encode_image(
+                image, config["image_format"], config["image_quality"]
+            )
+        results.append((image_bytes, labels, unplaced_cards))
+    return results
+
+
+def run_batch_in_worker(image_function: Callable, image_indices: List[int]) -> Tuple:
+    """
+    Return a tuple containing the results of the image function for a batch and the metrics reported by the worker
+    process meanwhile, which are merged into the metrics of the main process (see run_image_generation).
+    """
+    return image_function(image_indices), metrics.registry.pop_updates()
+
+
+def run_image_generation(
+    image_function: Callable,
+    generation_config: Dict,
+    image_indices: List[int] = None,
+    batch_size: int = 8,
+) -> Iterator:
+    """
+    Yield the result of every image in order. The image function generates the images of a batch of image indices and
+    returns a list of results. The batches are computed by a pool of processes if there is more than one worker, their
+    metrics are merged into the metrics of this process. By default all images of the dataset are generated.
+    """
+    if image_indices is None:
+        image_indices = range(generation_config["number_of_images"])
+    batches = [
+        image_indices[i : i + batch_size]
+        for i in range(0, len(image_indices), batch_size)
+    ]
+    workers = generation_config["workers"]
+    with tqdm(total=len(image_indices)) as progress_bar:
+        if workers > 1:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=init_worker,
+                initargs=(generation_config,),
+            ) as executor:
+                chunksize = max(1, len(batches) // (workers * 16))
+                for results, metric_updates in executor.map(
+                    partial(run_batch_in_worker, image_function),
+                    batches,
+                    chunksize=chunksize,
+                ):
+                    metrics.registry.merge_updates(metric_updates)
+                    progress_bar.update(len(results))
+                    yield from results
+        else:
+            init_worker(generation_config)
+            for results in map(image_function, batches):
+                progress_bar.update(len(results))
+                yield from results
+
+
 def generate_dataset(
     BACKGROUNDS_DIR: str,
     PHOTOS_DIR: str,
@@ -322,33 +678,146 @@ def generate_dataset(
     max_size: float,
     overlapping: bool,
     seed: int,
+    workers: int = 1,
+    output_format: str = "files",
+    samples_per_shard: int = 1000,
+    image_format: str = "jpg",
+    image_quality: int = None,
+    writer_threads: int = 4,
+    fsync: bool = True,
+    resume: bool = True,
+    sprite_atlas_grid: Tuple[int, int] = None,
+    metrics_log: str = None,
 ) -> str:
     """
     Generatete dataset to train, validate and test a YOLO model. Returns the output directory.
+    With workers > 1 the images are generated by a pool of processes, the dataset stays the same for every number of workers.
+    With output_format "shards" images and labels are packed into tar shards instead of two files per image.
+    Images are saved as jpg, png or webp, the image quality is passed to OpenCV (compression level for png).
+    Encoding and writing is done in the background by a DatasetWriter with writer_threads threads.
+    With resume, a rerun with the same parameters only generates the images missing in the output directory of
+    an interrupted run (see generation_progress.py), the result is the same as of an uninterrupted run.
+    With a sprite atlas grid (number of sizes, number of rotations), the cards are rendered once for every size and
+    rotation of the grid and only looked up when placing them (see sprite_atlas.py).
+    The duration of every stage (see timed_stage) is reported to the metrics of this process (see metrics.py), also of
+    the stages run by the pool of processes. With a metrics log, a snapshot of them is appended to this JSONL file at the end.
     """
-    rand.seed(seed)
-    current_dataset_split = "/train"
-
-    PLAYING_CARDS_DIR = ppf.process_photos(PHOTOS_DIR)
-    create_dataset_dir(OUTPUT_DIR)
-    name_to_int_dict = generate_yaml_file(PLAYING_CARDS_DIR, OUTPUT_DIR)
-
-    print(f"Generating {number_of_images} dataset images...")
-    for i in tqdm(range(number_of_images)):
-        background = select_background(BACKGROUNDS_DIR)
-        number_of_cards_per_image = rand.randint(1, max_number_of_cards_per_image)
-        cards, names = select_cards(PLAYING_CARDS_DIR, number_of_cards_per_image)
-        card_classes = [name_to_int_dict[name] for name in names]
-        image, labels = place_cards(
-            background, cards, card_classes, max_size, min_size, overlapping
-        )
+    if output_format not in ("files", "shards"):
+        raise ValueError(f'Unknown output format "{output_format}".')
+    sharded = output_format == "shards"
+    with timed_stage("photo_processing"):
+        PLAYING_CARDS_DIR = ppf.process_photos(PHOTOS_DIR, workers)
+    create_dataset_dir(OUTPUT_DIR, sharded)
+    name_to_int_dict = generate_yaml_file(PLAYING_CARDS_DIR, OUTPUT_DIR, sharded)
+    # index and decode backgrounds and cards once, instead of for every image
+    with timed_stage("asset_preloading"):
+        assets = AssetStore(BACKGROUNDS_DIR, PLAYING_CARDS_DIR)
+        sprite_atlas = None
+        if sprite_atlas_grid is not None:
+            sprite_atlas = SpriteAtlas(
+                assets.cards,
+                assets.card_masks,
+                assets.card_names,
+                BACKGROUND_SIZE,
+                min_size,
+                max_size,
+                *sprite_atlas_grid,
+            )
 
-        if (i >= 0.8 * number_of_images) and (i < 0.95 * number_of_images):
-            current_dataset_split = "/val"
-        elif i >= 0.95 * number_of_images:
-            current_dataset_split = "/test"
-        cv.imwrite(OUTPUT_DIR + current_dataset_split + f"/images/{i}.jpg", image)
-        with open(OUTPUT_DIR + current_dataset_split + f"/labels/{i}.txt", "w") as file:
-            file.write(labels)
+    generation_config = {
+        "assets": assets,
+        "OUTPUT_DIR": OUTPUT_DIR,
+        "name_to_int_dict": name_to_int_dict,
+        "number_of_images": number_of_images,
+        "max_number_of_cards_per_image": max_number_of_cards_per_image,
+        "min_size": min_size,
+        "max_size": max_size,
+        "overlapping": overlapping,
+        "seed": seed,
+        "workers": workers,
+        "image_format": image_format,
+        "image_quality": image_quality,
+        "sprite_atlas": sprite_atlas,
+    }
+
+    # everything the generated images depend on, a run can only be resumed if it is the same
+    parameters = dict(
+        (key, value)
+        for key, value in generation_config.items()
+        if key not in ("assets", "sprite_atlas", "OUTPUT_DIR", "workers")
+    )
+    parameters["sprite_atlas_grid"] = sprite_atlas_grid
+    parameters["cards"] = dict(
+        (photo_name, entry["sha256"])
+        for photo_name, entry in ppf.load_manifest(PLAYING_CARDS_DIR).items()
+    )
+    parameters["backgrounds"] = [
+        os.path.relpath(path, BACKGROUNDS_DIR) for path in assets.background_paths
+    ]
+    # shards are always written from the first image on
+    progress = (
+        None if sharded else GenerationProgress(OUTPUT_DIR, parameters, fsync=fsync)
+    )
+    image_indices = list(range(number_of_images))
+    if resume and (progress is not None):
+        completed_images, invalid_images = progress.load()
+        image_indices = [i for i in image_indices if i not in completed_images]
+        if completed_images:
+            print(
+                f"Resuming: {number_of_images - len(image_indices)} images are already completed, "
+                f"{invalid_images} incomplete images are generated again."
+            )
+
+    print(f"Generating {len(image_indices)} dataset images...")
+    try:
+        # the writer is closed also if the generation fails, so the written files are flushed and in the manifest
+        with DatasetWriter(
+            OUTPUT_DIR,
+            image_format,
+            image_quality,
+            writer_threads,
+            fsync=fsync,
+            shard_writer=(
+                ShardWriter(OUTPUT_DIR, samples_per_shard, fsync) if sharded else None
+            ),
+            progress=progress,
+        ) as writer:
+            # a pool of processes encodes the images itself, instead of sending the decoded images to this process
+            image_function = generate_encoded_images if workers > 1 else generate_images
+            unplaced_cards = 0
+            generated_images = run_image_generation(
+                image_function, generation_config, image_indices
+            )
+            # the stages of the images are reported where they run, this is only the time waited for them
+            wait_histogram = metrics.registry.histogram(
+                "generation_seconds",
+                "Duration of the stages of the dataset generation in seconds",
+                stage="wait_for_image",
+            )
+            submit_histogram = metrics.registry.histogram(
+                "generation_seconds", stage="submit"
+            )
+            image_counter = metrics.registry.counter("generated_images_total")
+            start_time = time.perf_counter()
+            for i, (image, labels, unplaced) in zip(image_indices, generated_images):
+                submit_time = time.perf_counter()
+                wait_histogram.observe(submit_time - start_time)
+                dataset_split = get_dataset_split(i, number_of_images)
+                writer.submit(dataset_split.strip("/"), i, image, labels)
+                unplaced_cards += unplaced
+                start_time = time.perf_counter()
+                submit_histogram.observe(start_time - submit_time)
+                image_counter.increase()
+            with metrics.registry.timed("generation_seconds", stage="close"):
+                writer.close()
+        metrics.registry.counter("unplaced_cards_total").increase(unplaced_cards)
+    finally:
+        assets.close()
+        if sprite_atlas is not None:
+            sprite_atlas.close()
+    if metrics_log is not None:
+        metrics.registry.write_jsonl(metrics_log)
+    if unplaced_cards > 0:
+        print(f"{unplaced_cards} cards did not fit on their image and were left out.")
     print(f'Dataset generated and saved at: "{OUTPUT_DIR}"!')
     return OUTPUT_DIR
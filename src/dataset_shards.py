@@ -0,0 +1,189 @@
+"""
+This file contains the sharded output format for generated datasets.
+Instead of two files per image, images and labels are packed into tar files (shards) with a fixed number
+of samples each. An index in shards/index.json stores for every sample the shard and the byte offsets of
+its image and labels, so a single sample can be read by seeking directly to it.
+The shards can be read with the ShardReader, or unpacked into the folder structure needed to train YOLO.
+"""
+
+import cv2 as cv
+import io
+import os
+import json
+import tarfile
+import numpy as np
+from typing import Iterator, Tuple
+
+SHARDS_SUBDIR = "/shards"
+INDEX_FILE_NAME = "index.json"
+DATASET_SPLITS = ("train", "val", "test")
+
+
+class ShardWriter:
+    """
+    Writes the samples of a dataset into tar shards and keeps the index of their positions.
+    """
+
+    def __init__(
+        self, OUTPUT_DIR: str, samples_per_shard: int = 1000, fsync: bool = False
+    ) -> None:
+        self.SHARDS_DIR = OUTPUT_DIR + SHARDS_SUBDIR
+        if not os.path.exists(self.SHARDS_DIR):
+            os.makedirs(self.SHARDS_DIR)
+        self.samples_per_shard = samples_per_shard
+        self.fsync = fsync
+        self.index = dict((split, list()) for split in DATASET_SPLITS)
+        self.open_shards = dict()
+
+    def _get_shard(self, split: str) -> Tuple[str, tarfile.TarFile]:
+        """
+        Return name and tar file of the shard the next sample of the split is written to.
+        """
+        number_of_samples = len(self.index[split])
+        shard_name = f"{split}-{number_of_samples // self.samples_per_shard:05d}.tar"
+        if (split in self.open_shards) and (self.open_shards[split][0] != shard_name):
+            self._close_shard(self.open_shards.pop(split)[1])
+        if split not in self.open_shards:
+            shard = tarfile.open(
+                self.SHARDS_DIR + "/" + shard_name, "w", format=tarfile.USTAR_FORMAT
+            )
+            self.open_shards[split] = (shard_name, shard)
+        return self.open_shards[split]
+
+    def add(
+        self, split: str, image_index: int, image_bytes: bytes, labels: str
+    ) -> None:
+        """
+        Add the encoded image and its labels to the current shard of the split.
+        """
+        shard_name, shard = self._get_shard(split)
+        image_extension = get_image_extension(image_bytes)
+        index_entry = [image_index, shard_name]
+        for member_name, data in (
+            (f"{image_index}.{image_extension}", image_bytes),
+            (f"{image_index}.txt", labels.encode()),
+        ):
+            # fixed metadata, so the same dataset always results in the same shards
+            member = tarfile.TarInfo(member_name)
+            member.size = len(data)
+            member.mode = 0o644
+            header = member.tobuf(shard.format, shard.encoding, shard.errors)
+            index_entry += [shard.offset + len(header), member.size]
+            shard.addfile(member, io.BytesIO(data))
+        self.index[split].append(index_entry)
+
+    def _close_shard(self, shard: tarfile.TarFile) -> None:
+        """
+        Close the shard, and flush it to the disk if fsync is enabled.
+        """
+        shard.close()
+        if self.fsync:
+            with open(shard.name, "rb") as file:
+                os.fsync(file.fileno())
+
+    def close(self) -> None:
+        """
+        Close all shards and save the index.
+        """
+        for _, shard in self.open_shards.values():
+            self._close_shard(shard)
+        self.open_shards = dict()
+        with open(self.SHARDS_DIR + "/" + INDEX_FILE_NAME, "w") as file:
+            json.dump(self.index, file)
+            if self.fsync:
+                file.flush()
+                os.fsync(file.fileno())
+
+
+class ShardReader:
+    """
+    Random access to the samples of a sharded dataset.
+    """
+
+    def __init__(self, OUTPUT_DIR: str) -> None:
+        self.OUTPUT_DIR = OUTPUT_DIR
+        self.SHARDS_DIR = OUTPUT_DIR + SHARDS_SUBDIR
+        with open(self.SHARDS_DIR + "/" + INDEX_FILE_NAME) as file:
+            self.index = json.load(file)
+
+    def __len__(self) -> int:
+        return sum(len(samples) for samples in self.index.values())
+
+    def number_of_samples(self, split: str) -> int:
+        """
+        Return the number of samples in the split.
+        """
+        return len(self.index[split])
+
+    def _read(self, shard_name: str, offset: int, size: int) -> bytes:
+        with open(self.SHARDS_DIR + "/" + shard_name, "rb") as shard:
+            shard.seek(offset)
+            return shard.read(size)
+
+    def read_encoded_sample(self, split: str, position: int) -> Tuple[int, bytes, str]:
+        """
+        Return a tuple containing the image index, the encoded image and the labels of the n-th sample in the split.
+        """
+        (
+            image_index,
+            shard_name,
+            image_offset,
+            image_size,
+            labels_offset,
+            labels_size,
+        ) = self.index[split][position]
+        image_bytes = self._read(shard_name, image_offset, image_size)
+        labels = self._read(shard_name, labels_offset, labels_size).decode()
+        return image_index, image_bytes, labels
+
+    def read_sample(self, split: str, position: int) -> Tuple:
+        """
+        Return a tuple containing the image index, the decoded image and the labels of the n-th sample in the split.
+        """
+        image_index, image_bytes, labels = self.read_encoded_sample(split, position)
+        image = cv.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv.IMREAD_COLOR)
+        return image_index, image, labels
+
+    def iter_split(self, split: str) -> Iterator[Tuple]:
+        """
+        Yield all samples of the split, as returned by read_sample.
+        """
+        for position in range(self.number_of_samples(split)):
+            yield self.read_sample(split, position)
+
+    def unpack(self, UNPACK_DIR: str = None) -> str:
+        """
+        Write the samples in the folder structure needed to train YOLO. Returns the directory of the unpacked dataset.
+        By default the samples are unpacked next to the shards, where the data.yaml of the dataset expects them.
+        """
+        UNPACK_DIR = UNPACK_DIR or self.OUTPUT_DIR
+        for split in self.index:
+            for subdir in ("images", "labels"):
+                FULL_SUBDIR = f"{UNPACK_DIR}/{split}/{subdir}"
+                if not os.path.exists(FULL_SUBDIR):
+                    os.makedirs(FULL_SUBDIR)
+            for position in range(self.number_of_samples(split)):
+                image_index, image_bytes, labels = self.read_encoded_sample(
+                    split, position
+                )
+                image_extension = get_image_extension(image_bytes)
+                with open(
+                    f"{UNPACK_DIR}/{split}/images/{image_index}.{image_extension}", "wb"
+                ) as file:
+                    file.write(image_bytes)
+                with open(
+                    f"{UNPACK_DIR}/{split}/labels/{image_index}.txt", "w"
+                ) as file:
+                    file.write(labels)
+        return UNPACK_DIR
+
+
+def get_image_extension(image_bytes: bytes) -> str:
+    """
+    Return the file extension of an encoded image, detected from its first bytes.
+    """
+    if image_bytes.startswith(b"\x89PNG"):
+        return "png"
+    if image_bytes[8:12] == b"WEBP":
+        return "webp"
+    return "jpg"
@@ -0,0 +1,214 @@
+"""
+This file contains the writer that saves the generated images and labels in the background.
+Encoding and writing are done by a pool of threads (OpenCV and file writes release the GIL), so the next
+image is composited while the previous ones are still encoded and written. At most max_pending_images
+images wait in the queue, generating blocks when the queue is full, so memory stays the same for any
+number of images. The files are not flushed to the disk one by one while generating: at every checkpoint of the
+progress manifest and by close, the files written since are flushed together, then their directories, and only then
+the manifest is saved, so it only lists files that are on the disk. Write errors are collected and raised together by
+close, also when the writer is used as context manager.
+"""
+
+import cv2 as cv
+import os
+import metrics
+import numpy as np
+from collections import deque
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, Future
+from generation_progress import fsync_path, get_file_entry
+from typing import List, Tuple, Union
+
+IMAGE_FORMATS = ("jpg", "png", "webp")
+
+
+def get_encoding_parameters(image_format: str, image_quality: int = None) -> List[int]:
+    """
+    Return the OpenCV parameters to encode an image in the given format.
+    The quality is 0-100 for JPEG and WebP, and the compression level 0-9 for PNG.
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f'Unknown image format "{image_format}".')
+    if image_quality is None:
+        return []
+    quality_flag = {
+        "jpg": cv.IMWRITE_JPEG_QUALITY,
+        "png": cv.IMWRITE_PNG_COMPRESSION,
+        "webp": cv.IMWRITE_WEBP_QUALITY,
+    }[image_format]
+    return [quality_flag, image_quality]
+
+
+def encode_image(image, image_format: str = "jpg", image_quality: int = None) -> bytes:
+    """
+    Return the image encoded in the given format.
+    """
+    success, image_bytes = cv.imencode(
+        "." + image_format, image, get_encoding_parameters(image_format, image_quality)
+    )
+    if not success:
+        raise ValueError(f"Image could not be encoded as {image_format}.")
+    return image_bytes.tobytes()
+
+
+class DatasetWriter:
+    """
+    Encodes and saves the images and labels of a dataset with a pool of threads.
+    The samples are written as files in the YOLO folder structure, or added to a ShardWriter in their order.
+    """
+
+    def __init__(
+        self,
+        OUTPUT_DIR: str,
+        image_format: str = "jpg",
+        image_quality: int = None,
+        threads: int = 4,
+        max_pending_images: int = 32,
+        fsync: bool = True,
+        shard_writer=None,
+        progress=None,
+    ) -> None:
+        get_encoding_parameters(image_format, image_quality)
+        self.OUTPUT_DIR = OUTPUT_DIR
+        self.image_format = image_format
+        self.image_quality = image_quality
+        self.max_pending_images = max_pending_images
+        self.fsync = fsync
+        self.shard_writer = shard_writer
+        self.progress = progress
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="dataset_writer"
+        )
+        # tar shards are appended to in order, by a single thread
+        if shard_writer is not None:
+            self.shard_executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="shard_writer"
+            )
+        self.pending = deque()
+        # directories of the written files and the files not flushed to the disk yet (see sync)
+        self.written_dirs = set()
+        self.unsynced_paths = list()
+        self.lock = Lock()
+        self.failed_images = list()
+        self.number_of_written_images = 0
+        self.closed = False
+
+    def __enter__(self) -> "DatasetWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            self.close()
+        except OSError:
+            # the error that stopped the generation is more important than the write errors
+            if exc_type is None:
+                raise
+
+    def submit(
+        self, split: str, image_index: int, image: Union[np.ndarray, bytes], labels: str
+    ) -> None:
+        """
+        Queue an image (decoded, or already encoded) and its labels for writing. Blocks while the queue is full.
+        """
+        while len(self.pending) >= self.max_pending_images:
+            self._wait_for_oldest()
+        if self.shard_writer is None:
+            future = self.executor.submit(
+                self._write_files, split, image_index, image, labels
+            )
+        else:
+            encoding = self.executor.submit(self._encode, image)
+            future = self.shard_executor.submit(
+                self._add_to_shard, split, image_index, encoding, labels
+            )
+        self.pending.append(future)
+
+    def _wait_for_oldest(self) -> None:
+        try:
+            written_image = self.pending.popleft().result()
+            self.number_of_written_images += 1
+        except (OSError, ValueError) as error:
+            self.failed_images.append(str(error))
+            return
+        # the images are added to the manifest here, so a checkpoint covers only files written before it
+        if (self.progress is not None) and self.progress.add(*written_image):
+            self.sync()
+            self.progress.save()
+
+    def _encode(self, image: Union[np.ndarray, bytes]) -> bytes:
+        if isinstance(image, np.ndarray):
+            with metrics.registry.timed("generation_seconds", stage="encode"):
+                return encode_image(image, self.image_format, self.image_quality)
+        return image
+
+    def _write_file(self, file_path: str, data: bytes) -> int:
+        # returns the modification time of the written file in ns, for the progress manifest
+        full_file_path = self.OUTPUT_DIR + "/" + file_path
+        with metrics.registry.timed("generation_seconds", stage="file_write"):
+            with open(full_file_path, "wb") as file:
+                file.write(data)
+                file.flush()
+                modification_time = os.fstat(file.fileno()).st_mtime_ns
+        with self.lock:
+            self.written_dirs.add(os.path.dirname(full_file_path))
+            self.unsynced_paths.append(full_file_path)
+        return modification_time
+
+    def _write_files(
+        self, split: str, image_index: int, image: Union[np.ndarray, bytes], labels: str
+    ) -> Tuple[int, List[List]]:
+        # returns the image index and the entries of its files in the progress manifest
+        files = (
+            (f"{split}/images/{image_index}.{self.image_format}", self._encode(image)),
+            (f"{split}/labels/{image_index}.txt", labels.encode()),
+        )
+        modification_times = [
+            self._write_file(file_path, data) for file_path, data in files
+        ]
+        if self.progress is None:
+            return image_index, list()
+        return image_index, [
+            get_file_entry(file_path, data, modification_time)
+            for (file_path, data), modification_time in zip(files, modification_times)
+        ]
+
+    def _add_to_shard(
+        self, split: str, image_index: int, encoding: Future, labels: str
+    ) -> None:
+        self.shard_writer.add(split, image_index, encoding.result(), labels)
+
+    def sync(self) -> None:
+        """
+        Flush the files written since the last call to the disk, then the entries of their directories. Does nothing
+        without fsync.
+        """
+        if not self.fsync:
+            return
+        with self.lock:
+            unsynced_paths, self.unsynced_paths = self.unsynced_paths, list()
+            written_dirs = sorted(self.written_dirs)
+        list(self.executor.map(fsync_path, unsynced_paths))
+        list(self.executor.map(fsync_path, written_dirs))
+
+    def close(self) -> None:
+        """
+        Wait until all queued images are written and flushed to the disk. Does nothing if the writer is closed already.
+        Raises an OSError with the number of failed images and the first error, if any image could not be written.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        while self.pending:
+            self._wait_for_oldest()
+        if self.shard_writer is not None:
+            self.shard_executor.shutdown()
+            self.shard_writer.close()
+        else:
+            self.sync()
+        if self.progress is not None:
+            self.progress.save()
+        self.executor.shutdown()
+        if self.failed_images:
+            raise OSError(
+                f"{len(self.failed_images)} images could not be written, first error: {self.failed_images[0]}"
+            )
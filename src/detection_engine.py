@@ -0,0 +1,573 @@
+"""
+This file contains the detection engine, which runs the card detection and the score keeping of the demo-application
+independently of the user interface.
+Every frame passes the stages capture -> decode -> infer -> track -> score -> render, each running on its own thread
+and connected to the next one by a small bounded queue. Stages in front of the model only keep the newest frames, so
+the model always works on the current view of the table; tracking and scoring see every detected frame, because the
+played cards are recognized over consecutive frames (see card_tracker.py). The user interface only subscribes to the
+output, so it can refresh at its own rate without slowing down the detection. The preview is rendered at a limited
+frame rate, frames in between are published with their scores only (see preview_renderer.py). With a motion gate,
+the model only runs on frames that changed, static frames reuse the detections of the last inference (see
+motion_gate.py). With a table ROI, the model only runs on the region of the cards, at an adapted resolution (see
+table_roi.py). Frames are decoded at the smallest scale at which the frame, or with a table ROI its region, is still as
+large as the input of the model (see frame_decoding.py). The detections are kept in coordinates of the full-size frame,
+so frames decoded at different scales can be compared, and only scaled to the decoded image for the preview.
+With an idle timeout, the engine pauses and stops its frame source while no subscriber reads its output, and resumes
+as soon as a subscriber reads again.
+"""
+
+import time
+import queue
+import threading
+from collections import deque
+import numpy as np
+import jass_rules as jass
+import metrics
+from card_tracker import NUMBER_OF_CARDS, CardTracker
+from frame_decoding import FrameDecoder
+from motion_gate import MotionGate
+from preview_renderer import PreviewRenderer
+from table_roi import TableRoi
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+
+class Detections(NamedTuple):
+    """
+    Detected cards of a frame: boxes as N x 4 array (x_min, y_min, x_max, y_max), confidences and classes.
+    """
+
+    boxes: np.ndarray
+    confidences: np.ndarray
+    card_classes: np.ndarray
+
+    @staticmethod
+    def from_result(result) -> "Detections":
+        """
+        Return the detections of an ultralytics result.
+        """
+        boxes = result.boxes.cpu().numpy()
+        return Detections(
+            boxes.xyxy.reshape(-1, 4),
+            boxes.conf.reshape(-1),
+            boxes.cls.reshape(-1).astype(np.int64),
+        )
+
+    def offset(self, x: int, y: int) -> "Detections":
+        """
+        Return the detections with boxes moved by x and y, e.g. from a crop to the full frame.
+        """
+        return self._replace(boxes=self.boxes + np.array([x, y, x, y]))
+
+    def scale(self, factor: float) -> "Detections":
+        """
+        Return the detections with boxes multiplied by the factor, e.g. from a frame decoded at a reduced scale to
+        the full frame.
+        """
+        return self._replace(boxes=self.boxes * factor)
+
+
+class GameState:
+    """
+    Score keeping of a game of Jass. The state is shared between the scoring thread and the user interface.
+    """
+
+    def __init__(
+        self,
+        number_of_players: int = 2,
+        trump: str = "s",
+        card_tracker: CardTracker = None,
+    ) -> None:
+        self.lock = threading.Lock()
+        self.card_tracker = card_tracker or CardTracker()
+        self.reset(number_of_players, trump)
+
+    def reset(self, number_of_players: int = None, trump: str = None) -> None:
+        """
+        Stop the game and reset the scores, optionally with new game settings.
+        """
+        with self.lock:
+            if number_of_players is not None:
+                self.number_of_players = number_of_players
+            if trump is not None:
+                self.trump = trump
+            self.running = False
+            self.winner = None
+            self.players_dict = dict(
+                [(f"Player {i+1}", 0) for i in range(self.number_of_players)]
+            )
+            self.card_tracker.reset()
+            self.already_played_cards = set()
+            self.current_play = list()
+            self.beginning_player = 0
+
+    def start(self, number_of_players: int, trump: str) -> None:
+        """
+        Start a new game with the given settings.
+        """
+        self.reset(number_of_players, trump)
+        with self.lock:
+            self.running = True
+
+    def track(self, detections: Detections) -> List[int]:
+        """
+        Register the detections of a frame in the card tracker. Returns the classes of the cards played with this frame.
+        """
+        with self.lock:
+            if not self.running:
+                return list()
+            return self.card_tracker.update(
+                detections.boxes, detections.confidences, detections.card_classes
+            )
+
+    def update(self, played_cards: List[str]) -> bool:
+        """
+        Register played cards, in the order they were played. Returns a bool that indicates if the scores changed.
+        """
+        with self.lock:
+            if not self.running:
+                return False
+            scores_changed = False
+            for card in played_cards:
+                if card in self.already_played_cards:
+                    continue
+                self.already_played_cards.add(card)
+                self.current_play.append(card)
+                if len(self.current_play) == self.number_of_players:
+                    self._score_current_play()
+                    scores_changed = True
+            return scores_changed
+
+    def _score_current_play(self) -> None:
+        print(
+            f"Cards from current play (starting with player {self.beginning_player + 1}): {self.current_play}"
+        )
+        self.players_dict, self.beginning_player = jass.add_points_from_play(
+            self.players_dict,
+            self.beginning_player,
+            self.current_play,
+            self.trump,
+            len(self.already_played_cards),
+            self.number_of_players,
+        )
+        self.current_play = list()
+
+        # when last round was played, determine winner and end game
+        if (NUMBER_OF_CARDS - len(self.already_played_cards)) < self.number_of_players:
+            self.winner = max(self.players_dict, key=self.players_dict.get)
+            self.running = False
+
+    def get_scores(self) -> Dict[str, int]:
+        """
+        Return a copy of the points of all players.
+        """
+        with self.lock:
+            return dict(self.players_dict)
+
+
+class Frame:
+    """
+    A frame on its way through the stages of the detection engine.
+    """
+
+    def __init__(self, frame_index: int, capture_time: float, encoded_image: bytes):
+        self.frame_index = frame_index
+        self.capture_time = capture_time
+        self.encoded_image = encoded_image
+        self.image = None
+        # the image is decoded at 1 / scale_factor of the frame size, the detections are in full-size coordinates
+        self.scale_factor = 1
+        self.detections = None
+        # the detections were reused from an earlier frame, because nothing changed
+        self.inference_skipped = False
+        # region of the frame the model ran on (x_min, y_min, x_max, y_max) and its input size
+        self.region = None
+        self.image_size = None
+        self.detected_cards = list()
+        self.played_cards = list()
+        self.scores = None
+        self.winner = None
+        # JPEG encoded preview with the detected cards, None if the frame was not rendered
+        self.preview_image = None
+        self.publish_time = None
+        # seconds spent in every stage
+        self.stage_times = dict()
+
+
+class Subscription:
+    """
+    Access to the newest output of the detection engine, for a single subscriber.
+    """
+
+    def __init__(self, engine: "DetectionEngine") -> None:
+        self.engine = engine
+        self.last_frame_index = -1
+
+    def get(self, timeout: float = None) -> Optional[Frame]:
+        """
+        Return the newest frame, that this subscriber did not get before.
+        Waits for a new frame, returns None if there is no new frame within the timeout.
+        """
+        self.engine.last_read_time = time.perf_counter()
+        with self.engine.output_available:
+            self.engine.output_available.wait_for(
+                lambda: (self.engine.output is not None)
+                and (self.engine.output.frame_index > self.last_frame_index),
+                timeout,
+            )
+            output = self.engine.output
+        if (output is None) or (output.frame_index <= self.last_frame_index):
+            return None
+        self.last_frame_index = output.frame_index
+        return output
+
+
+def get_input_size(model, default: int = 640) -> int:
+    """
+    Return the input size of the model (longer side) it was trained with, or the default if it is not known, e.g. for
+    exported models, which are exported at the default size (see model_export.py).
+    """
+    image_size = getattr(model, "overrides", dict()).get("imgsz") or default
+    if isinstance(image_size, (list, tuple)):
+        return max(image_size)
+    return int(image_size)
+
+
+def put_latest(frame_queue: queue.Queue, frame: Frame) -> bool:
+    """
+    Put the frame into the queue, removing the oldest frame if the queue is full. Returns a bool that indicates if a frame was dropped.
+    """
+    try:
+        frame_queue.put_nowait(frame)
+        return False
+    except queue.Full:
+        try:
+            frame_queue.get_nowait()
+        except queue.Empty:
+            pass
+        frame_queue.put_nowait(frame)
+        return True
+
+
+class DetectionEngine:
+    """
+    Runs the stages of the card detection and score keeping on their own threads.
+    The frame source needs a read(timeout) method returning a tuple of JPEG encoded frame and capture time (see FrameGrabber).
+    """
+
+    def __init__(
+        self,
+        frame_source,
+        model,
+        game_state: GameState = None,
+        confidence: float = 0.7,
+        queue_size: int = 2,
+        motion_gate: MotionGate = None,
+        table_roi: TableRoi = None,
+        preview_renderer: PreviewRenderer = None,
+        metric_labels: Dict[str, str] = None,
+        frame_decoder: FrameDecoder = None,
+        idle_timeout: float = None,
+    ) -> None:
+        self.frame_source = frame_source
+        self.model = model
+        self.game_state = game_state or GameState()
+        self.confidence = confidence
+        self.motion_gate = motion_gate
+        self.table_roi = table_roi
+        self.preview_renderer = preview_renderer or PreviewRenderer()
+        self.frame_decoder = frame_decoder or FrameDecoder(get_input_size(model))
+        self.last_detections = None
+        self.stopping = threading.Event()
+        self.output = None
+        self.output_available = threading.Condition()
+        self.number_of_dropped_frames = 0
+        # publication times of the last frames, to measure the frame rate
+        self.output_times = deque(maxlen=30)
+        self.last_error = None
+        self.threads = list()
+        # seconds without a subscriber reading the output until the engine pauses, None to never pause
+        self.idle_timeout = idle_timeout
+        self.last_read_time = time.perf_counter()
+        self.paused = False
+
+        # stage name, function, drop the oldest waiting frame when the stage is busy
+        self.stages = [
+            ("decode", self._decode, True),
+            ("infer", self._infer, True),
+            ("track", self._track, False),
+            ("score", self._score, False),
+            ("render", self._render, True),
+        ]
+        # latency of every stage and counters, labeled e.g. with the camera (see metrics.py)
+        metric_labels = metric_labels or dict()
+        self.stage_histograms = dict(
+            (
+                stage_name,
+                metrics.registry.histogram(
+                    "stage_seconds",
+                    "Duration of the stages of the live loop in seconds",
+                    stage=stage_name,
+                    **metric_labels,
+                ),
+            )
+            for stage_name, _, _ in self.stages
+        )
+        self.counters = dict(
+            (name, metrics.registry.counter(f"{name}_total", **metric_labels))
+            for name in (
+                "frames",
+                "dropped_frames",
+                "published_frames",
+                "inferred_frames",
+                "skipped_inferences",
+                "detections",
+                "played_cards",
+                "errors",
+            )
+        )
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in self.stages]
+
+    def start(self) -> "DetectionEngine":
+        """
+        Start the frame source and the threads of all stages. Returns the detection engine itself.
+        """
+        if self.threads:
+            return self
+        self.stopping.clear()
+        self.paused = False
+        self.last_read_time = time.perf_counter()
+        self._start_frame_source()
+        self.threads.append(
+            threading.Thread(target=self._capture, name="capture", daemon=True)
+        )
+        for stage_index, (stage_name, function, _) in enumerate(self.stages):
+            self.threads.append(
+                threading.Thread(
+                    target=self._run_stage,
+                    args=(stage_index, function),
+                    name=stage_name,
+                    daemon=True,
+                )
+            )
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop all stages and the frame source.
+        """
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = list()
+        self._stop_frame_source()
+        with self.output_available:
+            self.output_available.notify_all()
+
+    def subscribe(self) -> Subscription:
+        """
+        Return a subscription to the scored and rendered frames.
+        """
+        self.last_read_time = time.perf_counter()
+        return Subscription(self)
+
+    def is_idle(self) -> bool:
+        """
+        Return a bool that indicates if no subscriber read the output within the idle timeout.
+        """
+        return (self.idle_timeout is not None) and (
+            time.perf_counter() - self.last_read_time > self.idle_timeout
+        )
+
+    def process(
+        self, frame_index: int, capture_time: float, encoded_image: bytes
+    ) -> Frame:
+        """
+        Run a frame through all stages on the calling thread and publish it. No frame is dropped, so the same frames
+        always lead to the same scores (e.g. to replay a recording, see frame_recording.py).
+        """
+        frame = Frame(frame_index, capture_time, encoded_image)
+        self.counters["frames"].increase()
+        for stage_name, function, _ in self.stages:
+            start_time = time.perf_counter()
+            frame = function(frame)
+            frame.stage_times[stage_name] = time.perf_counter() - start_time
+            self.stage_histograms[stage_name].observe(frame.stage_times[stage_name])
+        self._publish(frame)
+        return frame
+
+    def get_fps(self) -> float:
+        """
+        Return the number of frames per second the engine published recently.
+        """
+        output_times = list(self.output_times)
+        if (len(output_times) < 2) or (time.perf_counter() - output_times[-1] > 2.0):
+            return 0.0
+        return (len(output_times) - 1) / (output_times[-1] - output_times[0])
+
+    def _put(self, queue_index: int, frame: Frame, drop_oldest: bool) -> None:
+        if drop_oldest:
+            if put_latest(self.queues[queue_index], frame):
+                self.number_of_dropped_frames += 1
+                self.counters["dropped_frames"].increase()
+            return
+        while not self.stopping.is_set():
+            try:
+                self.queues[queue_index].put(frame, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _start_frame_source(self) -> None:
+        # frame sources without start and stop (e.g. a replayed clip) always run
+        if hasattr(self.frame_source, "start"):
+            self.frame_source.start()
+
+    def _stop_frame_source(self) -> None:
+        if hasattr(self.frame_source, "stop"):
+            self.frame_source.stop()
+
+    def _capture(self) -> None:
+        frame_index = 0
+        while not self.stopping.is_set():
+            if self.is_idle():
+                if not self.paused:
+                    self.paused = True
+                    self._stop_frame_source()
+                self.stopping.wait(0.1)
+                continue
+            if self.paused:
+                self.paused = False
+                self._start_frame_source()
+            encoded_frame = self.frame_source.read(timeout=0.1)
+            if encoded_frame is None:
+                continue
+            encoded_image, capture_time = encoded_frame
+            self.counters["frames"].increase()
+            self._put(
+                0, Frame(frame_index, capture_time, encoded_image), self.stages[0][2]
+            )
+            frame_index += 1
+
+    def _run_stage(self, stage_index: int, function: Callable) -> None:
+        stage_name = self.stages[stage_index][0]
+        is_last_stage = stage_index == len(self.stages) - 1
+        while not self.stopping.is_set():
+            try:
+                frame = self.queues[stage_index].get(timeout=0.1)
+            except queue.Empty:
+                continue
+            start_time = time.perf_counter()
+            try:
+                frame = function(frame)
+            except Exception as error:
+                # a broken frame must not stop the detection, the error is kept for the user interface
+                self.last_error = error
+                self.counters["errors"].increase()
+                continue
+            frame.stage_times[stage_name] = time.perf_counter() - start_time
+            self.stage_histograms[stage_name].observe(frame.stage_times[stage_name])
+            if is_last_stage:
+                self._publish(frame)
+            else:
+                self._put(stage_index + 1, frame, self.stages[stage_index + 1][2])
+
+    def _decode(self, frame: Frame) -> Frame:
+        # with a table ROI, the region of the table has to stay as large as the input of the model
+        table_roi = self.table_roi
+        relative_region = None
+        if table_roi is not None:
+            relative_region = table_roi.get_relative_region()
+        frame.scale_factor = self.frame_decoder.get_scale_factor(
+            frame.encoded_image, relative_region
+        )
+        frame.image = self.frame_decoder.decode(
+            frame.encoded_image, scale_factor=frame.scale_factor
+        )
+        if frame.image is None:
+            raise ValueError(f"Frame {frame.frame_index} could not be decoded.")
+        if relative_region is not None:
+            frame.region = table_roi.get_region(frame.image.shape, relative_region)
+        return frame
+
+    def _infer(self, frame: Frame) -> Frame:
+        if (
+            (self.motion_gate is not None)
+            and (not self.motion_gate.should_infer(frame.image))
+            and (self.last_detections is not None)
+        ):
+            frame.detections = self.last_detections
+            frame.inference_skipped = True
+            self.counters["skipped_inferences"].increase()
+            return frame
+        table_roi = self.table_roi
+        if table_roi is None:
+            result = self.model(
+                source=frame.image, conf=self.confidence, verbose=False
+            )[0]
+            frame.detections = Detections.from_result(result).scale(frame.scale_factor)
+        else:
+            if frame.region is None:
+                frame.region = table_roi.get_region(frame.image.shape)
+            x_min, y_min, x_max, y_max = frame.region
+            crop = frame.image[y_min:y_max, x_min:x_max]
+            frame.image_size = table_roi.get_image_size(crop.shape)
+            result = self.model(
+                source=crop,
+                conf=self.confidence,
+                imgsz=frame.image_size,
+                verbose=False,
+            )[0]
+            # boxes in full-frame coordinates of the full-size frame, so they stay comparable between frames decoded
+            # at different scales (tracking, table ROI, reused detections)
+            frame.detections = (
+                Detections.from_result(result)
+                .offset(x_min, y_min)
+                .scale(frame.scale_factor)
+            )
+            height, width = frame.image.shape[:2]
+            table_roi.update(
+                frame.detections.boxes,
+                frame.detections.confidences,
+                (height * frame.scale_factor, width * frame.scale_factor),
+            )
+        self.last_detections = frame.detections
+        self.counters["inferred_frames"].increase()
+        self.counters["detections"].increase(len(frame.detections.boxes))
+        return frame
+
+    def _track(self, frame: Frame) -> Frame:
+        frame.detected_cards = [
+            self.model.names[int(card_class)]
+            for card_class in frame.detections.card_classes
+        ]
+        frame.played_cards = [
+            self.model.names[card_class]
+            for card_class in self.game_state.track(frame.detections)
+        ]
+        self.counters["played_cards"].increase(len(frame.played_cards))
+        return frame
+
+    def _score(self, frame: Frame) -> Frame:
+        self.game_state.update(frame.played_cards)
+        frame.scores = self.game_state.get_scores()
+        frame.winner = self.game_state.winner
+        return frame
+
+    def _render(self, frame: Frame) -> Frame:
+        # due to visualizing with Streamlit, output image of model cannot be used and bounding boxes need to be added manually
+        frame.preview_image = self.preview_renderer.render_if_due(
+            frame.image,
+            frame.detections.scale(1 / frame.scale_factor),
+            self.model.names,
+        )
+        return frame
+
+    def _publish(self, frame: Frame) -> None:
+        frame.publish_time = time.time()
+        self.output_times.append(time.perf_counter())
+        self.counters["published_frames"].increase()
+        with self.output_available:
+            self.output = frame
+            self.output_available.notify_all()
@@ -0,0 +1,115 @@
+"""
+This file contains the decoding of the JPEG camera frames for the detection.
+The encoded frame is wrapped by a numpy array without copying it. YOLO scales every frame down to its input size
+anyway, so the frame is decoded at a reduced scale (1/2, 1/4 or 1/8) if it stays at least as large as the input of
+the model. If the model only runs on a region of the frame (see table_roi.py), the scale keeps this region as large as
+the input of the model instead. JPEG decoders can skip most of the work at reduced scales. The size of the frame is read from the header of
+the JPEG (its start of frame segment) before decoding. If PyTurboJPEG and libjpeg-turbo are installed, they are used
+instead of OpenCV, otherwise OpenCV decodes the frames.
+"""
+
+import struct
+import cv2 as cv
+import numpy as np
+from typing import Optional, Tuple
+
+try:
+    from turbojpeg import TurboJPEG
+except ImportError:
+    TurboJPEG = None
+
+SCALE_FACTORS = (1, 2, 4, 8)
+REDUCED_READ_FLAGS = {
+    1: cv.IMREAD_COLOR,
+    2: cv.IMREAD_REDUCED_COLOR_2,
+    4: cv.IMREAD_REDUCED_COLOR_4,
+    8: cv.IMREAD_REDUCED_COLOR_8,
+}
+# start of frame markers, all 0xC0 to 0xCF except DHT (0xC4), JPG (0xC8) and DAC (0xCC)
+START_OF_FRAME_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def get_jpeg_size(encoded_image) -> Optional[Tuple[int, int]]:
+    """
+    Return height and width of a JPEG image read from its start of frame segment, None if it is not found.
+    """
+    data = memoryview(encoded_image)
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # fill byte
+            position += 1
+            continue
+        (segment_length,) = struct.unpack(">H", data[position + 2 : position + 4])
+        if marker in START_OF_FRAME_MARKERS:
+            if position + 9 > len(data):
+                return None
+            return struct.unpack(">HH", data[position + 5 : position + 9])
+        position += 2 + segment_length
+    return None
+
+
+def get_scale_factor(image_size: Tuple[int, int], target_size: int) -> int:
+    """
+    Return the largest scale factor the image can be reduced by, while its longer side stays at least target_size.
+    """
+    scale_factor = 1
+    for factor in SCALE_FACTORS:
+        if max(image_size) / factor >= target_size:
+            scale_factor = factor
+    return scale_factor
+
+
+class FrameDecoder:
+    """
+    Decodes JPEG frames at the smallest scale that is still at least target_size pixels (longer side), None for full size.
+    """
+
+    def __init__(self, target_size: int = 640, use_turbo_jpeg: bool = True) -> None:
+        self.target_size = target_size
+        self.turbo_jpeg = None
+        if use_turbo_jpeg and (TurboJPEG is not None):
+            try:
+                self.turbo_jpeg = TurboJPEG()
+            except (OSError, RuntimeError):
+                # PyTurboJPEG is installed, but not the libjpeg-turbo library
+                self.turbo_jpeg = None
+
+    def get_scale_factor(self, encoded_image, region: Tuple = None) -> int:
+        """
+        Return the scale factor the frame is decoded with. With a region (x_min, y_min, x_max, y_max relative to the
+        frame size), the region instead of the whole frame stays at least target_size pixels.
+        """
+        if self.target_size is None:
+            return 1
+        image_size = get_jpeg_size(encoded_image)
+        if image_size is None:
+            return 1
+        if region is not None:
+            x_min, y_min, x_max, y_max = region
+            image_size = (
+                (y_max - y_min) * image_size[0],
+                (x_max - x_min) * image_size[1],
+            )
+        return get_scale_factor(image_size, self.target_size)
+
+    def decode(self, encoded_image, region: Tuple = None, scale_factor: int = None):
+        """
+        Return the decoded BGR image of a JPEG frame, None if it could not be decoded. Only the region of the frame
+        is kept as large as target_size, if it is given (see get_scale_factor). A given scale factor is used instead.
+        """
+        if scale_factor is None:
+            scale_factor = self.get_scale_factor(encoded_image, region)
+        if self.turbo_jpeg is not None:
+            try:
+                return self.turbo_jpeg.decode(
+                    encoded_image, scaling_factor=(1, scale_factor)
+                )
+            except (OSError, ValueError):
+                return None
+        # wraps the bytes of the frame, without copying them
+        image_array = np.frombuffer(encoded_image, dtype=np.uint8)
+        return cv.imdecode(image_array, REDUCED_READ_FLAGS[scale_factor])
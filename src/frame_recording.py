@@ -0,0 +1,175 @@
+"""
+This file contains the recording and replay of camera frames, to run the demo-application without a camera.
+A clip is a folder of chunks, every chunk a .npz file holding up to frames_per_chunk JPEG frames as they were fetched
+(concatenated, with their offsets) and their capture times. A recorded clip is replayed as frame source of the
+detection engine, either in real time (with the timing of the recording) or as fast as possible. Together with
+DetectionEngine.process, a clip always leads to the same detections and scores, e.g. for benchmarks (see
+benchmarks.py) and tests. Execute the script in the root-directory of this project to record a clip, e.g.:
+
+    python src/frame_recording.py http://192.168.178.39:8080 ./clips/table_1 --seconds 60
+"""
+
+import os
+import time
+import argparse
+import threading
+import numpy as np
+from glob import glob
+from camera_capture import FrameGrabber
+from typing import Iterator, List, Optional, Tuple
+
+CHUNK_FILE_NAME = "chunk_{:05d}.npz"
+
+
+def save_chunk(path: str, encoded_images: List[bytes], capture_times: List[float]):
+    """
+    Save JPEG frames and their capture times as chunk. The chunk is written to a temporary file first, so a chunk is
+    either complete or missing.
+    """
+    offsets = np.cumsum([0] + [len(encoded_image) for encoded_image in encoded_images])
+    data = np.frombuffer(b"".join(encoded_images), dtype=np.uint8)
+    with open(path + ".tmp", "wb") as file:
+        np.savez(
+            file,
+            data=data,
+            offsets=offsets.astype(np.int64),
+            capture_times=np.asarray(capture_times, dtype=np.float64),
+        )
+    os.replace(path + ".tmp", path)
+
+
+def load_chunk(path: str) -> List[Tuple[bytes, float]]:
+    """
+    Return the JPEG frames of a chunk with their capture times.
+    """
+    with np.load(path) as chunk:
+        data, offsets = chunk["data"], chunk["offsets"]
+        capture_times = chunk["capture_times"]
+    return [
+        (data[offsets[i] : offsets[i + 1]].tobytes(), float(capture_times[i]))
+        for i in range(len(capture_times))
+    ]
+
+
+def iter_clip(CLIP_DIR: str) -> Iterator[Tuple[bytes, float]]:
+    """
+    Yield the JPEG frames of a clip with their capture times, loading one chunk at a time.
+    """
+    for path in sorted(glob(os.path.join(CLIP_DIR, "chunk_*.npz"))):
+        yield from load_chunk(path)
+
+
+class FrameRecorder:
+    """
+    Saves the frames added to it as clip.
+    """
+
+    def __init__(self, CLIP_DIR: str, frames_per_chunk: int = 100) -> None:
+        self.CLIP_DIR = CLIP_DIR
+        self.frames_per_chunk = frames_per_chunk
+        os.makedirs(CLIP_DIR, exist_ok=True)
+        self.encoded_images = list()
+        self.capture_times = list()
+        self.number_of_chunks = 0
+        self.number_of_frames = 0
+        self.lock = threading.Lock()
+
+    def add(self, encoded_image: bytes, capture_time: float) -> None:
+        """
+        Add a JPEG frame to the clip. Every full chunk is saved immediately.
+        """
+        with self.lock:
+            self.encoded_images.append(encoded_image)
+            self.capture_times.append(capture_time)
+            self.number_of_frames += 1
+            if len(self.encoded_images) >= self.frames_per_chunk:
+                self._save_chunk()
+
+    def close(self) -> None:
+        """
+        Save the frames of the last, incomplete chunk.
+        """
+        with self.lock:
+            if self.encoded_images:
+                self._save_chunk()
+
+    def _save_chunk(self) -> None:
+        save_chunk(
+            os.path.join(self.CLIP_DIR, CHUNK_FILE_NAME.format(self.number_of_chunks)),
+            self.encoded_images,
+            self.capture_times,
+        )
+        self.number_of_chunks += 1
+        self.encoded_images = list()
+        self.capture_times = list()
+
+
+class RecordingFrameSource:
+    """
+    Frame source passing the frames of another frame source through, while recording them.
+    """
+
+    def __init__(self, frame_source, recorder: FrameRecorder) -> None:
+        self.frame_source = frame_source
+        self.recorder = recorder
+
+    def read(self, timeout: float = None) -> Optional[Tuple[bytes, float]]:
+        encoded_frame = self.frame_source.read(timeout)
+        if encoded_frame is not None:
+            self.recorder.add(*encoded_frame)
+        return encoded_frame
+
+
+class ReplayFrameSource:
+    """
+    Frame source replaying a clip, in real time or as fast as possible. The capture times are moved to the time of the replay.
+    The finished event is set after the last frame.
+    """
+
+    def __init__(self, CLIP_DIR: str, real_time: bool = True) -> None:
+        self.frames = iter_clip(CLIP_DIR)
+        self.real_time = real_time
+        self.finished = threading.Event()
+        self.first_capture_time = None
+        self.start_time = None
+        self.number_of_frames = 0
+
+    def read(self, timeout: float = None) -> Optional[Tuple[bytes, float]]:
+        """
+        Return the next frame of the clip with its capture time, or None when the clip is finished.
+        """
+        encoded_frame = next(self.frames, None)
+        if encoded_frame is None:
+            self.finished.set()
+            time.sleep(timeout or 0)
+            return None
+        encoded_image, capture_time = encoded_frame
+        if self.start_time is None:
+            self.first_capture_time, self.start_time = capture_time, time.time()
+        replay_time = self.start_time + (capture_time - self.first_capture_time)
+        if self.real_time:
+            time.sleep(max(replay_time - time.time(), 0))
+        else:
+            replay_time = time.time()
+        self.number_of_frames += 1
+        return encoded_image, replay_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("camera_url", help="address displayed in IP Webcam")
+    parser.add_argument("clip_dir", help="folder the clip is saved to")
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--frames-per-chunk", type=int, default=100)
+    args = parser.parse_args()
+
+    frame_grabber = FrameGrabber(args.camera_url).start()
+    recorder = FrameRecorder(args.clip_dir, args.frames_per_chunk)
+    end_time = time.time() + args.seconds
+    while time.time() < end_time:
+        encoded_frame = frame_grabber.read(timeout=1.0)
+        if encoded_frame is not None:
+            recorder.add(*encoded_frame)
+    frame_grabber.stop()
+    recorder.close()
+    print(f'Recorded {recorder.number_of_frames} frames to "{args.clip_dir}"!')
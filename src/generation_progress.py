@@ -0,0 +1,147 @@
+"""
+This file contains the progress manifest, that makes an interrupted dataset generation resumable.
+Every image only depends on the seed and its index (see get_image_rng in dataset_generation_functions.py),
+so the images can be generated in any order and a rerun does not need the images generated before.
+The manifest in OUTPUT_DIR stores size, modification time and CRC32 checksum of the image and labels files of every
+completed image. It is saved every checkpoint_interval images, a rerun with the same parameters only generates the
+images that are not in the manifest, or whose files are missing, truncated or changed. Size and modification time are
+checked for every file, the checksum only for the files written after the last checkpoint before the manifest was
+saved, as only their data could still have been lost in a crash. The manifest itself is replaced atomically and
+flushed to the disk together with its directory.
+"""
+
+import os
+import json
+import zlib
+from threading import Lock
+from typing import Dict, List, Set, Tuple
+
+PROGRESS_FILE_NAME = ".progress.json"
+
+
+def fsync_path(path: str) -> None:
+    """
+    Flush a file, or the entries of a directory, to the disk, so they survive a crash.
+    """
+    file_descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(file_descriptor)
+    finally:
+        os.close(file_descriptor)
+
+
+def get_file_entry(file_path: str, data: bytes, modification_time: int) -> List:
+    """
+    Return path, size, CRC32 checksum and modification time (in ns) of a written file, as saved in the progress manifest.
+    """
+    return [file_path, len(data), zlib.crc32(data), modification_time]
+
+
+def is_file_entry_valid(
+    OUTPUT_DIR: str, file_entry: List, checkpoint_time: int = 0
+) -> bool:
+    """
+    Return a bool that indicates if the file still has the size and modification time it had when it was written.
+    The checksum is only compared for files written at or after the checkpoint time (in ns).
+    """
+    file_path, size, checksum, modification_time = file_entry
+    full_file_path = OUTPUT_DIR + "/" + file_path
+    if not os.path.exists(full_file_path):
+        return False
+    file_stat = os.stat(full_file_path)
+    if (file_stat.st_size != size) or (file_stat.st_mtime_ns != modification_time):
+        return False
+    if modification_time < checkpoint_time:
+        return True
+    with open(full_file_path, "rb") as file:
+        return zlib.crc32(file.read()) == checksum
+
+
+class GenerationProgress:
+    """
+    Completed images of a dataset generation, saved in the progress manifest of the output directory.
+    """
+
+    def __init__(
+        self,
+        OUTPUT_DIR: str,
+        parameters: Dict,
+        checkpoint_interval: int = 1000,
+        fsync: bool = True,
+    ) -> None:
+        self.OUTPUT_DIR = OUTPUT_DIR
+        self.progress_path = OUTPUT_DIR + "/" + PROGRESS_FILE_NAME
+        # the parameters are compared as saved in JSON, e.g. tuples become lists
+        self.parameters = json.loads(json.dumps(parameters, sort_keys=True))
+        self.checkpoint_interval = checkpoint_interval
+        self.fsync = fsync
+        self.completed_images = dict()
+        self.lock = Lock()
+        self.number_of_unsaved_images = 0
+        # modification time of the manifest when it was saved last, in ns
+        self.checkpoint_time = 0
+
+    def load(self) -> Tuple[Set[int], int]:
+        """
+        Load the progress of a previous run with the same parameters and verify its files.
+        Returns a tuple containing the indices of the verified images and the number of images that need to be generated again.
+        """
+        if not os.path.exists(self.progress_path):
+            return set(), 0
+        with open(self.progress_path) as file:
+            progress = json.load(file)
+        if progress["parameters"] != self.parameters:
+            print("The dataset was generated with other parameters, starting over.")
+            return set(), 0
+        invalid_images = 0
+        for image_index, file_entries in progress["completed_images"].items():
+            if all(
+                is_file_entry_valid(
+                    self.OUTPUT_DIR, file_entry, progress["checkpoint_time"]
+                )
+                for file_entry in file_entries
+            ):
+                self.completed_images[image_index] = file_entries
+            else:
+                invalid_images += 1
+        self.checkpoint_time = os.stat(self.progress_path).st_mtime_ns
+        return set(int(i) for i in self.completed_images), invalid_images
+
+    def add(self, image_index: int, file_entries: List[List]) -> bool:
+        """
+        Mark an image as completed. Returns a bool that indicates if checkpoint_interval images were added since the
+        manifest was saved, it is saved by the caller after flushing their files to the disk (see DatasetWriter).
+        Can be called by several threads at once.
+        """
+        with self.lock:
+            self.completed_images[str(image_index)] = file_entries
+            self.number_of_unsaved_images += 1
+            return self.number_of_unsaved_images >= self.checkpoint_interval
+
+    def save(self) -> None:
+        """
+        Save the progress manifest.
+        """
+        with self.lock:
+            self._save()
+
+    def _save(self) -> None:
+        with open(self.progress_path + ".tmp", "w") as file:
+            json.dump(
+                {
+                    "parameters": self.parameters,
+                    # the files written after it are checked by their checksum when loading
+                    "checkpoint_time": self.checkpoint_time,
+                    "completed_images": self.completed_images,
+                },
+                file,
+            )
+        # the new manifest is on the disk before it replaces the old one, and the replacement after
+        if self.fsync:
+            fsync_path(self.progress_path + ".tmp")
+        os.replace(self.progress_path + ".tmp", self.progress_path)
+        if self.fsync:
+            fsync_path(self.OUTPUT_DIR)
+        # the time of the file system, the modification times of the written files are compared with it
+        self.checkpoint_time = os.stat(self.progress_path).st_mtime_ns
+        self.number_of_unsaved_images = 0
@@ -0,0 +1,401 @@
+"""
+This file contains the latency histograms and counters of the demo-application and the dataset generation.
+Every stage of the live loop (decode, inference, tracking, scoring, rendering and the image push to the browser) and
+of generate_dataset reports its duration to a histogram, the frame grabbers report the time between the frames of their
+camera, together with counters of frames, detections, played cards and dropped frames. A histogram keeps its last samples for percentiles and cumulative bucket counts for
+Prometheus; reporting a value only takes a few microseconds, so the metrics can stay on in production.
+The metrics of the process are kept by the registry of this module. They are shown in the sidebar of the
+demo-application and can be exported as Prometheus text format on an HTTP endpoint or appended to a JSONL log file.
+The application reads the port of the endpoint from SHEL_METRICS_PORT and the log file from SHEL_METRICS_LOG.
+Worker processes send the metrics they reported to the main process, where they are merged into its registry (see
+pop_updates and merge_updates).
+"""
+
+import json
+import time
+import bisect
+import threading
+import numpy as np
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+PORT_VARIABLE = "SHEL_METRICS_PORT"
+LOG_VARIABLE = "SHEL_METRICS_LOG"
+METRIC_PREFIX = "shel_"
+# upper bounds of the histogram buckets in seconds
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+
+class Histogram:
+    """
+    Distribution of durations in seconds: the last window_size samples for percentiles and all samples in buckets.
+    """
+
+    def __init__(
+        self, buckets: Sequence[float] = DEFAULT_BUCKETS, window_size: int = 1024
+    ) -> None:
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.window = np.zeros(window_size, dtype=np.float64)
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """
+        Add a sample to the histogram.
+        """
+        with self.lock:
+            self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.window[self.count % len(self.window)] = value
+            self.count += 1
+            self.sum += value
+
+    def pop_samples(self) -> Tuple[List[int], int, float, np.ndarray]:
+        """
+        Return bucket counts, count, sum and the last samples in order, and reset the histogram.
+        """
+        with self.lock:
+            number_of_samples = min(self.count, len(self.window))
+            positions = (
+                self.count - number_of_samples + np.arange(number_of_samples)
+            ) % len(self.window)
+            samples = (
+                list(self.bucket_counts),
+                self.count,
+                self.sum,
+                self.window[positions],
+            )
+            self.bucket_counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.sum = 0.0
+        return samples
+
+    def add_samples(
+        self, bucket_counts: List[int], count: int, total: float, samples: np.ndarray
+    ) -> None:
+        """
+        Add the samples of another histogram with the same buckets (see pop_samples).
+        """
+        with self.lock:
+            samples = np.asarray(samples)[-len(self.window) :]
+            # the samples are the last ones of the count added samples
+            start = self.count + count - len(samples)
+            self.window[(start + np.arange(len(samples))) % len(self.window)] = samples
+            self.bucket_counts = [
+                own_count + other_count
+                for own_count, other_count in zip(self.bucket_counts, bucket_counts)
+            ]
+            self.count += count
+            self.sum += total
+
+    def get_percentiles(
+        self, percentiles: Sequence[int] = (50, 90, 99)
+    ) -> Dict[str, float]:
+        """
+        Return the percentiles of the last samples, empty if there are no samples yet.
+        """
+        with self.lock:
+            values = self.window[: min(self.count, len(self.window))].copy()
+        if len(values) == 0:
+            return dict()
+        return dict(
+            (f"p{percentile}", float(value))
+            for percentile, value in zip(
+                percentiles, np.percentile(values, percentiles)
+            )
+        )
+
+
+class Counter:
+    """
+    A number that only increases.
+    """
+
+    def __init__(self) -> None:
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def increase(self, amount: int = 1) -> None:
+        with self.lock:
+            self.value += amount
+
+    def pop_value(self) -> int:
+        """
+        Return the value and reset it to zero.
+        """
+        with self.lock:
+            value, self.value = self.value, 0
+        return value
+
+
+def escape_label_value(value: str) -> str:
+    """
+    Return the label value with backslashes, quotes and line breaks escaped for the Prometheus text format.
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: Tuple[Tuple[str, str], ...], **extra_labels) -> str:
+    """
+    Return labels in Prometheus text format, e.g. {stage="infer"}.
+    """
+    labels = list(labels) + list(extra_labels.items())
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(f'{key}="{escape_label_value(value)}"' for key, value in labels)
+        + "}"
+    )
+
+
+class MetricsRegistry:
+    """
+    All histograms and counters of a process, identified by name and labels.
+    """
+
+    def __init__(self) -> None:
+        self.histograms = dict()
+        self.counters = dict()
+        self.descriptions = dict()
+        self.lock = threading.Lock()
+
+    def histogram(self, name: str, description: str = "", **labels) -> Histogram:
+        """
+        Return the histogram with the name and labels, created on the first call.
+        """
+        return self._get_metric(self.histograms, Histogram, name, description, labels)
+
+    def counter(self, name: str, description: str = "", **labels) -> Counter:
+        """
+        Return the counter with the name and labels, created on the first call.
+        """
+        return self._get_metric(self.counters, Counter, name, description, labels)
+
+    @contextmanager
+    def timed(self, name: str, **labels) -> Iterator[None]:
+        """
+        Report the duration of the block to the histogram with the name and labels.
+        """
+        histogram = self.histogram(name, **labels)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.observe(time.perf_counter() - start_time)
+
+    def _get_metric(self, metric_dict: Dict, metric_class, name, description, labels):
+        key = (name, tuple(sorted((key, str(value)) for key, value in labels.items())))
+        metric = metric_dict.get(key)
+        if metric is None:
+            with self.lock:
+                if description or (name not in self.descriptions):
+                    self.descriptions[name] = description
+                metric = metric_dict.setdefault(key, metric_class())
+        return metric
+
+    def get_histograms(self) -> List[Tuple[Tuple, Histogram]]:
+        """
+        Return the histograms sorted by name and labels.
+        """
+        with self.lock:
+            return sorted(self.histograms.items(), key=lambda item: item[0])
+
+    def get_counters(self) -> List[Tuple[Tuple, Counter]]:
+        """
+        Return the counters sorted by name and labels.
+        """
+        with self.lock:
+            return sorted(self.counters.items(), key=lambda item: item[0])
+
+    def pop_updates(self) -> Dict:
+        """
+        Return the samples of all histograms and the values of all counters reported since the last call, and reset
+        them, e.g. to send the metrics of a worker process to the main process (see merge_updates).
+        """
+        return {
+            "histograms": [
+                (name, labels, self.descriptions.get(name, ""), histogram.pop_samples())
+                for (name, labels), histogram in self.get_histograms()
+                if histogram.count
+            ],
+            "counters": [
+                (name, labels, self.descriptions.get(name, ""), counter.pop_value())
+                for (name, labels), counter in self.get_counters()
+                if counter.value
+            ],
+        }
+
+    def merge_updates(self, updates: Dict) -> None:
+        """
+        Add the metrics of another registry, returned by its pop_updates.
+        """
+        for name, labels, description, samples in updates["histograms"]:
+            self.histogram(name, description, **dict(labels)).add_samples(*samples)
+        for name, labels, description, value in updates["counters"]:
+            self.counter(name, description, **dict(labels)).increase(value)
+
+    def get_snapshot(self) -> Dict:
+        """
+        Return the current values of all metrics: percentiles, count and sum of the histograms and the counters.
+        """
+        return {
+            "time": time.time(),
+            "histograms": [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    **histogram.get_percentiles(),
+                }
+                for (name, labels), histogram in self.get_histograms()
+            ],
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": counter.value}
+                for (name, labels), counter in self.get_counters()
+            ],
+        }
+
+    def to_prometheus(self) -> str:
+        """
+        Return all metrics in Prometheus text format.
+        """
+        lines = list()
+        written_names = set()
+
+        def add_header(name: str, metric_type: str) -> None:
+            if name not in written_names:
+                written_names.add(name)
+                description = self.descriptions.get(name) or name.replace("_", " ")
+                lines.append(f"# HELP {METRIC_PREFIX}{name} {description}")
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} {metric_type}")
+
+        for (name, labels), histogram in self.get_histograms():
+            add_header(name, "histogram")
+            with histogram.lock:
+                bucket_counts = list(histogram.bucket_counts)
+                count, total = histogram.count, histogram.sum
+            cumulative_count = 0
+            for bound, bucket_count in zip(
+                histogram.buckets + (float("inf"),), bucket_counts
+            ):
+                cumulative_count += bucket_count
+                bound = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    f"{METRIC_PREFIX}{name}_bucket{format_labels(labels, le=bound)} {cumulative_count}"
+                )
+            lines.append(f"{METRIC_PREFIX}{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{METRIC_PREFIX}{name}_count{format_labels(labels)} {count}")
+        for (name, labels), counter in self.get_counters():
+            add_header(name, "counter")
+            lines.append(
+                f"{METRIC_PREFIX}{name}{format_labels(labels)} {counter.value}"
+            )
+        return "\n".join(lines) + "\n"
+
+    def write_jsonl(self, path: str) -> None:
+        """
+        Append a snapshot of all metrics to a JSONL log file.
+        """
+        with open(path, "a") as file:
+            file.write(json.dumps(self.get_snapshot()) + "\n")
+
+
+# metrics of this process
+registry = MetricsRegistry()
+
+
+def start_http_server(
+    port: int, metrics_registry: MetricsRegistry = registry, host: str = "0.0.0.0"
+) -> ThreadingHTTPServer:
+    """
+    Serve the metrics in Prometheus text format at /metrics, on a background thread. Returns the server.
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics_registry.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(
+        target=server.serve_forever, name="metrics_server", daemon=True
+    ).start()
+    return server
+
+
+def start_jsonl_log(
+    path: str, interval: float = 10.0, metrics_registry: MetricsRegistry = registry
+) -> threading.Event:
+    """
+    Append a snapshot of the metrics to the log file every interval seconds, on a background thread.
+    Returns an event that stops the logging when set.
+    """
+    stopping = threading.Event()
+
+    def write_snapshots() -> None:
+        while not stopping.wait(interval):
+            metrics_registry.write_jsonl(path)
+        metrics_registry.write_jsonl(path)
+
+    threading.Thread(target=write_snapshots, name="metrics_log", daemon=True).start()
+    return stopping
+
+
+def get_stage_table(
+    metrics_registry: MetricsRegistry = registry, name: str = "stage_seconds"
+) -> List[Dict]:
+    """
+    Return a row with the latency percentiles in ms for every histogram with the name, e.g. to show them as table.
+    """
+    rows = list()
+    for (histogram_name, labels), histogram in metrics_registry.get_histograms():
+        if histogram_name == name:
+            rows.append(
+                {
+                    **dict(labels),
+                    "count": histogram.count,
+                    **dict(
+                        (f"{key}_ms", round(1000 * value, 2))
+                        for key, value in histogram.get_percentiles().items()
+                    ),
+                }
+            )
+    return rows
+
+
+def get_counter_table(metrics_registry: MetricsRegistry = registry) -> List[Dict]:
+    """
+    Return a row with name, labels and value of every counter, e.g. to show them as table.
+    """
+    return [
+        {"name": name, **dict(labels), "value": counter.value}
+        for (name, labels), counter in metrics_registry.get_counters()
+    ]
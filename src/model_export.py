@@ -0,0 +1,115 @@
+"""
+This file contains the export of the trained YOLO model to inference backends, which are faster on CPUs than PyTorch.
+Supported backends are PyTorch (the trained model itself), ONNX Runtime, OpenVINO and OpenVINO with int8 post-training
+quantization. The int8 quantization is calibrated on a dataset generated by generate_dataset (its data.yaml).
+The exported models are saved next to the trained model and only exported again, when the trained model changes.
+The demo-application reads the backend from the environment variable SHEL_BACKEND (and the calibration dataset
+from SHEL_CALIBRATION_DATA), and another model than the trained one from SHEL_MODEL. Instead of the trained model, the randomly initialized "yolov8n.yaml" can be used as
+stand-in, e.g. for tests and benchmarks without access to the trained model.
+"""
+
+import os
+import torch
+import numpy as np
+from pathlib import Path
+from ultralytics import YOLO
+from card_tracker import get_iou_matrix
+
+BACKENDS = ("pytorch", "onnx", "openvino", "openvino_int8")
+BACKEND_VARIABLE = "SHEL_BACKEND"
+MODEL_VARIABLE = "SHEL_MODEL"
+CALIBRATION_DATA_VARIABLE = "SHEL_CALIBRATION_DATA"
+STAND_IN_MODEL = "yolov8n.yaml"
+
+
+def load_model(MODEL_PATH: str):
+    """
+    Return the YOLO model of any backend. Models built from a .yaml file are initialized with a fixed seed,
+    so every backend of the stand-in model has the same weights. The random state of torch is restored afterwards.
+    """
+    if MODEL_PATH.endswith(".yaml"):
+        with torch.random.fork_rng():
+            torch.manual_seed(0)
+            return YOLO(MODEL_PATH, task="detect")
+    return YOLO(MODEL_PATH, task="detect")
+
+
+def get_export_path(MODEL_PATH: str, backend: str) -> str:
+    """
+    Return the path the model is exported to, as named by ultralytics.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(
+            f'Unknown backend "{backend}", choose one of {", ".join(BACKENDS)}.'
+        )
+    model_file = Path(MODEL_PATH)
+    return {
+        "pytorch": MODEL_PATH,
+        "onnx": str(model_file.with_suffix(".onnx")),
+        "openvino": str(model_file.with_suffix("")) + "_openvino_model",
+        "openvino_int8": str(model_file.with_suffix("")) + "_int8_openvino_model",
+    }[backend]
+
+
+def export_model(
+    MODEL_PATH: str,
+    backend: str,
+    calibration_data: str = None,
+    image_size: int = 640,
+) -> str:
+    """
+    Export the model to the backend, if it was not exported since the last change of the model. Returns the path of the exported model.
+    For int8 quantization, the path of the data.yaml of a generated dataset is needed for calibration.
+    """
+    export_path = get_export_path(MODEL_PATH, backend)
+    if backend == "pytorch":
+        return MODEL_PATH
+    if os.path.exists(export_path) and (
+        (not os.path.exists(MODEL_PATH))
+        or (os.path.getmtime(export_path) >= os.path.getmtime(MODEL_PATH))
+    ):
+        return export_path
+
+    model = load_model(MODEL_PATH)
+    print(f'Exporting model "{MODEL_PATH}" to {backend}...')
+    if backend == "onnx":
+        return model.export(format="onnx", imgsz=image_size)
+    if backend == "openvino":
+        return model.export(format="openvino", imgsz=image_size)
+    if calibration_data is None:
+        raise ValueError("The int8 quantization needs a dataset for calibration.")
+    return model.export(
+        format="openvino", imgsz=image_size, int8=True, data=calibration_data
+    )
+
+
+def get_configured_model_path(MODEL_PATH: str) -> str:
+    """
+    Return the path of the model for the backend configured by environment variables, exported if needed.
+    """
+    backend = os.environ.get(BACKEND_VARIABLE, "pytorch")
+    calibration_data = os.environ.get(CALIBRATION_DATA_VARIABLE)
+    return export_model(MODEL_PATH, backend, calibration_data)
+
+
+def get_detection_agreement(
+    boxes, card_classes, reference_boxes, reference_card_classes, iou_threshold=0.5
+) -> float:
+    """
+    Return how well two sets of detections agree, as F1 score of the detections matched to the reference detections
+    (same class and IoU above the threshold). Returns 1 if both sets are empty.
+    """
+    if (len(boxes) == 0) and (len(reference_boxes) == 0):
+        return 1.0
+    iou_matrix = get_iou_matrix(boxes, reference_boxes)
+    iou_matrix[
+        np.asarray(card_classes)[:, None] != np.asarray(reference_card_classes)[None, :]
+    ] = 0
+    number_of_matches = 0
+    # greedy matching, best pairs first
+    while iou_matrix.size and (iou_matrix.max() >= iou_threshold):
+        i, j = np.unravel_index(iou_matrix.argmax(), iou_matrix.shape)
+        iou_matrix[i, :] = 0
+        iou_matrix[:, j] = 0
+        number_of_matches += 1
+    return 2 * number_of_matches / (len(boxes) + len(reference_boxes))
@@ -0,0 +1,115 @@
+"""
+This file contains the process-wide store of the YOLO models used by the demo-application.
+A model is loaded once per process and shared by every browser session and every rerun of the Streamlit script.
+After loading, one inference on an empty image is run (warm-up), because the first inference of a model also
+sets up the predictor and is a lot slower than the following ones. The model can be loaded in the background,
+its ready event tells the user interface when the detection can start. Load time, warm-up time and the memory
+of the process before and after loading are kept, to see what a model costs (see also benchmarks.py).
+"""
+
+import os
+import time
+import resource
+import threading
+import numpy as np
+from model_export import load_model
+from typing import Dict
+
+WARMUP_IMAGE_SIZE = 640
+
+_loaded_models = dict()
+_loaded_models_lock = threading.Lock()
+
+
+def get_rss_mb() -> float:
+    """
+    Return the current resident memory of this process in MB, or the peak resident memory if it is not available.
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            resident_pages = int(file.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class LoadedModel:
+    """
+    A YOLO model shared by the whole process, together with its load statistics.
+    """
+
+    def __init__(self, MODEL_PATH: str) -> None:
+        self.MODEL_PATH = MODEL_PATH
+        self.model = None
+        self.ready = threading.Event()
+        self.error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.rss_before_mb = None
+        self.rss_after_mb = None
+
+    def load(self, warmup: bool = True) -> None:
+        """
+        Load the model and run the warm-up inference. Sets the ready event, also if loading failed.
+        """
+        try:
+            self.rss_before_mb = get_rss_mb()
+            start_time = time.perf_counter()
+            self.model = load_model(self.MODEL_PATH)
+            self.load_seconds = time.perf_counter() - start_time
+            if warmup:
+                start_time = time.perf_counter()
+                warmup_image = np.zeros(
+                    (WARMUP_IMAGE_SIZE, WARMUP_IMAGE_SIZE, 3), dtype=np.uint8
+                )
+                self.model(source=warmup_image, verbose=False)
+                self.warmup_seconds = time.perf_counter() - start_time
+            self.rss_after_mb = get_rss_mb()
+        except Exception as error:
+            self.error = error
+        finally:
+            self.ready.set()
+
+    def wait(self, timeout: float = None):
+        """
+        Return the model as soon as it is loaded. Raises the error of loading, if it failed.
+        """
+        if not self.ready.wait(timeout):
+            raise TimeoutError(f'Model "{self.MODEL_PATH}" is not loaded yet.')
+        if self.error is not None:
+            raise self.error
+        return self.model
+
+    def get_statistics(self) -> Dict:
+        """
+        Return load time, warm-up time and memory of the model.
+        """
+        return {
+            "model_path": self.MODEL_PATH,
+            "ready": self.ready.is_set(),
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "rss_before_mb": self.rss_before_mb,
+            "rss_after_mb": self.rss_after_mb,
+        }
+
+
+def get_loaded_model(
+    MODEL_PATH: str, background: bool = False, warmup: bool = True
+) -> LoadedModel:
+    """
+    Return the model of the process, loading it on the first call only.
+    With background, the model is loaded by another thread and this function returns immediately (see LoadedModel.ready).
+    """
+    with _loaded_models_lock:
+        if MODEL_PATH in _loaded_models:
+            return _loaded_models[MODEL_PATH]
+        loaded_model = LoadedModel(MODEL_PATH)
+        _loaded_models[MODEL_PATH] = loaded_model
+    if background:
+        threading.Thread(
+            target=loaded_model.load, args=(warmup,), name="model_loading", daemon=True
+        ).start()
+    else:
+        loaded_model.load(warmup)
+    return loaded_model
@@ -0,0 +1,81 @@
+"""
+This file contains the motion gate, which decides if the model needs to run on a frame.
+During most of a game the table does not change, so instead of detecting the same cards again and again, every
+frame is compared to the frame the model last ran on. The comparison is done on small grayscale versions of the
+frames: if only a few pixels changed (camera noise, light flicker), the scene is static and the detections of the
+last inference are reused. To not keep outdated detections forever, the model runs again after a fixed number of
+skipped frames.
+"""
+
+import cv2 as cv
+import numpy as np
+from typing import Tuple
+
+
+class MotionGate:
+    """
+    Frame differencing on downscaled frames, to skip the inference on static frames.
+    """
+
+    def __init__(
+        self,
+        size: Tuple[int, int] = (80, 60),
+        pixel_threshold: int = 12,
+        changed_fraction: float = 0.004,
+        max_skipped_frames: int = 15,
+    ) -> None:
+        self.size = size
+        self.pixel_threshold = pixel_threshold
+        self.changed_fraction = changed_fraction
+        self.max_skipped_frames = max_skipped_frames
+        self.reference = None
+        self.skipped_frames_in_row = 0
+        self.number_of_inferred_frames = 0
+        self.number_of_skipped_frames = 0
+        self.number_of_rechecks = 0
+
+    def get_thumbnail(self, image):
+        """
+        Return the small, slightly blurred grayscale version of the image used for the comparison.
+        """
+        if image.ndim == 3:
+            image = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
+        thumbnail = cv.resize(image, self.size, interpolation=cv.INTER_AREA)
+        return cv.GaussianBlur(thumbnail, (3, 3), 0)
+
+    def get_changed_fraction(self, thumbnail) -> float:
+        """
+        Return the fraction of pixels that changed since the reference frame.
+        """
+        difference = cv.absdiff(thumbnail, self.reference)
+        return np.count_nonzero(difference > self.pixel_threshold) / difference.size
+
+    def should_infer(self, image) -> bool:
+        """
+        Return a bool that indicates if the model has to run on the image. The image becomes the new reference if so.
+        """
+        thumbnail = self.get_thumbnail(image)
+        if self.reference is None:
+            changed = True
+        else:
+            changed = self.get_changed_fraction(thumbnail) > self.changed_fraction
+        recheck = self.skipped_frames_in_row >= self.max_skipped_frames
+        if changed or recheck:
+            self.reference = thumbnail
+            self.skipped_frames_in_row = 0
+            self.number_of_inferred_frames += 1
+            self.number_of_rechecks += int(recheck and not changed)
+            return True
+        self.skipped_frames_in_row += 1
+        self.number_of_skipped_frames += 1
+        return False
+
+    def get_counters(self) -> dict:
+        """
+        Return the number of inferred, skipped and rechecked frames.
+        """
+        return {
+            "inferred_frames": self.number_of_inferred_frames,
+            "skipped_frames": self.number_of_skipped_frames,
+            "rechecks": self.number_of_rechecks,
+        }
@@ -4,14 +4,23 @@ The cards need to be cropped so they can then be placed on a background
 in the second step.
 This is done be detecting the outer edges of a card, filling the inner area,
 which leaves us with a mask we can use to distinguish card and background.
-The images are saved in a separate folder for further use.
+The images are saved in a separate folder for further use, as PNG with the mask stored
+in the alpha channel, so the mask does not need to be computed again when placing the card.
+A manifest in this folder keeps track of the processed photos, so only new or changed photos
+are processed when the dataset is generated again.
 """
 
 import cv2 as cv
 from pathlib import Path
 import os
+import json
+import hashlib
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
+from typing import Tuple, Dict, List
+
+MANIFEST_FILE_NAME = ".manifest.json"
 
 
 def find_edges(img):
@@ -41,27 +50,193 @@ def create_mask(img):
     return eroded_mask
 
 
-def crop_image(img):
+def read_photo(photo_path: str):
     """
-    Return cropped playing card.
+    Return the photo decoded at a quarter of its resolution, without decoding the full sized photo first.
+    """
+    return cv.imread(photo_path, cv.IMREAD_REDUCED_COLOR_4)
+
+
+def crop_card_and_mask(img, downscale: bool = True) -> Tuple:
     """
-    height, width, _ = img.shape
-    img = cv.resize(img, (int(width / 4), int(height / 4)))
+    Return a tuple containing the cropped playing card and the according mask.
+    The photo is resized to a quarter of its size first, unless it was already decoded at this size.
+    """
+    if downscale:
+        height, width, _ = img.shape
+        img = cv.resize(img, (int(width / 4), int(height / 4)))
     mask = create_mask(img)
     img = cv.bitwise_and(img, img, mask=mask)  # keep card, make background black
     x, y, w, h = cv.boundingRect(mask)
-    cropped_img = img[
-        y - 5 : y + h + 5, x - 5 : x + w + 5
-    ]  # add 5 pixels to each edge, to ensure the whole card is still in the image
+    # add 5 pixels to each edge, to ensure the whole card is still in the image
+    y_min, x_min = max(0, y - 5), max(0, x - 5)
+    cropped_img = img[y_min : y + h + 5, x_min : x + w + 5]
+    cropped_mask = mask[y_min : y + h + 5, x_min : x + w + 5]
+    return cropped_img, cropped_mask
+
+
+def crop_image(img):
+    """
+    Return cropped playing card.
+    """
+    cropped_img, _ = crop_card_and_mask(img)
     return cropped_img
 
 
-def save_image(input_photo_path: str, output_folder: str, card) -> None:
+def get_photo_name_without_extension(input_photo_path: str) -> str:
+    """
+    Return the name of the photo without folder and extension, which is the name of its card.
+    """
+    return input_photo_path.split("/")[-1].split(".")[0]
+
+
+def get_processed_photo_path(input_photo_path: str, output_folder: str) -> str:
+    """
+    Return the path the processed photo is saved at.
+    """
+    photo_name_without_extension = get_photo_name_without_extension(input_photo_path)
+    return output_folder + "/" + photo_name_without_extension + ".png"
+
+
+def check_photo_names(photo_paths: List[str]) -> None:
+    """
+    Raise a ValueError if several photos have the same name without extension, e.g. IMG_1.jpg and IMG_1.png.
+    They would be saved as the same card, which is then processed again every time.
+    """
+    photo_paths_by_name = dict()
+    for photo_path in sorted(photo_paths):
+        photo_paths_by_name.setdefault(
+            get_photo_name_without_extension(photo_path), list()
+        ).append(photo_path.split("/")[-1])
+    duplicate_names = [
+        photo_names
+        for photo_names in photo_paths_by_name.values()
+        if len(photo_names) > 1
+    ]
+    if duplicate_names:
+        raise ValueError(
+            f"Photos with the same name would be saved as the same card: {duplicate_names}"
+        )
+
+
+def save_image(input_photo_path: str, output_folder: str, card, mask) -> None:
+    """
+    Saves the processed photo to the output folder, with the mask as alpha channel.
+    """
+    processed_photo_path = get_processed_photo_path(input_photo_path, output_folder)
+    cv.imwrite(processed_photo_path, np.dstack((card, mask)))
+    # remove card saved by earlier versions without mask, to not have the card twice
+    legacy_photo_path = processed_photo_path[: -len(".png")] + ".jpg"
+    if os.path.exists(legacy_photo_path):
+        os.remove(legacy_photo_path)
+
+
+def load_card(processed_photo_path: str) -> Tuple:
+    """
+    Return a tuple containing the processed playing card and its mask.
+    The mask is only computed, if the card was saved without it.
+    """
+    card = cv.imread(processed_photo_path, cv.IMREAD_UNCHANGED)
+    if card.shape[2] == 4:
+        return np.ascontiguousarray(card[:, :, :3]), np.ascontiguousarray(card[:, :, 3])
+    return card, create_mask(card)
+
+
+def get_file_hash(file_path: str) -> str:
+    """
+    Return the SHA-256 hash of the file content.
+    """
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_manifest_entry(input_photo_path: str, file_hash: str = None) -> Dict:
+    """
+    Return size, modification time and hash of the input photo, as saved in the manifest.
+    """
+    file_stats = os.stat(input_photo_path)
+    return {
+        "size": file_stats.st_size,
+        "mtime_ns": file_stats.st_mtime_ns,
+        "sha256": file_hash or get_file_hash(input_photo_path),
+    }
+
+
+def load_manifest(PLAYING_CARDS_DIR: str) -> Dict[str, Dict]:
+    """
+    Return the manifest of the already processed photos. Returns an empty manifest if there is none.
+    """
+    manifest_path = PLAYING_CARDS_DIR + "/" + MANIFEST_FILE_NAME
+    if not os.path.exists(manifest_path):
+        return dict()
+    with open(manifest_path) as file:
+        return json.load(file)
+
+
+def save_manifest(PLAYING_CARDS_DIR: str, manifest: Dict[str, Dict]) -> None:
+    """
+    Saves the manifest of the processed photos.
+    """
+    manifest_path = PLAYING_CARDS_DIR + "/" + MANIFEST_FILE_NAME
+    with open(manifest_path + ".tmp", "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def is_processed_photo_valid(
+    input_photo_path: str, output_folder: str, manifest: Dict[str, Dict]
+) -> bool:
+    """
+    Return a bool that indicates if the processed photo and its mask are still up to date with the input photo.
+    The hash of the photo is only computed, if size or modification time changed.
+    """
+    photo_name = input_photo_path.split("/")[-1]
+    processed_photo_path = get_processed_photo_path(input_photo_path, output_folder)
+    if (photo_name not in manifest) or (not os.path.exists(processed_photo_path)):
+        return False
+    entry = manifest[photo_name]
+    file_stats = os.stat(input_photo_path)
+    if (entry["size"] == file_stats.st_size) and (
+        entry["mtime_ns"] == file_stats.st_mtime_ns
+    ):
+        return True
+    if entry["sha256"] == get_file_hash(input_photo_path):
+        # content did not change (e.g. photo copied again), only remember the new modification time
+        manifest[photo_name] = get_manifest_entry(input_photo_path, entry["sha256"])
+        return True
+    return False
+
+
+def process_photo(input_photo_path: str, output_folder: str) -> Tuple[str, Dict]:
+    """
+    Process a single photo and save the card with its mask. Returns the name of the photo and its manifest entry.
+    """
+    # read the manifest entry before processing, changes made to the photo meanwhile are detected next time
+    manifest_entry = get_manifest_entry(input_photo_path)
+    photo = read_photo(input_photo_path)
+    card, mask = crop_card_and_mask(photo, downscale=False)
+    save_image(input_photo_path, output_folder, card, mask)
+    return input_photo_path.split("/")[-1], manifest_entry
+
+
+def remove_deleted_photos(
+    PHOTOS_DIR: str, PLAYING_CARDS_DIR: str, manifest: Dict[str, Dict]
+) -> None:
     """
-    Saves the processed photo to the output folder.
+    Remove the processed cards of photos that are not in the input folder anymore.
     """
-    photo_name_without_extension = input_photo_path.split("/")[-1].split(".")[0]
-    cv.imwrite(output_folder + "/" + photo_name_without_extension + ".jpg", card)
+    for photo_name in list(manifest):
+        photo_path = PHOTOS_DIR + "/" + photo_name
+        if not os.path.exists(photo_path):
+            processed_photo_path = get_processed_photo_path(
+                photo_path, PLAYING_CARDS_DIR
+            )
+            if os.path.exists(processed_photo_path):
+                os.remove(processed_photo_path)
+            del manifest[photo_name]
 
 
 def create_playing_card_dir(photo_DIR: str) -> str:
@@ -74,16 +249,36 @@ def create_playing_card_dir(photo_DIR: str) -> str:
     return PLAYING_CARDS_DIR
 
 
-def process_photos(PHOTOS_DIR: str) -> str:
+def process_photos(PHOTOS_DIR: str, workers: int = 1) -> str:
     """
     Processes input photos for the train-image generation. Returns the directory of the saved processed images.
+    Only new or changed photos are processed, with workers > 1 using a pool of processes.
+    Raises a ValueError if several photos have the same name without extension.
     """
     PLAYING_CARDS_DIR = create_playing_card_dir(PHOTOS_DIR)
-    photo_paths = [str(path) for path in Path(PHOTOS_DIR).glob("*")]
+    photo_paths = [str(path) for path in Path(PHOTOS_DIR).glob("*") if path.is_file()]
+    check_photo_names(photo_paths)
+    manifest = load_manifest(PLAYING_CARDS_DIR)
+    remove_deleted_photos(PHOTOS_DIR, PLAYING_CARDS_DIR, manifest)
+    # only process photos that changed since their card and mask were saved
+    photo_paths = [
+        photo_path
+        for photo_path in photo_paths
+        if not is_processed_photo_valid(photo_path, PLAYING_CARDS_DIR, manifest)
+    ]
     print(f"Processing {len(photo_paths)} input photos...")
-    for photo_path in tqdm(photo_paths):
-        photo = cv.imread(photo_path)
-        card = crop_image(photo)
-        save_image(photo_path, PLAYING_CARDS_DIR, card)
+    output_folders = [PLAYING_CARDS_DIR] * len(photo_paths)
+    if (workers > 1) and (len(photo_paths) > 1):
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            processed_photos = list(
+                tqdm(
+                    executor.map(process_photo, photo_paths, output_folders),
+                    total=len(photo_paths),
+                )
+            )
+    else:
+        processed_photos = list(map(process_photo, tqdm(photo_paths), output_folders))
+    manifest.update(processed_photos)
+    save_manifest(PLAYING_CARDS_DIR, manifest)
     print(f'Finished processing. Playing cards saved at: "{PLAYING_CARDS_DIR}"!')
     return PLAYING_CARDS_DIR
@@ -0,0 +1,86 @@
+"""
+This file contains the preview renderer, which draws the detected cards for the user interface.
+Sending full-resolution frames to the browser costs more than some of the inference backends, so the preview is
+rendered at a limited frame rate, on a downscaled copy of the frame, and sent as JPEG. The boxes are drawn on the
+downscaled copy only. Frames in between are not rendered, their scores are still published (see detection_engine.py).
+"""
+
+import time
+import cv2 as cv
+import numpy as np
+from ultralytics.utils.plotting import Annotator
+from typing import Dict, Optional
+
+# colors of the bounding boxes drawn on the frames
+COLOR_LIST = [
+    (87, 139, 46),
+    (128, 0, 0),
+    (226, 43, 138),
+    (143, 143, 188),
+    (30, 105, 210),
+    (222, 196, 176),
+]
+
+
+class PreviewRenderer:
+    """
+    Renders the detections of at most max_fps frames per second as JPEG, no larger than max_size pixels.
+    """
+
+    def __init__(
+        self, max_fps: float = 10.0, max_size: int = 640, jpeg_quality: int = 75
+    ) -> None:
+        self.max_fps = max_fps
+        self.max_size = max_size
+        self.jpeg_quality = jpeg_quality
+        self.last_render_time = None
+        self.number_of_rendered_frames = 0
+        self.number_of_skipped_frames = 0
+
+    def should_render(self) -> bool:
+        """
+        Return a bool that indicates if the next frame is rendered, keeping the frame rate below max_fps.
+        """
+        now = time.perf_counter()
+        if (self.last_render_time is not None) and (
+            now - self.last_render_time < 1 / self.max_fps
+        ):
+            self.number_of_skipped_frames += 1
+            return False
+        self.last_render_time = now
+        return True
+
+    def render(self, image, detections, names: Dict[int, str]) -> bytes:
+        """
+        Return the image with the detected cards drawn on it, downscaled and encoded as JPEG.
+        """
+        scale = min(self.max_size / max(image.shape[:2]), 1.0)
+        if scale < 1.0:
+            image = cv.resize(
+                image,
+                (round(image.shape[1] * scale), round(image.shape[0] * scale)),
+                interpolation=cv.INTER_AREA,
+            )
+        annotator = Annotator(np.ascontiguousarray(image))
+        for i, (box, confidence, card_class) in enumerate(
+            zip(detections.boxes, detections.confidences, detections.card_classes)
+        ):
+            annotator.box_label(
+                box * scale,
+                f"{names[int(card_class)]} {round(float(confidence), 2)}",
+                COLOR_LIST[i % len(COLOR_LIST)],
+            )
+        self.number_of_rendered_frames += 1
+        return cv.imencode(
+            ".jpg", annotator.im, [cv.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+        )[1].tobytes()
+
+    def render_if_due(
+        self, image, detections, names: Dict[int, str]
+    ) -> Optional[bytes]:
+        """
+        Return the rendered preview, or None if the frame is skipped to keep the frame rate.
+        """
+        if not self.should_render():
+            return None
+        return self.render(image, detections, names)
@@ -0,0 +1,137 @@
+"""
+This file contains the sprite atlas, an optional way to speed up the placement of cards for very large datasets.
+Instead of warping every card with its own continuous size and rotation, every card is rendered once for a
+grid of sizes and rotations. The sprites are cut to the bounding box of their mask (tight bounding boxes) and
+packed into one flat buffer, which is saved as a memory-mapped file (shared by the processes of the generation
+pool) or kept in memory. Placing a card then only needs a lookup of the sprite with the nearest size and
+rotation, brightness and contrast are still changed for every placed card (see composite_sprite).
+"""
+
+import cv2 as cv
+import os
+import tempfile
+import numpy as np
+import card_compositing as cc
+from tqdm import tqdm
+from typing import List
+
+
+class SpriteAtlas:
+    """
+    Pre-rendered BGRA sprites of all playing cards for a grid of sizes and rotations.
+    """
+
+    def __init__(
+        self,
+        cards: List,
+        card_masks: List,
+        card_names: List[str],
+        image_height: int,
+        min_size: float,
+        max_size: float,
+        number_of_sizes: int = 6,
+        number_of_rotations: int = 24,
+        in_memory: bool = False,
+    ) -> None:
+        self.card_indices = dict((name, i) for i, name in enumerate(card_names))
+        self.sizes = np.linspace(min_size, max_size, number_of_sizes)
+        self.rotation_step = 360 / number_of_rotations
+        self.number_of_rotations = number_of_rotations
+        # offset in the buffer, height and width of every sprite
+        self.sprite_table = np.zeros(
+            (len(cards), number_of_sizes, number_of_rotations, 3), dtype=np.int64
+        )
+        file_descriptor, self.atlas_path = tempfile.mkstemp(
+            prefix="sprite_atlas_", suffix=".bin"
+        )
+        print(f"Rendering {self.sprite_table[..., 0].size} card sprites...")
+        offset = 0
+        with os.fdopen(file_descriptor, "wb") as file:
+            for card_index, (card, card_mask) in enumerate(
+                zip(tqdm(cards), card_masks)
+            ):
+                card_bgra = cc.to_bgra(card, card_mask)
+                for size_index, size in enumerate(self.sizes):
+                    for rotation_index in range(number_of_rotations):
+                        sprite = render_tight_sprite(
+                            card_bgra,
+                            size,
+                            rotation_index * self.rotation_step,
+                            image_height,
+                        )
+                        height, width = sprite.shape[:2]
+                        self.sprite_table[card_index, size_index, rotation_index] = (
+                            offset,
+                            height,
+                            width,
+                        )
+                        file.write(sprite.tobytes())
+                        offset += sprite.nbytes
+        self.nbytes = offset
+        if in_memory:
+            self.pixels = np.fromfile(self.atlas_path, dtype=np.uint8)
+            os.remove(self.atlas_path)
+            self.atlas_path = None
+        else:
+            self._open_pixels()
+
+    def _open_pixels(self) -> None:
+        self.pixels = np.memmap(self.atlas_path, dtype=np.uint8, mode="r")
+
+    def __getstate__(self) -> dict:
+        # other processes open their own memory map, only an atlas in memory is copied
+        state = self.__dict__.copy()
+        if self.atlas_path is not None:
+            state.pop("pixels")
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        if self.atlas_path is not None:
+            self._open_pixels()
+
+    def get_sprite(self, card_index: int, size: float, rotation: float):
+        """
+        Return the BGRA sprite of the card with the size and rotation closest to the given ones.
+        """
+        if len(self.sizes) > 1:
+            size_index = np.abs(self.sizes - size).argmin()
+        else:
+            size_index = 0
+        rotation_index = round(rotation / self.rotation_step) % self.number_of_rotations
+        offset, height, width = self.sprite_table[
+            card_index, size_index, rotation_index
+        ]
+        return self.pixels[offset : offset + height * width * 4].reshape(
+            height, width, 4
+        )
+
+    def close(self) -> None:
+        """
+        Remove the atlas from the disk.
+        """
+        self.pixels = None
+        if self.atlas_path is not None:
+            os.remove(self.atlas_path)
+            self.atlas_path = None
+
+
+def render_tight_sprite(card_bgra, size: float, rotation: float, image_height: int):
+    """
+    Return the BGRA sprite of the whole transformed card, cut to the bounding box of its mask.
+    """
+    transformation, sprite_size = cc.get_card_transformation(
+        card_bgra.shape, size, rotation, image_height
+    )
+    sprite = cv.warpAffine(
+        card_bgra,
+        transformation[:2],
+        sprite_size,
+        flags=cv.INTER_LINEAR,
+        borderMode=cv.BORDER_CONSTANT,
+        borderValue=0,
+    )
+    x, y, width, height = cv.boundingRect(cv.extractChannel(sprite, 3))
+    if (width == 0) or (height == 0):
+        return sprite
+    return np.ascontiguousarray(sprite[y : y + height, x : x + width])
@@ -0,0 +1,102 @@
+"""
+This file contains a dataset that generates the synthetic images on demand, instead of saving them to disk first.
+The images are generated in the same way as by generate_dataset in dataset_generation_functions.py, image i
+of epoch 0 is the same image that generate_dataset saves. Every other epoch generates new images, so a model
+can be trained on fresh synthetic images in every epoch without encoding and decoding JPEGs.
+The dataset can be used directly with a torch DataLoader (together with collate_samples), writing the images
+to disk stays a separate step done by generate_dataset.
+"""
+
+import numpy as np
+import dataset_generation_functions as dgf
+import photo_preparation_functions as ppf
+from asset_store import AssetStore
+from typing import Tuple, List, Iterator
+
+
+class SyntheticCardDataset:
+    """
+    Map-style dataset of synthetic images. Every item is a tuple of image, bounding boxes and card classes.
+    """
+
+    def __init__(
+        self,
+        BACKGROUNDS_DIR: str,
+        PHOTOS_DIR: str,
+        number_of_images: int,
+        max_number_of_cards_per_image: int,
+        min_size: float,
+        max_size: float,
+        overlapping: bool,
+        seed: int,
+        epoch: int = 0,
+    ) -> None:
+        PLAYING_CARDS_DIR = ppf.process_photos(PHOTOS_DIR)
+        self.card_names = dgf.get_card_names(PLAYING_CARDS_DIR)
+        self.number_of_images = number_of_images
+        self.epoch = epoch
+        self.generation_config = {
+            "assets": AssetStore(BACKGROUNDS_DIR, PLAYING_CARDS_DIR),
+            "name_to_int_dict": dict(
+                (name, i) for i, name in enumerate(self.card_names)
+            ),
+            "max_number_of_cards_per_image": max_number_of_cards_per_image,
+            "min_size": min_size,
+            "max_size": max_size,
+            "overlapping": overlapping,
+            "seed": seed,
+        }
+
+    def __len__(self) -> int:
+        return self.number_of_images
+
+    def __getitem__(self, image_index: int) -> Tuple:
+        """
+        Return a tuple containing the image, the normalized bounding boxes (center x, center y, width, height)
+        of the cards as N x 4 array and their classes as array of length N.
+        """
+        if not 0 <= image_index < self.number_of_images:
+            raise IndexError(f"Image index {image_index} is out of range.")
+        image, bounding_boxes, card_classes, _ = dgf.generate_sample(
+            self.generation_config, image_index, self.epoch
+        )
+        return image, bounding_boxes, card_classes
+
+    def get_batch(self, image_indices: List[int]) -> Tuple:
+        """
+        Return a tuple containing the images as (B, H, W, 3) array and their labels as (M, 6) array, like collate_samples.
+        The sprites of all cards are composited onto the whole batch at once.
+        """
+        images, labels, _ = dgf.generate_batch(
+            self.generation_config, image_indices, self.epoch
+        )
+        return images, labels
+
+    def __iter__(self) -> Iterator[Tuple]:
+        for image_index in range(self.number_of_images):
+            yield self[image_index]
+
+    def set_epoch(self, epoch: int) -> None:
+        """
+        Generate the images of another epoch from now on.
+        """
+        self.epoch = epoch
+
+    def close(self) -> None:
+        """
+        Remove the preloaded backgrounds from the disk.
+        """
+        self.generation_config["assets"].close()
+
+
+def collate_samples(samples: List[Tuple]) -> Tuple:
+    """
+    Combine samples to a batch. Returns a tuple containing the images as (B, H, W, 3) array and the labels of all
+    images as (M, 6) array, every row containing image index in the batch, class, x, y, width and height.
+    """
+    images = np.stack([image for image, _, _ in samples])
+    labels = [
+        np.column_stack((np.full(len(card_classes), i), card_classes, bounding_boxes))
+        for i, (_, bounding_boxes, card_classes) in enumerate(samples)
+    ]
+    return images, np.concatenate(labels).reshape(-1, 6)
@@ -0,0 +1,124 @@
+"""
+This file contains the region of interest (ROI) of the table, to run the card detection on a part of the frame only.
+The cards are only ever played in one region of the table, so the frame can be cropped to this region before the
+inference. The region is either set once (relative to the frame size) or inferred from the detections of the last
+inferences, with a margin around them and the full frame from time to time, to find cards outside of the region.
+The inference resolution is adapted as well: it is decreased while the detections are confident and increased again
+as soon as the confidence drops or cards are lost, so the model runs on the smallest input that still detects the cards.
+Exported models with a fixed input size (ONNX, OpenVINO) need a single image size (see model_export.py).
+"""
+
+import numpy as np
+from collections import deque
+from typing import Sequence, Tuple
+
+
+class TableRoi:
+    """
+    Region of the frame and input size of the model for the next inference, adapted to the detections.
+    """
+
+    def __init__(
+        self,
+        roi: Tuple[float, float, float, float] = None,
+        margin: float = 0.25,
+        number_of_inferences: int = 30,
+        full_frame_interval: int = 30,
+        image_sizes: Sequence[int] = (320, 416, 512, 640),
+        confidence_target: float = 0.8,
+        patience: int = 10,
+    ) -> None:
+        # set region as (x_min, y_min, x_max, y_max) relative to the frame size, None to infer it from the detections
+        self.roi = roi
+        self.margin = margin
+        self.full_frame_interval = full_frame_interval
+        self.image_sizes = sorted(image_sizes)
+        self.confidence_target = confidence_target
+        self.patience = patience
+        # boxes of the last inferences in full-frame coordinates, with width and height of their frame
+        self.recent_boxes = deque(maxlen=number_of_inferences)
+        self.size_index = len(self.image_sizes) - 1
+        self.confident_inferences_in_row = 0
+        self.number_of_inferences = 0
+
+    def get_region(
+        self, image_shape: Tuple[int, ...], relative_region: Tuple = None
+    ) -> Tuple[int, int, int, int]:
+        """
+        Return the region of the frame to run the inference on, as (x_min, y_min, x_max, y_max) in pixels.
+        A region relative to the frame size (see get_relative_region) is converted to pixels instead.
+        """
+        height, width = image_shape[:2]
+        if relative_region is None:
+            relative_region = self.roi
+        if relative_region is not None:
+            x_min, y_min, x_max, y_max = relative_region
+            return (
+                int(x_min * width),
+                int(y_min * height),
+                int(np.ceil(x_max * width)),
+                int(np.ceil(y_max * height)),
+            )
+        boxes = [
+            # boxes of frames decoded at another size are scaled to this frame
+            boxes * np.array([width, height] * 2) / np.array(frame_size * 2)
+            for boxes, frame_size in self.recent_boxes
+            if len(boxes)
+        ]
+        if (not boxes) or (self.number_of_inferences % self.full_frame_interval == 0):
+            return 0, 0, width, height
+        boxes = np.concatenate(boxes)
+        x_min, y_min = boxes[:, :2].min(axis=0)
+        x_max, y_max = boxes[:, 2:].max(axis=0)
+        margin = self.margin * max(x_max - x_min, y_max - y_min)
+        return (
+            max(int(x_min - margin), 0),
+            max(int(y_min - margin), 0),
+            min(int(np.ceil(x_max + margin)), width),
+            min(int(np.ceil(y_max + margin)), height),
+        )
+
+    def get_relative_region(self) -> Tuple[float, float, float, float]:
+        """
+        Return the region of the next inference relative to the frame size, e.g. to decode the frame at a scale that
+        keeps the region as large as the input of the model.
+        """
+        if (self.roi is not None) or (not self.recent_boxes):
+            return self.roi or (0.0, 0.0, 1.0, 1.0)
+        width, height = self.recent_boxes[-1][1]
+        x_min, y_min, x_max, y_max = self.get_region((height, width))
+        return x_min / width, y_min / height, x_max / width, y_max / height
+
+    def get_image_size(self, crop_shape: Tuple[int, ...]) -> int:
+        """
+        Return the input size of the model for a crop, never larger than needed to keep the resolution of the crop.
+        """
+        image_size = self.image_sizes[self.size_index]
+        for size in self.image_sizes:
+            if size >= max(crop_shape[:2]):
+                return min(size, image_size)
+        return image_size
+
+    def update(self, boxes, confidences, image_shape: Tuple[int, ...]) -> None:
+        """
+        Register the detections of an inference, boxes in full-frame coordinates of a frame with the given shape, and
+        adapt the input size of the model.
+        """
+        lost_cards = bool(self.recent_boxes) and (
+            len(boxes) < len(self.recent_boxes[-1][0])
+        )
+        self.number_of_inferences += 1
+        height, width = image_shape[:2]
+        self.recent_boxes.append((np.asarray(boxes).reshape(-1, 4), (width, height)))
+        if len(boxes) == 0:
+            if lost_cards:
+                self.size_index = len(self.image_sizes) - 1
+            return
+        if lost_cards or (np.mean(confidences) < self.confidence_target):
+            self.size_index = min(self.size_index + 1, len(self.image_sizes) - 1)
+            self.confident_inferences_in_row = 0
+            return
+        self.confident_inferences_in_row += 1
+        if self.confident_inferences_in_row >= self.patience:
+            self.size_index = max(self.size_index - 1, 0)
+            self.confident_inferences_in_row = 0